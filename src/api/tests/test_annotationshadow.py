@@ -2,9 +2,14 @@
 Tests for annotationshadow tables, testing the trigger functionality,
 and that they are populated correctly.
 """
+import copy
+
 import pytest
 
+from datalayer.allelefilter.frequencyfilter import FrequencyFilter
 from vardb.datamodel import annotationshadow
+from vardb.datamodel.annotationshadow_rebuild import CHUNK_TABLE, ShadowTableRebuild
+from vardb.util.db import DB
 from conftest import mock_allele_with_annotation
 
 
@@ -206,3 +211,216 @@ def test_annotationshadowcreate(session):
     )
 
     assert len(ast3) == 0
+
+
+def test_annotationshadow_bulk_insert(session):
+    def get_annotations():
+        return [
+            {
+                "frequencies": {"ExAC": {"freq": {"G": 0.0051}, "num": {"G": 9000}}},
+                "transcripts": [
+                    {
+                        "symbol": "GENE1AD",
+                        "transcript": "NM_1.1",
+                        "HGVSc": "c.123A>G",
+                        "protein": "NP_SOMETHING",
+                        "HGVSp": "p.Arg123Gly",
+                        "consequences": ["intron_variant", "splice_region_variant"],
+                        "exon_distance": 0,
+                    }
+                ],
+            },
+            {
+                "transcripts": [
+                    {"symbol": "GENE2", "transcript": "NM_2.1", "hgnc_id": 2},
+                    {"transcript": "NM_1.1", "coding_region_distance": -10},
+                ]
+            },
+            {"transcripts": []},
+        ]
+
+    def get_shadow_rows(allele_id):
+        transcripts = session.execute(
+            "SELECT hgnc_id, symbol, transcript, hgvsc, protein, hgvsp, consequences, "
+            "exon_distance, coding_region_distance FROM annotationshadowtranscript "
+            "WHERE allele_id = :allele_id ORDER BY id",
+            {"allele_id": allele_id},
+        ).fetchall()
+        frequencies = session.execute(
+            "SELECT * FROM annotationshadowfrequency WHERE allele_id = :allele_id",
+            {"allele_id": allele_id},
+        ).fetchall()
+        return [tuple(t) for t in transcripts], [tuple(f)[2:] for f in frequencies]
+
+    # Inserted using trigger
+    trigger_allele_ids = [
+        mock_allele_with_annotation(session, annotations=a)[0].id for a in get_annotations()
+    ]
+
+    # Inserted with trigger skipped, shadow tables updated in bulk
+    with annotationshadow.skip_annotationshadow_trigger(session):
+        bulk = [mock_allele_with_annotation(session, annotations=a) for a in get_annotations()]
+        bulk_allele_ids = [al.id for al, _ in bulk]
+        for allele_id in bulk_allele_ids:
+            assert get_shadow_rows(allele_id) == ([], [])
+        annotationshadow.insert_annotationshadow_bulk(session, [an.id for _, an in bulk])
+
+    for trigger_allele_id, bulk_allele_id in zip(trigger_allele_ids, bulk_allele_ids):
+        assert get_shadow_rows(trigger_allele_id) == get_shadow_rows(bulk_allele_id)
+
+    assert annotationshadow.check_annotationshadow_consistency(session, GLOBAL_CONFIG) == []
+
+    # Trigger is used again outside context
+    al, _ = mock_allele_with_annotation(session, annotations=get_annotations()[0])
+    assert get_shadow_rows(al.id) == get_shadow_rows(trigger_allele_ids[0])
+
+    # Consistency check picks up missing, extra and modified rows
+    session.execute(
+        "DELETE FROM annotationshadowtranscript WHERE allele_id = :allele_id",
+        {"allele_id": bulk_allele_ids[0]},
+    )
+    session.execute(
+        "INSERT INTO annotationshadowtranscript (allele_id, transcript) VALUES (:allele_id, 'NM_3.1')",
+        {"allele_id": bulk_allele_ids[2]},
+    )
+    session.execute(
+        'UPDATE annotationshadowfrequency SET "ExAC.G" = 0.1 WHERE allele_id = :allele_id',
+        {"allele_id": trigger_allele_ids[0]},
+    )
+    assert annotationshadow.check_annotationshadow_consistency(session, GLOBAL_CONFIG) == sorted(
+        [bulk_allele_ids[0], bulk_allele_ids[2], trigger_allele_ids[0]]
+    )
+    assert annotationshadow.check_annotationshadow_consistency(
+        session, GLOBAL_CONFIG, allele_ids=trigger_allele_ids
+    ) == [trigger_allele_ids[0]]
+
+
+def test_annotationshadow_online_rebuild(session):
+    new_config = {
+        "frequencies": {
+            "groups": {
+                "external": {"ExAC": ["G", "FIN", "SAS"], "GNOMAD_GENOMES": ["G"]},
+                "internal": {"inDB": ["AF"]},
+            }
+        }
+    }
+
+    class Interrupted(Exception):
+        pass
+
+    def interrupt():
+        raise Interrupted()
+
+    rebuild = ShadowTableRebuild(session, new_config, chunk_size=100, workers=2)
+    rebuild.prepare()
+    assert ShadowTableRebuild.in_progress(session)
+
+    # Interrupted after the first chunk
+    with pytest.raises(Interrupted):
+        rebuild._fill_chunks(session, interrupt)
+
+    # Annotations inserted during the rebuild are captured by the change log
+    al, _ = mock_allele_with_annotation(
+        session,
+        annotations={
+            "frequencies": {"GNOMAD_GENOMES": {"freq": {"G": 0.1}}},
+            "transcripts": [{"transcript": "NM_5.1"}],
+        },
+    )
+    session.commit()
+
+    # A rebuild for another config can't be started while one is in progress
+    with pytest.raises(RuntimeError):
+        ShadowTableRebuild(session, GLOBAL_CONFIG).prepare()
+
+    # Resume
+    messages = []
+    ShadowTableRebuild(
+        session, new_config, chunk_size=100, workers=2, progress=messages.append
+    ).run()
+    assert "Resuming shadow table rebuild" in messages
+    assert not ShadowTableRebuild.in_progress(session)
+
+    annotationshadow.check_db_consistency(session, new_config)
+    assert annotationshadow.check_annotationshadow_consistency(session, new_config) == []
+    asf = (
+        session.query(annotationshadow.AnnotationShadowFrequency)
+        .filter(annotationshadow.AnnotationShadowFrequency.allele_id == al.id)
+        .one()
+    )
+    assert getattr(asf, "GNOMAD_GENOMES.G") == 0.1
+    ast = (
+        session.query(annotationshadow.AnnotationShadowTranscript)
+        .filter(annotationshadow.AnnotationShadowTranscript.allele_id == al.id)
+        .one()
+    )
+    assert ast.transcript == "NM_5.1"
+
+    # Triggers use the new tables
+    al, _ = mock_allele_with_annotation(
+        session, annotations={"frequencies": {"GNOMAD_GENOMES": {"freq": {"G": 0.2}}}}
+    )
+    assert (
+        annotationshadow.check_annotationshadow_consistency(session, new_config, allele_ids=[al.id])
+        == []
+    )
+
+    # Abort
+    ShadowTableRebuild(session, GLOBAL_CONFIG).prepare()
+    ShadowTableRebuild.abort(session)
+    assert not ShadowTableRebuild.in_progress(session)
+    assert session.execute("SELECT to_regclass('tmp_annotationshadowtranscript')").scalar() is None
+
+
+def test_annotationshadow_online_rebuild_concurrent(session):
+    # Second process running the same rebuild
+    other_db = DB()
+    other_db.connect()
+    other_session = other_db.session()
+
+    messages = []
+    rebuild = ShadowTableRebuild(session, GLOBAL_CONFIG, chunk_size=100, progress=messages.append)
+    other_rebuild = ShadowTableRebuild(other_session, GLOBAL_CONFIG, chunk_size=100)
+    try:
+        rebuild.prepare()
+        other_rebuild.prepare()
+
+        # A chunk claimed by the other process is not filled yet, so the rebuild is left to it
+        other_session.execute(
+            "SELECT id FROM {} WHERE NOT done ORDER BY id LIMIT 1 FOR UPDATE".format(CHUNK_TABLE)
+        )
+        rebuild.fill()
+        assert rebuild.finalize() is False
+        assert ShadowTableRebuild.in_progress(session)
+
+        # Both processes see all chunks filled, but only one replaces the shadow tables
+        other_rebuild.fill()
+        assert other_rebuild.finalize() is True
+        assert rebuild.finalize() is True
+        other_rebuild.swap()
+        assert not ShadowTableRebuild.in_progress(session)
+
+        rebuild.swap()
+        assert "Shadow table rebuild was completed by another process" in messages
+        assert rebuild.finalize() is False
+
+        annotationshadow.check_db_consistency(session, GLOBAL_CONFIG)
+        assert annotationshadow.check_annotationshadow_consistency(session, GLOBAL_CONFIG) == []
+    finally:
+        other_session.close()
+        other_db.disconnect()
+
+
+def test_annotationshadow_online_rebuild_running_config(session):
+    # Processes still running with the old config keep working when frequency groups are added
+    added_config = copy.deepcopy(GLOBAL_CONFIG)
+    added_config["frequencies"]["groups"]["external"]["GNOMAD_GENOMES"] = ["G"]
+    ShadowTableRebuild(session, added_config, chunk_size=100).run()
+    FrequencyFilter(session, GLOBAL_CONFIG)
+
+    # ...but not when they are removed
+    removed_config = copy.deepcopy(GLOBAL_CONFIG)
+    del removed_config["frequencies"]["groups"]["external"]["esp6500"]
+    ShadowTableRebuild(session, removed_config, chunk_size=100).run()
+    with pytest.raises(AssertionError):
+        FrequencyFilter(session, GLOBAL_CONFIG)
@@ -0,0 +1,136 @@
+import datetime
+import gzip
+
+import pytz
+
+from vardb.datamodel import allele, assessment
+from api.v1.resources.igv import ClassificationBedCache
+
+
+def test_classification_bed_cache(session):
+    cache = ClassificationBedCache()
+    data, etag = cache.get(session)
+    n_current = (
+        session.query(assessment.AlleleAssessment)
+        .filter(assessment.AlleleAssessment.date_superceeded.is_(None))
+        .count()
+    )
+    assert len(data.decode().split("\n")) == n_current + 1  # Header
+
+    # Unchanged data gives same result
+    assert cache.get(session) == (data, etag)
+    gzip_data, gzip_etag = cache.get(session, gzipped=True)
+    assert gzip.decompress(gzip_data) == data
+    assert gzip_etag != etag
+
+    # Supercede an assessment with a new one, and add an assessment for a new allele
+    existing = (
+        session.query(assessment.AlleleAssessment)
+        .filter(assessment.AlleleAssessment.date_superceeded.is_(None))
+        .first()
+    )
+    existing.date_superceeded = datetime.datetime.now(pytz.utc)
+    new_allele = (
+        session.query(allele.Allele)
+        .filter(
+            ~allele.Allele.id.in_(
+                session.query(assessment.AlleleAssessment.allele_id).filter(
+                    assessment.AlleleAssessment.date_superceeded.is_(None)
+                )
+            )
+        )
+        .first()
+    )
+    for allele_id, classification in [(existing.allele_id, "5"), (new_allele.id, "4")]:
+        session.add(
+            assessment.AlleleAssessment(
+                user_id=1,
+                allele_id=allele_id,
+                classification=classification,
+                evaluation={},
+                genepanel_name=existing.genepanel_name,
+                genepanel_version=existing.genepanel_version,
+            )
+        )
+    session.flush()
+
+    updated_data, updated_etag = cache.get(session)
+    assert updated_etag != etag
+    assert len(updated_data.decode().split("\n")) == n_current + 2
+    assert "Name=5;" in updated_data.decode().split("\n")[-2]
+    assert "Name=4;" in updated_data.decode().split("\n")[-1]
+
+    # Incremental update gives the same result as building from scratch
+    assert ClassificationBedCache().get(session) == (updated_data, updated_etag)
+
+
+def test_classification_bed_cache_out_of_order_commit(session):
+    existing = (
+        session.query(assessment.AlleleAssessment)
+        .filter(assessment.AlleleAssessment.date_superceeded.is_(None))
+        .order_by(assessment.AlleleAssessment.id)
+        .first()
+    )
+    new_allele = (
+        session.query(allele.Allele)
+        .filter(
+            ~allele.Allele.id.in_(
+                session.query(assessment.AlleleAssessment.allele_id).filter(
+                    assessment.AlleleAssessment.date_superceeded.is_(None)
+                )
+            )
+        )
+        .first()
+    )
+
+    def add_assessment(allele_id, classification, date_superceeded=None):
+        aa = assessment.AlleleAssessment(
+            user_id=1,
+            allele_id=allele_id,
+            classification=classification,
+            evaluation={},
+            genepanel_name=existing.genepanel_name,
+            genepanel_version=existing.genepanel_version,
+            date_superceeded=date_superceeded,
+        )
+        session.add(aa)
+        session.flush()
+        return aa
+
+    # Transaction A gets the lower id, but commits after transaction B.
+    # Until then, A's row is not current.
+    late = add_assessment(existing.allele_id, "5", datetime.datetime.now(pytz.utc))
+    add_assessment(new_allele.id, "4")
+
+    cache = ClassificationBedCache()
+    data, etag = cache.get(session)
+
+    # A commits, superceding an existing assessment: the number of current assessments
+    # and the max id are unchanged
+    existing.date_superceeded = datetime.datetime.now(pytz.utc)
+    session.flush()
+    late.date_superceeded = None
+    session.flush()
+
+    updated_data, updated_etag = cache.get(session)
+    assert updated_etag != etag
+    assert ClassificationBedCache().get(session) == (updated_data, updated_etag)
+
+
+def test_classification_resource(client):
+    response = client.get("/api/v1/igv/classifications/")
+    assert response.status_code == 200
+    assert response.data.startswith(b'track name="Classifications"')
+    data, etag = response.data, response.get_etag()[0]
+
+    response = client.get("/api/v1/igv/classifications/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    response = client.get("/api/v1/igv/classifications/", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.data) == data
+
+    response = client.get("/api/v1/igv/classifications/", headers={"Range": "bytes=0-4"})
+    assert response.status_code == 206
+    assert response.data == b"track"
@@ -148,6 +148,60 @@ class TestAnalysisOverview(object):
         assert len(r.get_json()["ongoing"]) == 0
         assert len(r.get_json()["not_ready"]) == 0
 
+    @pytest.mark.overviewanalysis(order=3)
+    def test_changes_since_version(self, client):
+
+        overview = client.get("/api/v1/overviews/analyses/").get_json()
+
+        # No previous version gives the full overview
+        r = client.get("/api/v1/overviews/analyses/?since_version=")
+        changes = r.get_json()
+        assert changes["full"] is True
+        version = changes["version"]
+        assert set(changes["categories"]) == set(overview)
+        for category, entries in overview.items():
+            assert changes["categories"][category]["ids"] == [e["id"] for e in entries]
+            assert changes["categories"][category]["changed"] == entries
+
+        # Malformed version gives the full overview
+        r = client.get("/api/v1/overviews/analyses/?since_version=abc")
+        assert r.status_code == 200
+        assert r.get_json()["full"] is True
+        assert r.get_json()["version"] == version
+
+        # Version of another overview (e.g. for another user group) gives the full overview
+        other_version = "{}:{}".format("0" * 40, version.split(":")[1])
+        r = client.get("/api/v1/overviews/analyses/?since_version={}".format(other_version))
+        assert r.get_json()["full"] is True
+        assert r.get_json()["version"] == version
+
+        # No changes
+        r = client.get("/api/v1/overviews/analyses/?since_version={}".format(version))
+        changes = r.get_json()
+        assert changes["full"] is False
+        assert changes["version"] == version
+        assert all(not c["changed"] for c in changes["categories"].values())
+
+        # Only the analysis with new priority is changed
+        analysis_id = overview["not_started"][0]["id"]
+        r = client.post(
+            "/api/v1/workflows/analyses/{}/logs/".format(analysis_id), data={"priority": 3}
+        )
+        assert r.status_code == 200
+
+        r = client.get("/api/v1/overviews/analyses/?since_version={}".format(version))
+        changes = r.get_json()
+        assert changes["full"] is False
+        assert changes["version"] != version
+        for category, entries in overview.items():
+            assert changes["categories"][category]["ids"] == [e["id"] for e in entries]
+            if category == "not_started":
+                changed = changes["categories"][category]["changed"]
+                assert [c["id"] for c in changed] == [analysis_id]
+                assert changed[0]["priority"] == 3
+            else:
+                assert changes["categories"][category]["changed"] == []
+
 
 class TestAlleleOverview(object):
     @pytest.mark.overviewallele(order=0)
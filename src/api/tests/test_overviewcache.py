@@ -0,0 +1,108 @@
+import datetime
+
+import pytz
+
+from api.util.overviewcache import OverviewCache
+from vardb.datamodel import annotation, sample, workflow
+from vardb.util.db import DB
+
+
+def test_overview_cache_concurrent_commit(session):
+    other_db = DB()
+    other_db.connect()
+    other_session = other_db.session()
+
+    analysis = other_session.query(sample.Analysis).order_by(sample.Analysis.id).first()
+    warnings = analysis.warnings
+
+    def create():
+        return {"not_started": [{"id": analysis.id}]}
+
+    def create_with_commit():
+        # Workflow change committed from another session while the overview is created
+        analysis.warnings = "Changed while creating overview"
+        other_session.commit()
+        return create()
+
+    try:
+        cache = OverviewCache()
+        session.commit()
+
+        version, overview = cache.get(session, "analyses", create_with_commit)
+        assert version is None
+        assert overview == create()
+        assert (cache.hits, cache.misses) == (0, 1)
+
+        # Overview was not cached, so it's created again
+        session.commit()
+        version, _ = cache.get(session, "analyses", create)
+        assert version is not None
+        assert (cache.hits, cache.misses) == (0, 2)
+
+        session.commit()
+        assert cache.get(session, "analyses", create)[0] == version
+        assert (cache.hits, cache.misses) == (1, 2)
+    finally:
+        analysis.warnings = warnings
+        other_session.commit()
+        other_session.close()
+        other_db.disconnect()
+
+
+def test_workflow_version_triggers(session):
+    def version():
+        session.commit()
+        return OverviewCache.data_version(session)[1]
+
+    interpretation = (
+        session.query(workflow.AlleleInterpretation)
+        .order_by(workflow.AlleleInterpretation.id)
+        .first()
+    )
+    current_annotation = (
+        session.query(annotation.Annotation)
+        .filter(annotation.Annotation.date_superceeded.is_(None))
+        .order_by(annotation.Annotation.id)
+        .first()
+    )
+    state, date_last_update = interpretation.state, interpretation.date_last_update
+
+    try:
+        start_version = version()
+
+        # Interpretation state is not shown in the overviews
+        interpretation.state = dict(state, overview_test=True)
+        assert version() == start_version
+
+        # ...but the date of the last update is
+        interpretation.date_last_update = datetime.datetime.now(pytz.utc)
+        assert version() == start_version + 1
+
+        # Allele overviews include the current annotation
+        current_annotation.date_superceeded = datetime.datetime.now(pytz.utc)
+        assert version() == start_version + 2
+    finally:
+        interpretation.state = state
+        interpretation.date_last_update = date_last_update
+        current_annotation.date_superceeded = None
+        session.commit()
+
+
+def test_overview_cache_changes_other_key(session):
+    def create():
+        return {"not_started": [{"id": 1}]}
+
+    def entry_id(e):
+        return e["id"]
+
+    cache = OverviewCache()
+    session.commit()
+
+    version = cache.changes(session, "analyses", create, entry_id)["version"]
+    other_version = cache.changes(session, "alleles", create, entry_id)["version"]
+    assert version != other_version
+
+    assert cache.changes(session, "analyses", create, entry_id, version)["full"] is False
+    # Version given for another key, e.g. after the user's group changed
+    assert cache.changes(session, "analyses", create, entry_id, other_version)["full"] is True
+    assert cache.changes(session, "analyses", create, entry_id, "1")["full"] is True
@@ -1,6 +1,6 @@
 from sqlalchemy import tuple_
 from datalayer import queries
-from vardb.datamodel import gene
+from vardb.datamodel import allele, gene, sample, workflow
 from conftest import mock_allele_with_annotation
 
 
@@ -193,3 +193,100 @@ def test_annotation_transcripts_genepanel(session, test_database):
     assert set(result) == set(passes)
 
     session.rollback()
+
+
+def test_workflow_by_status(session, test_database):
+
+    test_database.refresh()
+
+    def latest_interpretations(model, model_id_attr):
+        # Reference: latest interpretation computed from the interpretation history
+        latest = (
+            session.query(
+                getattr(model, model_id_attr), model.workflow_status, model.status, model.finalized
+            )
+            .order_by(getattr(model, model_id_attr), model.date_created.desc(), model.id.desc())
+            .distinct(getattr(model, model_id_attr))
+            .all()
+        )
+        return {a[0]: tuple(a[1:]) for a in latest}
+
+    def check_workflow_state(model, model_id_attr):
+        latest = latest_interpretations(model, model_id_attr)
+        for workflow_status, status, finalized in set(latest.values()):
+            expected = set(
+                k for k, v in latest.items() if v[0] == workflow_status and v[1] == status
+            )
+            assert (
+                set(
+                    queries.workflow_by_status(
+                        session,
+                        model,
+                        model_id_attr,
+                        workflow_status=workflow_status,
+                        status=status,
+                    ).scalar_all()
+                )
+                == expected
+            )
+        assert set(
+            queries.workflow_by_status(session, model, model_id_attr, finalized=True).scalar_all()
+        ) == set(k for k, v in latest.items() if v[2] is True)
+        assert set(
+            queries.workflow_by_status(session, model, model_id_attr, finalized=False).scalar_all()
+        ) == set(k for k, v in latest.items() if not v[2])
+
+    genepanel = session.query(gene.Genepanel).first()
+    for model, model_id_attr, id_model in [
+        (workflow.AnalysisInterpretation, "analysis_id", sample.Analysis),
+        (workflow.AlleleInterpretation, "allele_id", allele.Allele),
+    ]:
+        check_workflow_state(model, model_id_attr)
+
+        # Restart the workflow, finish the interpretation and start the next,
+        # the state tables are updated by triggers
+        model_id = session.query(id_model.id).order_by(id_model.id).first()[0]
+        session.query(model).filter(getattr(model, model_id_attr) == model_id).delete()
+        check_workflow_state(model, model_id_attr)
+
+        latest_interpretation = model(
+            genepanel_name=genepanel.name, genepanel_version=genepanel.version
+        )
+        setattr(latest_interpretation, model_id_attr, model_id)
+        session.add(latest_interpretation)
+        session.flush()
+        check_workflow_state(model, model_id_attr)
+        assert model_id in set(
+            queries.workflow_by_status(
+                session,
+                model,
+                model_id_attr,
+                workflow_status="Interpretation",
+                status="Not started",
+            ).scalar_all()
+        )
+
+        latest_interpretation.status = "Done"
+        latest_interpretation.finalized = True
+        session.flush()
+        check_workflow_state(model, model_id_attr)
+        assert model_id in set(
+            queries.workflow_by_status(session, model, model_id_attr, finalized=True).scalar_all()
+        )
+
+        next_interpretation = model.create_next(latest_interpretation)
+        next_interpretation.workflow_status = "Review"
+        session.add(next_interpretation)
+        session.flush()
+        check_workflow_state(model, model_id_attr)
+        assert model_id in set(
+            queries.workflow_by_status(
+                session, model, model_id_attr, workflow_status="Review", status="Not started"
+            ).scalar_all()
+        )
+
+        session.delete(next_interpretation)
+        session.flush()
+        check_workflow_state(model, model_id_attr)
+
+    session.rollback()
@@ -35,3 +35,15 @@ def test_search(client, query, expected_analysis_ids, expected_allele_ids):
 
     assert set(allele_ids) == set(expected_allele_ids)
     assert set(analysis_ids) == set(expected_analysis_ids)
+
+
+def test_search_options_gene(client):
+    # Substring match, with symbols starting with the query first
+    response = client.get("/api/v1/search/options/?q={}".format(json.dumps({"gene": "rca2"})))
+    assert {"symbol": "BRCA2", "hgnc_id": 1101} in response.json["gene"]
+
+    response = client.get("/api/v1/search/options/?q={}".format(json.dumps({"gene": "brca"})))
+    symbols = [g["symbol"] for g in response.json["gene"]]
+    assert symbols
+    is_prefix = [s.lower().startswith("brca") for s in symbols]
+    assert is_prefix == sorted(is_prefix, reverse=True)
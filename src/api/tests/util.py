@@ -53,11 +53,13 @@ class FlaskClientProxy(object):
                 "/api/v1/users/actions/logout/", data={}, content_type="application/json"
             )
 
-    def get(self, url, username="testuser1"):
+    def get(self, url, username="testuser1", headers=None):
         with self.app.test_client() as client:
             if username:
                 self.ensure_logged_in(client, username)
-            return client.get(self.url_prefix + url, content_type="application/json")
+            return client.get(
+                self.url_prefix + url, content_type="application/json", headers=headers
+            )
 
     def post(self, url, data, username="testuser1"):
         with self.app.test_client() as client:
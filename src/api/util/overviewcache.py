@@ -0,0 +1,174 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm.session import Session
+
+log = logging.getLogger(__name__)
+
+# {category: [entry, ...]}, e.g. {'not_started': [<analysis>, ...], 'ongoing': [...]}
+Overview = Dict[str, List[Dict[str, Any]]]
+
+
+class OverviewCache(object):
+    """
+    Process local cache of the workflow overviews, keyed on e.g. overview type and user group.
+
+    The overviews are versioned by workflowversion.version, which is incremented on commit of
+    every transaction changing the data shown in the overviews (see
+    create_workflow_version_triggers()). An overview is only computed once per version,
+    regardless of the number of users polling it.
+
+    The last overviews for every key are kept, so that changes since a previous version can be
+    given as a delta (see changes()).
+    """
+
+    def __init__(self, maxsize: int = 64, history: int = 16) -> None:
+        self.maxsize = maxsize
+        self.history = history
+        self.hits = 0
+        self.misses = 0
+        # {key: (database stamp, {version: overview})}
+        self._overviews: "OrderedDict[Hashable, Tuple[Tuple, OrderedDict[int, Overview]]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def data_version(session: Session) -> Optional[Tuple[Tuple, int]]:
+        """
+        Returns a stamp of the database (changes if it's recreated) and the current version.
+
+        Returns None if the current transaction has written data, as the version is
+        not incremented until commit.
+        """
+        row = session.execute(
+            text(
+                """
+                SELECT
+                    (SELECT oid FROM pg_database WHERE datname = current_database()),
+                    'workflowversion'::regclass::oid,
+                    txid_current_if_assigned(),
+                    version
+                FROM workflowversion
+                """
+            )
+        ).first()
+        database_oid, table_oid, txid, version = row
+        if txid is not None:
+            return None
+        return (str(session.get_bind().url), database_oid, table_oid), version
+
+    def get(
+        self, session: Session, key: Hashable, create: Callable[[], Overview]
+    ) -> Tuple[Optional[int], Overview]:
+        """
+        Returns the version and the overview given by create() for key, computing it only
+        if not already cached for the current version. The overview must not be modified.
+
+        The version is None if the overview could not be cached, i.e. if the current transaction
+        has written data, or if the version changed while creating the overview.
+        """
+        data_version = self.data_version(session)
+        if data_version is None:
+            return None, create()
+        stamp, version = data_version
+
+        with self._lock:
+            cached = self._overviews.get(key)
+            if cached is not None and cached[0] == stamp and version in cached[1]:
+                self._overviews.move_to_end(key)
+                self.hits += 1
+                return version, cached[1][version]
+            self.misses += 1
+
+        overview = create()
+
+        # A transaction committed while creating the overview can be included in it, so it can't
+        # be cached as the version read above (with READ COMMITTED, every statement in create()
+        # sees the latest committed data)
+        if self.data_version(session) != data_version:
+            log.debug("Overview for {} changed while created, not cached".format(key))
+            return None, overview
+
+        with self._lock:
+            cached = self._overviews.get(key)
+            if cached is None or cached[0] != stamp:
+                cached = (stamp, OrderedDict())
+                self._overviews[key] = cached
+            cached[1][version] = overview
+            while len(cached[1]) > self.history:
+                cached[1].popitem(last=False)
+            self._overviews.move_to_end(key)
+            while len(self._overviews) > self.maxsize:
+                self._overviews.popitem(last=False)
+
+        log.debug("Overview cache miss for {} at version {}".format(key, version))
+        return version, overview
+
+    def changes(
+        self,
+        session: Session,
+        key: Hashable,
+        create: Callable[[], Overview],
+        entry_id: Callable[[Dict[str, Any]], int],
+        since_version: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Returns the overview for key as changes since since_version:
+
+        {
+            'version': <opaque token of key and current version, to be given as since_version
+                        in the next call (None if the overview could not be cached)>,
+            'full': <True if the changes are the full overview>,
+            'categories': {
+                <category>: {
+                    'ids': [<ids of all entries in category, in order>],
+                    'changed': [<entries added to category, or changed, since since_version>]
+                },
+                ...
+            }
+        }
+
+        If since_version is not given, is malformed, was given for another key (e.g. before
+        the user's group changed) or is not among the cached versions, the full overview
+        is returned, i.e. all entries are given as changed. Entries are identified using entry_id.
+        """
+        version, overview = self.get(session, key, create)
+
+        key_digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        previous = None
+        if since_version is not None and version is not None:
+            since_digest, _, since_number = since_version.partition(":")
+            if since_digest == key_digest and since_number.isdigit():
+                with self._lock:
+                    cached = self._overviews.get(key)
+                    if cached is not None:
+                        previous = cached[1].get(int(since_number))
+
+        categories = dict()
+        for category, entries in overview.items():
+            if previous is not None:
+                previous_entries = {entry_id(e): e for e in previous.get(category, [])}
+                changed = [e for e in entries if previous_entries.get(entry_id(e)) != e]
+            else:
+                changed = list(entries)
+            categories[category] = {"ids": [entry_id(e) for e in entries], "changed": changed}
+
+        return {
+            "version": "{}:{}".format(key_digest, version) if version is not None else None,
+            "full": previous is None,
+            "categories": categories,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._overviews.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+overview_cache = OverviewCache()
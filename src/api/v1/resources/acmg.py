@@ -1,6 +1,6 @@
 from flask import request
 from vardb.datamodel import allele, gene
-from datalayer import ACMGDataLoader
+from datalayer import ACMGDataLoader, acmg_code_cache
 from api.util.util import request_json, authenticate
 from api.v1.resource import LogRequestResource
 
@@ -170,8 +170,8 @@ class ACMGAlleleResource(LogRequestResource):
         alleles = self.get_alleles(session, data["allele_ids"])
         genepanel = self.get_genepanel(session, data["gp_name"], data["gp_version"])
 
-        return ACMGDataLoader(session).from_objs(
-            alleles, data.get("referenceassessments"), genepanel, user_config["acmg"]
+        return acmg_code_cache.from_objs(
+            session, alleles, data.get("referenceassessments"), genepanel, user_config["acmg"]
         )
 
 
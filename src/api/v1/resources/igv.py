@@ -1,16 +1,21 @@
 import os
+import gzip
+import hashlib
 import mimetypes
 import json
 import logging
+import threading
 from io import BytesIO
+from typing import Dict
 
 from flask import request, Response, send_file
-from sqlalchemy import tuple_, func
+from sqlalchemy import Text, cast, func, literal, or_, tuple_
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 
 from api import ApiError
 from api.config import config
 
-from vardb.datamodel import sample, gene, allele, assessment, user as user_model
+from vardb.datamodel import sample, gene, allele, assessment, genotype, user as user_model
 
 from api.v1.resource import LogRequestResource
 from api.util.util import authenticate, logger
@@ -118,71 +123,99 @@ def transcripts_to_bed(transcripts):
     return data
 
 
-def get_classification_bed(session):
+CLASSIFICATION_BED_HEADER = (
+    'track name="Classifications" description="ella classifications" itemRgb="On"\n'
+)
+
+CLASSIFICATION_BED_TEMPLATE = (
+    "{chrom}\t"
+    "{start}\t"
+    "{end}\t"
+    "Name={name};"
+    "genome_reference={genome_reference};"
+    "chromosome={chrom};"
+    "vcf_pos={vcf_pos};"
+    "vcf_ref={vcf_ref};"
+    "vcf_alt={vcf_alt};"
+    "genepanel_name={genepanel_name};"
+    "genepanel_version={genepanel_version};"
+    "date_created={date_created}\t"
+    "1\t"
+    "-\t"
+    "{start}"
+    "\t{end}"
+    "\t{color}"
+)
+
+CLASSIFICATION_COLORS = {
+    "1": "#76B100",
+    "2": "#6BA100",
+    "3": "#FFAA3C",
+    "4": "#FE5B5B",
+    "5": "#D00000",
+}
 
-    result = 'track name="Classifications" description="ella classifications" itemRgb="On"\n'
-
-    template = (
-        "{chrom}\t"
-        "{start}\t"
-        "{end}\t"
-        "Name={name};"
-        "genome_reference={genome_reference};"
-        "chromosome={chrom};"
-        "vcf_pos={vcf_pos};"
-        "vcf_ref={vcf_ref};"
-        "vcf_alt={vcf_alt};"
-        "genepanel_name={genepanel_name};"
-        "genepanel_version={genepanel_version};"
-        "date_created={date_created}\t"
-        "1\t"
-        "-\t"
-        "{start}"
-        "\t{end}"
-        "\t{color}"
-    )
-    all_aa = (
-        session.query(
-            allele.Allele.chromosome,
-            allele.Allele.start_position,
-            allele.Allele.open_end_position,
-            assessment.AlleleAssessment.classification,
-            allele.Allele.genome_reference,
-            allele.Allele.vcf_pos,
-            allele.Allele.vcf_ref,
-            allele.Allele.vcf_alt,
-            assessment.AlleleAssessment.genepanel_name,
-            assessment.AlleleAssessment.genepanel_version,
-            assessment.AlleleAssessment.date_created,
-        )
-        .join(assessment.AlleleAssessment)
-        .filter(assessment.AlleleAssessment.date_superceeded.is_(None))
-        .all()
-    )
 
-    COLORS = {"1": "#76B100", "2": "#6BA100", "3": "#FFAA3C", "4": "#FE5B5B", "5": "#D00000"}
-
-    lines = []
-    for (
-        chrom,
-        start,
-        end,
-        classification,
-        genome_reference,
-        vcf_pos,
-        vcf_ref,
-        vcf_alt,
-        genepanel_name,
-        genepanel_version,
-        date_created,
-    ) in all_aa:
-        lines.append(
-            template.format(
+class ClassificationBedCache(object):
+    """
+    Keeps the classification BED track in memory, together with its gzipped version and ETag.
+
+    On every request, a cheap query checks whether the current alleleassessments have changed.
+    If so, only lines for new alleleassessments are queried and formatted, and lines for
+    superceded alleleassessments are removed.
+    """
+
+    def __init__(self):
+        self.lines: Dict[int, str] = dict()  # {alleleassessment id: bed line}
+        self.version = None
+        self.data = CLASSIFICATION_BED_HEADER.encode()
+        self.etag = hashlib.sha1(self.data).hexdigest()
+        self._gzip_data = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _format_lines(session, alleleassessment_ids=None):
+        query = (
+            session.query(
+                assessment.AlleleAssessment.id,
+                allele.Allele.chromosome,
+                allele.Allele.start_position,
+                allele.Allele.open_end_position,
+                assessment.AlleleAssessment.classification,
+                allele.Allele.genome_reference,
+                allele.Allele.vcf_pos,
+                allele.Allele.vcf_ref,
+                allele.Allele.vcf_alt,
+                assessment.AlleleAssessment.genepanel_name,
+                assessment.AlleleAssessment.genepanel_version,
+                assessment.AlleleAssessment.date_created,
+            )
+            .join(assessment.AlleleAssessment)
+            .filter(assessment.AlleleAssessment.date_superceeded.is_(None))
+        )
+        if alleleassessment_ids is not None:
+            query = query.filter(assessment.AlleleAssessment.id.in_(alleleassessment_ids))
+
+        for (
+            alleleassessment_id,
+            chrom,
+            start,
+            end,
+            classification,
+            genome_reference,
+            vcf_pos,
+            vcf_ref,
+            vcf_alt,
+            genepanel_name,
+            genepanel_version,
+            date_created,
+        ) in query:
+            yield alleleassessment_id, CLASSIFICATION_BED_TEMPLATE.format(
                 chrom=chrom,
                 start=start,
                 end=end,
                 name=classification,
-                color=COLORS.get(classification, "#007ED0"),
+                color=CLASSIFICATION_COLORS.get(classification, "#007ED0"),
                 genome_reference=genome_reference,
                 vcf_pos=vcf_pos,
                 vcf_ref=vcf_ref,
@@ -191,29 +224,95 @@ def get_classification_bed(session):
                 genepanel_version=genepanel_version,
                 date_created=date_created.strftime("%Y-%m-%d"),
             )
+
+    def update(self, session):
+        """
+        Bring the track up to date with the current alleleassessments.
+
+        Alleleassessments are never changed in place: finalizing creates a new row, and
+        superceding sets date_superceeded on the old one. Hence the set of current
+        alleleassessment ids changes whenever the track needs to be updated. The max id is not
+        enough, as transactions can commit out of id order, so the version is a hash of all ids.
+        """
+        version = (
+            session.query(
+                func.count(assessment.AlleleAssessment.id),
+                func.md5(
+                    func.string_agg(
+                        cast(assessment.AlleleAssessment.id, Text),
+                        aggregate_order_by(literal(","), assessment.AlleleAssessment.id),
+                    )
+                ),
+            )
+            .filter(assessment.AlleleAssessment.date_superceeded.is_(None))
+            .one()
         )
-    result += "\n".join(lines)
-    return result
 
+        with self._lock:
+            if version == self.version:
+                return
 
-def get_allele_vcf(session, analysis_id, allele_ids):
-    if not allele_ids:
-        return None
+            current_ids = set(
+                session.query(assessment.AlleleAssessment.id)
+                .filter(assessment.AlleleAssessment.date_superceeded.is_(None))
+                .scalar_all()
+            )
+            for superceded_id in set(self.lines) - current_ids:
+                del self.lines[superceded_id]
 
-    alleles = session.query(allele.Allele).filter(allele.Allele.id.in_(allele_ids)).all()
+            new_ids = current_ids - set(self.lines)
+            if len(new_ids) > len(current_ids) // 2:
+                # Mostly new data (e.g. first load): cheaper to get all than to filter on ids
+                new_lines = self._format_lines(session)
+            else:
+                new_lines = self._format_lines(session, new_ids)
+            for alleleassessment_id, line in new_lines:
+                self.lines[alleleassessment_id] = line
 
-    analysis = session.query(sample.Analysis).filter(sample.Analysis.id == analysis_id).one()
+            self.data = (
+                CLASSIFICATION_BED_HEADER + "\n".join(self.lines[k] for k in sorted(self.lines))
+            ).encode()
+            self.etag = hashlib.sha1(self.data).hexdigest()
+            self._gzip_data = None
+            self.version = version
+            log.debug(
+                "Updated classification track: {} new, {} total".format(
+                    len(new_ids), len(self.lines)
+                )
+            )
 
-    adl = AlleleDataLoader(session)
-    allele_objs = adl.from_objs(
-        alleles,
-        analysis_id=analysis.id,
-        genepanel=analysis.genepanel,
-        include_allele_assessment=False,
-        include_allele_report=False,
-        include_custom_annotation=False,
-        include_reference_assessments=False,
-    )
+    def get(self, session, gzipped=False):
+        """
+        Returns the up to date track (optionally gzipped) with its ETag
+        """
+        self.update(session)
+        with self._lock:
+            if not gzipped:
+                return self.data, self.etag
+            if self._gzip_data is None:
+                self._gzip_data = gzip.compress(self.data)
+            return self._gzip_data, self.etag + "-gzip"
+
+
+classification_bed_cache = ClassificationBedCache()
+
+
+def get_classification_bed(session):
+    return classification_bed_cache.get(session)[0].decode()
+
+
+# Number of VCF lines written at a time by iter_allele_vcf
+VCF_LINES_PER_CHUNK = 500
+
+
+def iter_allele_vcf(session, analysis_id, allele_ids):
+    """
+    Yields a VCF with the given alleles of an analysis, header first and then one chunk
+    of lines at a time. Alleles are loaded in chunks, so memory use is bounded
+    for large number of alleles.
+    """
+
+    analysis = session.query(sample.Analysis).filter(sample.Analysis.id == analysis_id).one()
 
     VCF_HEADER_TEMPLATE = (
         "\n".join(
@@ -223,9 +322,36 @@ def get_allele_vcf(session, analysis_id, allele_ids):
     )
     VCF_LINE_TEMPLATE = "{chr}\t{pos}\t{id}\t{ref}\t{alt}\t{qual}\t{filter_status}\t{info}\t{genotype_format}\t{genotype_data}\n"
 
-    sample_names = sorted(list(set([s["identifier"] for a in allele_objs for s in a["samples"]])))
-    data = VCF_HEADER_TEMPLATE.format("\t".join(sample_names))
+    # Loaded sample data includes the proband samples with genotypes for the alleles.
+    # Fetch their names up front, so the header can be written before any alleles are loaded
+    sample_names = sorted(
+        s
+        for s, in session.query(sample.Sample.identifier)
+        .join(genotype.Genotype, genotype.Genotype.sample_id == sample.Sample.id)
+        .filter(
+            sample.Sample.analysis_id == analysis.id,
+            sample.Sample.proband.is_(True),
+            or_(
+                genotype.Genotype.allele_id.in_(allele_ids),
+                genotype.Genotype.secondallele_id.in_(allele_ids),
+            ),
+        )
+        .distinct()
+    )
+    yield VCF_HEADER_TEMPLATE.format("\t".join(sample_names))
 
+    adl = AlleleDataLoader(session)
+    allele_objs = adl.iter_from_ids(
+        allele_ids,
+        analysis_id=analysis.id,
+        genepanel=analysis.genepanel,
+        include_allele_assessment=False,
+        include_allele_report=False,
+        include_custom_annotation=False,
+        include_reference_assessments=False,
+    )
+
+    lines = list()
     for a in allele_objs:
         chr = a["chromosome"]
         pos = a["vcf_pos"]
@@ -252,19 +378,32 @@ def get_allele_vcf(session, analysis_id, allele_ids):
         # Annotation
         info = []
         genotype_data_keys = sorted(genotype_data.keys())
-        data += VCF_LINE_TEMPLATE.format(
-            chr=chr,
-            pos=pos,
-            id=".",
-            ref=ref,
-            alt=alt,
-            qual=qual,
-            filter_status=filter_status,
-            info=";".join(info) if info else ".",
-            genotype_format=":".join(genotype_data_keys),
-            genotype_data=":".join([genotype_data[k] for k in genotype_data_keys]),
+        lines.append(
+            VCF_LINE_TEMPLATE.format(
+                chr=chr,
+                pos=pos,
+                id=".",
+                ref=ref,
+                alt=alt,
+                qual=qual,
+                filter_status=filter_status,
+                info=";".join(info) if info else ".",
+                genotype_format=":".join(genotype_data_keys),
+                genotype_data=":".join([genotype_data[k] for k in genotype_data_keys]),
+            )
         )
-    return data
+        if len(lines) >= VCF_LINES_PER_CHUNK:
+            yield "".join(lines)
+            lines = list()
+
+    if lines:
+        yield "".join(lines)
+
+
+def get_allele_vcf(session, analysis_id, allele_ids):
+    if not allele_ids:
+        return None
+    return "".join(iter_allele_vcf(session, analysis_id, allele_ids))
 
 
 class IgvSearchResource(LogRequestResource):
@@ -334,10 +473,26 @@ class ClassificationResource(LogRequestResource):
     @authenticate()
     @logger(exclude=True)
     def get(self, session, user=None):
-        data = BytesIO()
-        data.write(get_classification_bed(session).encode())
-        data.seek(0)
-        return send_file(data, attachment_filename="classifications.bed")
+        """
+        Serves the (cached) classification track. Supports conditional requests
+        (If-None-Match), and gzip encoding if accepted by the client.
+        Range requests are served from the uncompressed track.
+        """
+        headers = {"Vary": "Accept-Encoding"}
+        gzipped = "Range" not in request.headers and "gzip" in request.headers.get(
+            "Accept-Encoding", ""
+        )
+        if gzipped:
+            headers["Content-Encoding"] = "gzip"
+        data, etag = classification_bed_cache.get(session, gzipped=gzipped)
+
+        rv = Response(
+            data,
+            mimetype=mimetypes.guess_type("classifications.bed")[0] or "application/octet-stream",
+            headers=headers,
+        )
+        rv.set_etag(etag)
+        return rv.make_conditional(request, accept_ranges=True, complete_length=len(data))
 
 
 class AnalysisVariantTrack(LogRequestResource):
@@ -346,7 +501,8 @@ class AnalysisVariantTrack(LogRequestResource):
     def get(self, session, analysis_id, user=None):
         allele_ids = [int(aid) for aid in request.args.get("allele_ids", "").split(",")]
         data = BytesIO()
-        data.write(get_allele_vcf(session, analysis_id, allele_ids).encode())
+        for vcf_data in iter_allele_vcf(session, analysis_id, allele_ids):
+            data.write(vcf_data.encode())
         data.seek(0)
         return send_file(data, attachment_filename="analysis-variants.vcf")
 
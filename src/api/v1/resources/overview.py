@@ -1,5 +1,6 @@
 from typing import Dict, Any, DefaultDict, Tuple, Set
 from collections import defaultdict
+from flask import request
 from sqlalchemy import func, tuple_, and_
 from sqlalchemy.orm import defer, joinedload
 from vardb.datamodel import sample, workflow, allele, genotype, gene
@@ -12,6 +13,7 @@ from datalayer.workflowcategorization import (
 )
 from api import schemas
 from api.v1.resource import LogRequestResource
+from api.util.overviewcache import overview_cache
 from api.util.util import authenticate, paginate
 
 
@@ -158,18 +160,16 @@ def load_analyses(session, analysis_ids, user, keep_input_order=False):
     review_comments = queries.workflow_analyses_review_comment(session, analysis_ids).all()
     warnings_cleared = queries.workflow_analyses_warning_cleared(session, analysis_ids).all()
 
+    priority_by_analysis_id = {p.analysis_id: p.priority for p in priorities}
+    review_comment_by_analysis_id = {rc.analysis_id: rc.review_comment for rc in review_comments}
+    warning_cleared_by_analysis_id = {wc.analysis_id: wc.warning_cleared for wc in warnings_cleared}
+
     for analysis in loaded_analyses:
-        priority = next((p.priority for p in priorities if p.analysis_id == analysis["id"]), 1)
-        analysis["priority"] = priority
-        review_comment = next(
-            (rc.review_comment for rc in review_comments if rc.analysis_id == analysis["id"]), None
-        )
+        analysis["priority"] = priority_by_analysis_id.get(analysis["id"], 1)
+        review_comment = review_comment_by_analysis_id.get(analysis["id"])
         if review_comment:
             analysis["review_comment"] = review_comment
-        warning_cleared = next(
-            (wc.warning_cleared for wc in warnings_cleared if wc.analysis_id == analysis["id"]),
-            None,
-        )
+        warning_cleared = warning_cleared_by_analysis_id.get(analysis["id"])
         if warning_cleared:
             analysis["warning_cleared"] = warning_cleared
 
@@ -297,17 +297,52 @@ def get_alleles_existing_alleleinterpretation(
     return alleleinterpretation_allele_ids, count
 
 
+def overview_cache_key(overview, user):
+    """
+    The overviews only depend on the user through the genepanels of the user's group.
+    """
+    if user is None:
+        return (overview, None)
+    return (overview, tuple(sorted((gp.name, gp.version) for gp in user.group.genepanels)))
+
+
+def get_cached_overview(session, overview, user, create, entry_id):
+    """
+    Returns the overview as given by create(), from overview_cache if possible.
+
+    If the request has the argument since_version, the overview is returned as changes since
+    that version instead (see OverviewCache.changes()). An empty, malformed or unknown
+    since_version gives the full overview.
+    """
+    key = overview_cache_key(overview, user)
+    since_version = request.args.get("since_version")
+    if since_version is None:
+        return overview_cache.get(session, key, create)[1]
+    return overview_cache.changes(session, key, create, entry_id, since_version)
+
+
 class OverviewAlleleResource(LogRequestResource):
     @authenticate()
     def get(self, session, user=None):
-        categorized_allele_ids = get_categorized_alleles(session, user=user)
+        """
+        Returns the allele workflows per category.
+
+        Given the argument since_version (version from a previous response), only the changes
+        since that version are returned (see OverviewCache.changes()).
+        """
 
-        result: Dict[str, Any] = dict()
-        for key, allele_ids in categorized_allele_ids.items():
-            allele_id_genepanel = get_alleleinterpretation_allele_ids_genepanel(session, allele_ids)
-            result[key] = load_alleles(session, allele_id_genepanel)
+        def create():
+            categorized_allele_ids = get_categorized_alleles(session, user=user)
 
-        return result
+            result: Dict[str, Any] = dict()
+            for key, allele_ids in categorized_allele_ids.items():
+                allele_id_genepanel = get_alleleinterpretation_allele_ids_genepanel(
+                    session, allele_ids
+                )
+                result[key] = load_alleles(session, allele_id_genepanel)
+            return result
+
+        return get_cached_overview(session, "alleles", user, create, lambda x: x["allele"]["id"])
 
 
 class OverviewAlleleFinalizedResource(LogRequestResource):
@@ -355,13 +390,22 @@ class OverviewAnalysisFinalizedResource(LogRequestResource):
 class OverviewAnalysisResource(LogRequestResource):
     @authenticate()
     def get(self, session, user=None):
-        categorized_analysis_ids = get_categorized_analyses(session, user=user)
+        """
+        Returns the analyses per workflow category.
+
+        Given the argument since_version (version from a previous response), only the changes
+        since that version are returned (see OverviewCache.changes()).
+        """
+
+        def create():
+            categorized_analysis_ids = get_categorized_analyses(session, user=user)
 
-        result = {}
-        for key, analysis_ids in categorized_analysis_ids.items():
-            result[key] = load_analyses(session, analysis_ids, user)
+            result = {}
+            for key, analysis_ids in categorized_analysis_ids.items():
+                result[key] = load_analyses(session, analysis_ids, user)
+            return result
 
-        return result
+        return get_cached_overview(session, "analyses", user, create, lambda x: x["id"])
 
 
 class OverviewUserStatsResource(LogRequestResource):
@@ -1,7 +1,7 @@
 import re
 import json
 from flask import request
-from sqlalchemy import tuple_, or_, select, text, func
+from sqlalchemy import tuple_, or_, select, text
 from vardb.datamodel import (
     sample,
     assessment,
@@ -143,7 +143,14 @@ class SearchResource(LogRequestResource):
     # 123456
     RE_CHR_POS = re.compile(r"^(chr)?((?P<chr>[0-9XYM]*):)?(?P<pos1>[0-9]+)(-(?P<pos2>[0-9]+))?")
 
-    TSQUERY_ESCAPE = ["&", ":", "(", ")", "*", "!", "|"]
+    @staticmethod
+    def _escape_like(value):
+        """
+        Escapes the wildcards in value, for use in (I)LIKE patterns. Substring search
+        ('%...%') on hgvsc, hgvsp, gene symbol and analysis name is supported by trigram
+        (gin_trgm_ops) indexes.
+        """
+        return re.sub(r"([\\%_])", r"\\\1", value)
 
     @authenticate()
     @paginate
@@ -283,11 +290,11 @@ class SearchResource(LogRequestResource):
         )
 
         if search_query.freetext:
-            re_freetext = re.escape(search_query.freetext)
-            # Escape special characters before sending to tsquery
-            for t in SearchResource.TSQUERY_ESCAPE:
-                re_freetext = re_freetext.replace(t, "\\" + t)
-            filters.append(sample.Analysis.name.op("~*")(".*{}.*".format(re_freetext)))
+            filters.append(
+                sample.Analysis.name.ilike(
+                    "%{}%".format(SearchResource._escape_like(search_query.freetext))
+                )
+            )
 
         if search_query.username is not None:
             user_ids = (
@@ -369,15 +376,14 @@ class SearchResource(LogRequestResource):
 
         if search_query.hgvsp:
             allele_ids = allele_ids.filter(
-                func.lower(annotationshadow.AnnotationShadowTranscript.hgvsp).like(
-                    search_query.hgvsp.lower() + "%"
+                annotationshadow.AnnotationShadowTranscript.hgvsp.ilike(
+                    "%{}%".format(SearchResource._escape_like(search_query.hgvsp))
                 )
             )
-        # Our btree indexes are set as "lower(column) text_pattern_ops" and only support rightside wildcard.
         elif search_query.hgvsc:
             allele_ids = allele_ids.filter(
-                func.lower(annotationshadow.AnnotationShadowTranscript.hgvsc).like(
-                    search_query.hgvsc.lower() + "%"
+                annotationshadow.AnnotationShadowTranscript.hgvsc.ilike(
+                    "%{}%".format(SearchResource._escape_like(search_query.hgvsc))
                 )
             )
         else:
@@ -437,7 +443,7 @@ class SearchResource(LogRequestResource):
             session, [(gp.name, gp.version) for gp in genepanels], allele_ids=allele_ids
         ).subquery()
 
-        allele_ids_transcripts = (
+        allele_ids_transcripts = set(
             session.query(
                 genepanel_transcripts.c.allele_id, genepanel_transcripts.c.annotation_transcript
             )
@@ -445,34 +451,31 @@ class SearchResource(LogRequestResource):
             .all()
         )
 
-        def annotation_transcripts_hgvs(transcripts, search_query):
+        # Case insensitive, as in _search_allele_hgvs()
+        hgvsc = search_query.hgvsc.lower() if search_query.hgvsc else None
+        hgvsp = search_query.hgvsp.lower() if search_query.hgvsp else None
+
+        def annotation_transcripts_hgvs(transcripts):
             results = list()
             for t in transcripts:
-                if search_query.hgvsc and search_query.hgvsc in t.get("HGVSc", ""):
+                if hgvsc and hgvsc in t.get("HGVSc", "").lower():
                     results.append(t)
-                if search_query.hgvsp and search_query.hgvsp in t.get("HGVSp", ""):
+                if hgvsp and hgvsp in t.get("HGVSp", "").lower():
                     results.append(t)
             return results
 
         for al in alleles:
-            filtered_transcripts = list()
-
             # Filter transcripts on genepanel
-            for transcript in al["annotation"]["transcripts"]:
-                if next(
-                    (
-                        at
-                        for at in allele_ids_transcripts
-                        if at[0] == al["id"] and at[1] == transcript["transcript"]
-                    ),
-                    None,
-                ):
-                    filtered_transcripts.append(transcript)
+            filtered_transcripts = [
+                transcript
+                for transcript in al["annotation"]["transcripts"]
+                if (al["id"], transcript["transcript"]) in allele_ids_transcripts
+            ]
             if search_query.is_hgvs():
-                genepanel_has_hgvs = annotation_transcripts_hgvs(filtered_transcripts, search_query)
+                genepanel_has_hgvs = annotation_transcripts_hgvs(filtered_transcripts)
                 if not genepanel_has_hgvs:
                     filtered_transcripts.extend(
-                        annotation_transcripts_hgvs(al["annotation"]["transcripts"], search_query)
+                        annotation_transcripts_hgvs(al["annotation"]["transcripts"])
                     )
             al["annotation"]["filtered_transcripts"] = sorted(
                 list(set([t["transcript"] for t in filtered_transcripts]))
@@ -536,8 +539,11 @@ class SearchOptionsResource(LogRequestResource):
         query = json.loads(request.args["q"])
         result = dict()
         if query.get("gene"):
+            # Substring match (trigram index), with symbols starting with the query first
+            gene_query = SearchResource._escape_like(query["gene"])
+            is_prefix = gene.Gene.hgnc_symbol.ilike("{}%".format(gene_query))
             gene_results = (
-                session.query(gene.Gene.hgnc_symbol, gene.Gene.hgnc_id)
+                session.query(gene.Gene.hgnc_symbol, gene.Gene.hgnc_id, is_prefix)
                 .join(gene.Transcript, gene.Genepanel.transcripts)
                 .filter(
                     # was a bit hard to get the join correct, had to put join condition here
@@ -545,11 +551,10 @@ class SearchOptionsResource(LogRequestResource):
                     tuple_(gene.Genepanel.name, gene.Genepanel.version).in_(
                         [(g.name, g.version) for g in user.group.genepanels]
                     ),
-                    # Our btree indexes are set as "lower(column) text_pattern_ops" and only support rightside wildcard.
-                    func.lower(gene.Gene.hgnc_symbol).like(query["gene"].lower() + "%"),
+                    gene.Gene.hgnc_symbol.ilike("%{}%".format(gene_query)),
                 )
                 .distinct()
-                .order_by(gene.Gene.hgnc_symbol)
+                .order_by(is_prefix.desc(), gene.Gene.hgnc_symbol)
                 .limit(SearchOptionsResource.RESULT_LIMIT)
             )
 
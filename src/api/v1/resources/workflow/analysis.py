@@ -3,6 +3,7 @@ from sqlalchemy import tuple_
 from vardb.datamodel import sample, genotype, allele
 
 from api import ApiError, ConflictError
+from api.config import config
 from api.util.util import request_json, authenticate, rest_filter, paginate
 from api.v1.resource import LogRequestResource
 
@@ -708,7 +709,10 @@ class AnalysisInterpretationFilteredAlleles(LogRequestResource):
             filterconfig_id = int(filterconfig_id)
 
         allele_ids, excluded_allele_ids = helpers.get_filtered_alleles(
-            session, interpretation, filter_config_id=filterconfig_id
+            session,
+            interpretation,
+            filter_config_id=filterconfig_id,
+            filter_workers=config["app"].get("filter_workers", 0),
         )
         result = {"allele_ids": allele_ids, "excluded_allele_ids": excluded_allele_ids}
 
@@ -3,20 +3,20 @@ import datetime
 import pytz
 from collections import defaultdict
 
-from sqlalchemy import tuple_, literal, func
+from sqlalchemy import tuple_, literal, or_, and_
 from sqlalchemy.orm import joinedload
 
 from vardb.datamodel import user, assessment, sample, genotype, allele, workflow, gene, annotation
 
 from api import schemas, ApiError, ConflictError
 from datalayer import (
-    AlleleFilter,
     AlleleDataLoader,
     AssessmentCreator,
     AlleleReportCreator,
     SnapshotCreator,
     queries,
 )
+from datalayer.allelefilter import filter_result_cache
 from api.util.util import get_nested
 
 
@@ -862,33 +862,21 @@ def get_workflow_allele_collisions(session, allele_ids, analysis_id=None, allele
         for single interpretations.
         """
 
-        more_than_one = (
-            session.query(getattr(model, model_attr_id))
-            .group_by(getattr(model, model_attr_id))
-            .having(func.count(getattr(model, model_attr_id)) > 1)
-            .subquery()
-        )
-
-        not_finalized = queries.workflow_by_status(
-            session, model, model_attr_id, finalized=False
-        ).subquery()
-
-        ongoing = set(
-            queries.workflow_by_status(session, model, model_attr_id, status="Ongoing").scalar_all()
-        )
-
-        more_than_one_not_finalized = set(
-            session.query(getattr(more_than_one.c, model_attr_id))
-            .join(
-                not_finalized,
-                getattr(not_finalized.c, model_attr_id) == getattr(more_than_one.c, model_attr_id),
+        state_model = queries.workflow_state_model(model)
+        return set(
+            session.query(getattr(state_model, model_attr_id))
+            .filter(
+                or_(
+                    state_model.status == "Ongoing",
+                    and_(
+                        state_model.interpretation_count > 1,
+                        or_(state_model.finalized.is_(None), state_model.finalized.is_(False)),
+                    ),
+                )
             )
-            .distinct()
             .scalar_all()
         )
 
-        return ongoing | more_than_one_not_finalized
-
     workflow_analysis_ids = get_collision_interpretation_model_ids(
         workflow.AnalysisInterpretation, "analysis_id"
     )
@@ -912,17 +900,17 @@ def get_workflow_allele_collisions(session, allele_ids, analysis_id=None, allele
             sample.Analysis,
             workflow.AnalysisInterpretation,
         )
+        .join(
+            workflow.AnalysisWorkflowState,
+            workflow.AnalysisWorkflowState.analysisinterpretation_id
+            == workflow.AnalysisInterpretation.id,
+        )
         .filter(
             sample.Analysis.id.in_(workflow_analysis_ids),
             allele.Allele.id.in_(allele_ids),
             ~allele.Allele.id.in_(queries.allele_ids_with_valid_alleleassessments(session)),
         )
-        .distinct(workflow.AnalysisInterpretation.analysis_id, allele.Allele.id)
-        .order_by(
-            workflow.AnalysisInterpretation.analysis_id,
-            allele.Allele.id,
-            workflow.AnalysisInterpretation.date_created.desc(),
-        )
+        .distinct()
     ).all()
 
     # Allele workflow
@@ -941,15 +929,15 @@ def get_workflow_allele_collisions(session, allele_ids, analysis_id=None, allele
             workflow.AlleleInterpretation.allele_id,
             literal(None).label("analysis_id"),
         )
+        .join(
+            workflow.AlleleWorkflowState,
+            workflow.AlleleWorkflowState.alleleinterpretation_id
+            == workflow.AlleleInterpretation.id,
+        )
         .filter(
             workflow.AlleleInterpretation.allele_id.in_(workflow_allele_ids),
             workflow.AlleleInterpretation.allele_id.in_(allele_ids),
         )
-        .distinct(workflow.AlleleInterpretation.allele_id)
-        .order_by(
-            workflow.AlleleInterpretation.allele_id,
-            workflow.AlleleInterpretation.date_created.desc(),
-        )
     ).all()
 
     # Preload the users
@@ -1217,13 +1205,16 @@ def delete_interpretationlog(
     session.delete(il)
 
 
-def get_filtered_alleles(session, interpretation, filter_config_id=None):
+def get_filtered_alleles(session, interpretation, filter_config_id=None, filter_workers=0):
     """
     Return filter results for interpretation.
     - If AlleleInterpretation, return only allele id for interpretation (no alleles excluded)
     - If AnalysisInterpretation:
         - filter_config_id not provided: Return snapshot results. Requires interpretation to be 'Done'-
-        - filter_config_id provided: Run filter on analysis, and return results.
+        - filter_config_id provided: Run filter on analysis (or reuse cached result if
+          the analysis data is unchanged), and return results.
+          If filter_workers > 1, independent filters are run concurrently on separate
+          connections. Only use this for committed data.
     """
     if isinstance(interpretation, workflow.AlleleInterpretation):
         return [interpretation.allele_id], None
@@ -1268,9 +1259,8 @@ def get_filtered_alleles(session, interpretation, filter_config_id=None):
                 .scalar_all()
             )
 
-            af = AlleleFilter(session)
-            filtered_alleles = af.filter_analysis(
-                filter_config_id, analysis_id, analysis_allele_ids
+            filtered_alleles = filter_result_cache.filter_analysis(
+                session, filter_config_id, analysis_id, analysis_allele_ids, workers=filter_workers
             )
 
             return (filtered_alleles["allele_ids"], filtered_alleles["excluded_allele_ids"])
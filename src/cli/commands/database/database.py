@@ -7,7 +7,9 @@ from contextlib import contextmanager
 import click
 import psycopg2
 
-from vardb.datamodel import DB
+from vardb.datamodel import DB, annotationshadow
+from vardb.datamodel.annotationshadow_rebuild import DEFAULT_CHUNK_SIZE, ShadowTableRebuild
+from api.config import config
 from .drop_db import drop_db
 from .make_db import make_db, refresh, refresh_tmp
 from .ci_migration_db import (
@@ -106,6 +108,58 @@ def cmd_refresh(logger, f=None):
         logger.echo("AnnotationShadowFrequency count: {}".format(asf_count))
 
 
+@database.command(
+    "refresh-online",
+    help="Refresh shadow tables in database, while ELLA is running. "
+    "An interrupted refresh is resumed by running the command again.",
+    short_help="Refresh shadow tables online",
+)
+@click.option(
+    "--chunk-size",
+    type=int,
+    default=DEFAULT_CHUNK_SIZE,
+    help="Number of allele ids per chunk (only used when starting a new refresh)",
+)
+@click.option("--workers", type=int, default=0, help="Number of chunks filled in parallel")
+@click.option("--abort", is_flag=True, help="Abort a refresh in progress")
+@cli_logger()
+def cmd_refresh_online(logger, chunk_size, workers, abort):
+    db = DB()
+    db.connect()
+    if abort:
+        ShadowTableRebuild.abort(db.session)
+        logger.echo("Aborted shadow table refresh")
+        return
+
+    removed_columns = annotationshadow.get_db_frequency_columns(db.session) - set(
+        c for c, _ in annotationshadow.iter_config_columns(config)
+    )
+    if removed_columns:
+        logger.echo(
+            "Frequency columns {} are removed: filtering in running ELLA processes will fail "
+            "from the end of the refresh until they are restarted".format(
+                ", ".join(sorted(removed_columns))
+            )
+        )
+
+    ShadowTableRebuild(
+        db.session, config, chunk_size=chunk_size, workers=workers, progress=click.echo
+    ).run()
+
+    ast_count = db.session.execute("SELECT COUNT(*) FROM annotationshadowtranscript").scalar()
+    asf_count = db.session.execute("SELECT COUNT(*) FROM annotationshadowfrequency").scalar()
+    db.session.commit()
+    db.disconnect()
+
+    conn = psycopg2.connect(os.environ["DB_URL"])
+    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    conn.cursor().execute("VACUUM(ANALYZE) annotationshadowtranscript, annotationshadowfrequency")
+
+    logger.echo("AnnotationShadowTranscript count: {}".format(ast_count))
+    logger.echo("AnnotationShadowFrequency count: {}".format(asf_count))
+    logger.echo("Restart ELLA with the current ELLA_CONFIG to use the new frequency groups")
+
+
 @database.command(
     "make-migration-base",
     help="Creates MIGRATION BASE tables in database.",
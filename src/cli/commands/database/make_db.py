@@ -5,6 +5,10 @@ Script for creating all tables in a vardb database.
 from vardb.datamodel import *  # noqa: F403
 from vardb.datamodel.annotationshadow import create_shadow_tables, create_tmp_shadow_tables
 from vardb.datamodel.jsonschemas.update_schemas import update_schemas
+from vardb.datamodel.workflow import (
+    create_workflow_state_triggers,
+    create_workflow_version_triggers,
+)
 from sqlalchemy.orm import configure_mappers
 from api.config import config
 
@@ -28,3 +32,6 @@ def refresh(db, use_prepared_tmp_tables=False):
     update_schemas(db.session)
 
     create_shadow_tables(db.session, config, use_prepared_tmp_tables=use_prepared_tmp_tables)
+
+    create_workflow_state_triggers(db.session)
+    create_workflow_version_triggers(db.session)
@@ -29,17 +29,55 @@ def deposit():
 
 @deposit.command("analysis")
 @click.argument("file_or_folder", type=click.Path(exists=True))
+@click.option("--copy", "use_copy", is_flag=True, help="Use COPY for importing genotypes (faster)")
+@click.option(
+    "--workers",
+    type=int,
+    default=0,
+    help="Number of worker processes for annotation conversion (0: no parallelization)",
+)
+@click.option(
+    "--preload-classifications",
+    is_flag=True,
+    help="Load all classified alleles once for prefiltering, instead of querying per batch",
+)
+@click.option(
+    "--python-json-validation",
+    is_flag=True,
+    help="Validate annotation data in Python instead of in the database (faster)",
+)
+@click.option(
+    "--bulk-annotationshadow",
+    is_flag=True,
+    help="Update annotation shadow tables once per batch instead of per annotation (faster)",
+)
 @session
 @cli_logger()
-def cmd_deposit_analysis(logger, session, file_or_folder):
+def cmd_deposit_analysis(
+    logger,
+    session,
+    file_or_folder,
+    use_copy,
+    workers,
+    preload_classifications,
+    python_json_validation,
+    bulk_annotationshadow,
+):
     """
     Deposit an analysis given input vcf.
     File should be in format of {analysis_name}.{genepanel_name}-{genepanel_version}.vcf
     """
 
-    da = DepositAnalysis(session)
+    da = DepositAnalysis(
+        session,
+        use_copy=use_copy,
+        python_json_validation=python_json_validation,
+        bulk_annotationshadow=bulk_annotationshadow,
+    )
     analysis_config_data = AnalysisConfigData(file_or_folder)
-    analysis = da.import_vcf(analysis_config_data)
+    analysis = da.import_vcf(
+        analysis_config_data, workers=workers, preload_classifications=preload_classifications
+    )
     session.commit()
     logger.echo("Analysis {} deposited successfully".format(analysis.name))
 
@@ -76,16 +114,30 @@ def cmd_deposit_alleles(logger, session, vcf, genepanel_name, genepanel_version)
 
 @deposit.command("annotation")
 @click.argument("vcf")
+@click.option(
+    "--python-json-validation",
+    is_flag=True,
+    help="Validate annotation data in Python instead of in the database (faster)",
+)
+@click.option(
+    "--bulk-annotationshadow",
+    is_flag=True,
+    help="Update annotation shadow tables once per batch instead of per annotation (faster)",
+)
 @session
 @cli_logger()
-def cmd_deposit_annotation(logger, session, vcf):
+def cmd_deposit_annotation(logger, session, vcf, python_json_validation, bulk_annotationshadow):
     """
     Update/deposit alleles with annotation only given input vcf.
     No analysis/variant interpretation is created.
     File should be in format of {something}.{genepanel_name}_{genepanel_version}.vcf
     """
     matches = re.match(VCF_FIELDS_RE, os.path.basename(vcf))
-    da = DepositAlleles(session)
+    da = DepositAlleles(
+        session,
+        python_json_validation=python_json_validation,
+        bulk_annotationshadow=bulk_annotationshadow,
+    )
     da.import_vcf(
         vcf,
         matches.group("genepanel_name"),
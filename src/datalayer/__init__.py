@@ -1,4 +1,5 @@
 from .acmgdataloader import ACMGDataLoader
+from .acmgcodecache import ACMGCodeCache, acmg_code_cache
 from .allelefilter import AlleleFilter
 from .alleledataloader.alleledataloader import AlleleDataLoader
 from .allelereportcreator import AlleleReportCreator
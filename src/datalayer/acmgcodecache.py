@@ -0,0 +1,180 @@
+import copy
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from sqlalchemy.orm.session import Session
+
+from vardb.datamodel import allele, annotation, gene
+from .acmgdataloader import ACMGDataLoader
+
+log = logging.getLogger(__name__)
+
+
+def _digest(data: Any) -> str:
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ACMGCodeCache(object):
+    """
+    Process local LRU cache of the ACMG codes computed by ACMGDataLoader, per allele.
+
+    Codes are keyed on (annotation id, custom annotation id, genepanel, ACMG config hash,
+    reference assessment hash). New annotation or custom annotation creates new rows, genepanels
+    are never changed in place (a new version is created instead), and the application config
+    (e.g. frequency groups) is only read on startup, so cached codes are invalidated automatically.
+
+    The reference assessments are given by the client, and change whenever the user edits them,
+    so only the alleles with changed reference assessments need to be recomputed.
+    """
+
+    def __init__(self, maxsize: int = 4096) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._codes: "OrderedDict[Hashable, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def annotation_ids(
+        session: Session, allele_ids: Sequence[int]
+    ) -> Dict[int, Tuple[Optional[int], Optional[int]]]:
+        """
+        Returns the current (annotation id, custom annotation id) per allele id,
+        as loaded by AlleleDataLoader.
+        """
+        if not allele_ids:
+            return dict()
+        annotation_ids = (
+            session.query(annotation.Annotation.id)
+            .filter(
+                annotation.Annotation.allele_id == allele.Allele.id,
+                annotation.Annotation.date_superceeded.is_(None),
+            )
+            .limit(1)
+            .as_scalar()
+        )
+        custom_annotation_ids = (
+            session.query(annotation.CustomAnnotation.id)
+            .filter(
+                annotation.CustomAnnotation.allele_id == allele.Allele.id,
+                annotation.CustomAnnotation.date_superceeded.is_(None),
+            )
+            .limit(1)
+            .as_scalar()
+        )
+        return {
+            allele_id: (annotation_id, custom_annotation_id)
+            for allele_id, annotation_id, custom_annotation_id in session.query(
+                allele.Allele.id, annotation_ids, custom_annotation_ids
+            ).filter(allele.Allele.id.in_(allele_ids))
+        }
+
+    @staticmethod
+    def _key(
+        annotation_id: Optional[int],
+        custom_annotation_id: Optional[int],
+        genepanel: gene.Genepanel,
+        acmgconfig_digest: str,
+        reference_assessments: List[Dict[str, Any]],
+    ) -> Tuple:
+        reference_assessments_digest = _digest(
+            sorted(
+                [(ra["reference_id"], ra.get("evaluation")) for ra in reference_assessments],
+                key=lambda ra: ra[0],
+            )
+        )
+        return (
+            annotation_id,
+            custom_annotation_id,
+            (genepanel.name, genepanel.version),
+            acmgconfig_digest,
+            reference_assessments_digest,
+        )
+
+    def from_objs(
+        self,
+        session: Session,
+        alleles: Sequence[allele.Allele],
+        reference_assessments: Optional[List[Dict[str, Any]]],
+        genepanel: gene.Genepanel,
+        acmgconfig: Dict[str, Any],
+    ) -> Dict[int, Dict[str, Any]]:
+        """
+        Same as ACMGDataLoader(session).from_objs(alleles, reference_assessments, genepanel,
+        acmgconfig), only computing the codes for the alleles not already cached.
+        """
+        acmgconfig_digest = _digest(acmgconfig)
+        ra_per_allele = defaultdict(list)
+        for ra in reference_assessments or []:
+            ra_per_allele[ra["allele_id"]].append(ra)
+
+        annotation_ids = self.annotation_ids(session, [a.id for a in alleles])
+
+        result = dict()
+        missing = list()
+        with self._lock:
+            for al in alleles:
+                key = self._key(
+                    *annotation_ids.get(al.id, (None, None)),
+                    genepanel,
+                    acmgconfig_digest,
+                    ra_per_allele[al.id],
+                )
+                codes = self._codes.get(key)
+                if codes is not None:
+                    self._codes.move_to_end(key)
+                    self.hits += 1
+                    result[al.id] = copy.deepcopy(codes)
+                else:
+                    self.misses += 1
+                    missing.append(al)
+
+        if missing:
+            # Loaded annotation data gives the ids actually used, in case of new annotation
+            # since annotation_ids()
+            loaded_alleles = ACMGDataLoader(session).load_alleles(missing, genepanel)
+            keys = {
+                a["id"]: self._key(
+                    a["annotation"].get("annotation_id"),
+                    a["annotation"].get("custom_annotation_id"),
+                    genepanel,
+                    acmgconfig_digest,
+                    ra_per_allele[a["id"]],
+                )
+                for a in loaded_alleles
+            }
+            computed = ACMGDataLoader(session).from_data(
+                loaded_alleles,
+                [ra for al in missing for ra in ra_per_allele[al.id]],
+                genepanel,
+                acmgconfig,
+            )
+
+            with self._lock:
+                for allele_id, codes in computed.items():
+                    self._codes[keys[allele_id]] = copy.deepcopy(codes)
+                    self._codes.move_to_end(keys[allele_id])
+                while len(self._codes) > self.maxsize:
+                    self._codes.popitem(last=False)
+            result.update(computed)
+
+            log.debug(
+                "ACMG code cache miss for {} of {} alleles ({} hits, {} misses)".format(
+                    len(missing), len(alleles), self.hits, self.misses
+                )
+            )
+
+        return {al.id: result[al.id] for al in alleles}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._codes.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+acmg_code_cache = ACMGCodeCache()
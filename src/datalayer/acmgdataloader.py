@@ -9,6 +9,8 @@ from .allelefilter.frequencyfilter import FrequencyFilter
 from .acmgconfig import AcmgConfig
 from .alleledataloader.alleledataloader import AlleleDataLoader
 
+compiled_rules = GRE.compile(rules)
+
 
 class ACMGDataLoader(object):
     def __init__(self, session):
@@ -63,11 +65,23 @@ class ACMGDataLoader(object):
         :param annotation_data: List of annotation data dicts
         :returns: List of ACMG codes (dicts)
         """
-        passed, nonpassed = GRE().query(rules, annotation_data)
-        passed_data = schemas.RuleSchema().dump(passed, many=True).data
-        return passed_data
+        return self.get_acmg_codes_batch([annotation_data])[0]
+
+    def get_acmg_codes_batch(self, annotation_data_list):
+        """
+        Calculates ACMG codes from the rules for each of the given annotation data,
+        evaluating the rules (compiled once per process) for all of them in one call.
+
+        :param annotation_data_list: List of annotation data, as for get_acmg_codes()
+        :returns: List of ACMG codes (list of dicts) for each annotation data, in same order
+        """
+        rule_schema = schemas.RuleSchema()
+        return [
+            rule_schema.dump(passed, many=True).data
+            for passed, _ in compiled_rules.query_batch(annotation_data_list)
+        ]
 
-    def _from_data(self, alleles, reference_assessments, genepanel, acmgconfig):
+    def from_data(self, alleles, reference_assessments, genepanel, acmgconfig):
         """
         Calculates ACMG codes for a list of alleles already preloaded using the AlleleDataLoader.
         They must have been loaded with include_annotation and include_custom_annotation.
@@ -95,6 +109,7 @@ class ACMGDataLoader(object):
             {gp_key: allele_ids}, acmg_frequency_config
         )[gp_key]
 
+        annotation_data_list = list()
         for a in alleles:
             # Add extra data/keys that the rule engine expects to be there
             annotation_data = a["annotation"]
@@ -116,10 +131,29 @@ class ACMGDataLoader(object):
             else:
                 annotation_data["genepanel"] = resolver.resolve(None)
 
-            passed_data = self.get_acmg_codes(annotation_data)
+            annotation_data_list.append(annotation_data)
+
+        for a, passed_data in zip(alleles, self.get_acmg_codes_batch(annotation_data_list)):
             allele_classifications[a["id"]] = {"codes": passed_data}
         return allele_classifications
 
+    def load_alleles(self, alleles, genepanel):
+        """
+        Loads the allele data needed by from_data() using the AlleleDataLoader.
+
+        :param alleles: List
+        :type alleles: vardb.datamodel.allele.Allele
+        :param genepanel: Genepanel to be used.
+        :type genepanel: vardb.datamodel.gene.Genepanel
+        :returns: List of allele data
+        """
+        return AlleleDataLoader(self.session).from_objs(
+            alleles,
+            genepanel=genepanel,
+            include_allele_assessment=False,
+            include_reference_assessments=False,
+        )
+
     def from_objs(self, alleles, reference_assessments, genepanel, acmgconfig):
         """
         Calculates ACMG codes for a list of alleles model objects.
@@ -138,10 +172,5 @@ class ACMGDataLoader(object):
 
         loaded_alleles = None
         if alleles:
-            loaded_alleles = AlleleDataLoader(self.session).from_objs(
-                alleles,
-                genepanel=genepanel,
-                include_allele_assessment=False,
-                include_reference_assessments=False,
-            )
-        return self._from_data(loaded_alleles, reference_assessments, genepanel, acmgconfig)
+            loaded_alleles = self.load_alleles(alleles, genepanel)
+        return self.from_data(loaded_alleles, reference_assessments, genepanel, acmgconfig)
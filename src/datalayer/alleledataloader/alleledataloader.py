@@ -8,7 +8,7 @@ from sqlalchemy.orm import aliased
 
 from .. import queries
 from ..allelefilter.segregationfilter import SegregationFilter
-from ..allelefilter.genotypetable import get_genotype_temp_table
+from ..allelefilter.genotypetable import get_genotype_temp_table, shared_genotype_tables
 from .calculate_qc import genotype_calculate_qc
 from .annotationprocessor import AnnotationProcessor
 
@@ -38,6 +38,9 @@ KEY_ALLELE = "allele"
 
 KEY_ANNOTATIONS = "annotations"
 
+# Number of alleles loaded at a time by AlleleDataLoader.iter_from_ids()
+DEFAULT_CHUNK_SIZE = 500
+
 
 SEGREGATION_TAGS = [
     "denovo",
@@ -149,6 +152,7 @@ class Warnings(object):
         )
 
         nearby_warnings = dict()
+        allele_ids = set(self.allele_ids)
 
         # Create frames for alleles
         for i, (allele_id, chrom, start, end) in enumerate(alleles_ordered):
@@ -167,14 +171,14 @@ class Warnings(object):
                 end_end = abs(end - other_end)
 
                 if start_start < 3 or end_start < 3 or end_end < 3:
-                    if allele_id in self.allele_ids:
+                    if allele_id in allele_ids:
                         nearby_warnings[
                             allele_id
                         ] = "Another variant is within 2 bp of this variant"
 
                     # Since the frames are created for subsequent alleles only, we need to set warning for other_allele
                     # here if the allele is in our alleles of interest
-                    if other_allele_id in self.allele_ids:
+                    if other_allele_id in allele_ids:
                         nearby_warnings[
                             other_allele_id
                         ] = "Another variant is within 2 bp of this variant"
@@ -541,6 +545,7 @@ class AlleleDataLoader(object):
         allele_ids = [al["id"] for al in alleles]
         genotype_schema = GenotypeSchema()
         sample_schema = SampleSchema()
+        genotypesampledata_schema = GenotypeSampleDataSchema()
 
         allele_ids_sample_data = defaultdict(list)
 
@@ -550,19 +555,25 @@ class AlleleDataLoader(object):
         )
 
         proband_samples = [s for s in samples if s.proband]
+        samples_by_id = {s.id: s for s in samples}
+        sibling_samples_by_proband_id = defaultdict(list)
+        for s in samples:
+            if s.sibling_id is not None:
+                sibling_samples_by_proband_id[s.sibling_id].append(s)
 
         proband_sample_id_family = defaultdict(dict)
         # Load parents and siblings
         for proband_sample in proband_samples:
             if proband_sample.father_id:
-                father_sample = next(s for s in samples if s.id == proband_sample.father_id)
+                father_sample = samples_by_id[proband_sample.father_id]
                 proband_sample_id_family[proband_sample.id]["father"] = father_sample
             if proband_sample.mother_id:
-                mother_sample = next(s for s in samples if s.id == proband_sample.mother_id)
+                mother_sample = samples_by_id[proband_sample.mother_id]
                 proband_sample_id_family[proband_sample.id]["mother"] = mother_sample
 
-            sibling_samples = [s for s in samples if s.sibling_id == proband_sample.id]
-            proband_sample_id_family[proband_sample.id]["siblings"] = sibling_samples
+            proband_sample_id_family[proband_sample.id]["siblings"] = list(
+                sibling_samples_by_proband_id[proband_sample.id]
+            )
 
         genotypes = (
             self.session.query(genotype.Genotype)
@@ -585,6 +596,18 @@ class AlleleDataLoader(object):
             .all()
         )
 
+        # Index genotypes on (allele id, sample id) and sample data on
+        # (sample id, genotype id, secondallele), keeping the first match like a linear scan would
+        genotype_by_allele_sample = dict()
+        for g in genotypes:
+            genotype_by_allele_sample.setdefault((g.allele_id, g.sample_id), g)
+            if g.secondallele_id is not None:
+                genotype_by_allele_sample.setdefault((g.secondallele_id, g.sample_id), g)
+
+        genotypesampledata_by_key = dict()
+        for g in genotypesampledata:
+            genotypesampledata_by_key.setdefault((g.sample_id, g.genotype_id, g.secondallele), g)
+
         sample_id_formatted_genotypes = dict()
         for s in samples:
             # Calculate the actual genotype for display (e.g. A/C or G/GTT)
@@ -592,23 +615,16 @@ class AlleleDataLoader(object):
 
         allele_ids_p_denovo = dict()
         if segregation_results:
-            denovo_allele_ids = segregation_results.get("denovo", set())
+            # Segregation results can cover more alleles than we're loading (see iter_from_ids)
+            denovo_allele_ids = set(segregation_results.get("denovo", set())) & set(allele_ids)
             allele_ids_p_denovo = self.get_p_denovo(denovo_allele_ids, analysis_id)
 
-        def load_sample_data(
-            allele_data, sample, genotype, genotypesampledata, genotype_id_formatted, p_denovo=None
-        ):
+        def load_sample_data(allele_data, sample, genotype, genotype_id_formatted, p_denovo=None):
             is_secondallele = bool(genotype.secondallele_id == allele_data["id"])
             sample_data = sample_schema.dump(sample).data
             genotype_data = genotype_schema.dump(genotype).data
-            gsd = next(
-                g
-                for g in genotypesampledata
-                if g.sample_id == sample.id
-                and g.secondallele == is_secondallele
-                and g.genotype_id == gt.id
-            )
-            genotype_data.update(GenotypeSampleDataSchema().dump(gsd).data)
+            gsd = genotypesampledata_by_key[(sample.id, genotype.id, is_secondallele)]
+            genotype_data.update(genotypesampledata_schema.dump(gsd).data)
             genotype_data.update(
                 genotype_calculate_qc(allele_data, genotype_data, sample_data["sample_type"])
             )
@@ -623,18 +639,7 @@ class AlleleDataLoader(object):
         for allele_data in alleles:
             allele_id_sample_data = list()
             for proband_sample in proband_samples:
-                gt = next(
-                    (
-                        g
-                        for g in genotypes
-                        if (
-                            g.allele_id == allele_data["id"]
-                            or g.secondallele_id == allele_data["id"]
-                        )
-                        and g.sample_id == proband_sample.id
-                    ),
-                    None,
-                )
+                gt = genotype_by_allele_sample.get((allele_data["id"], proband_sample.id))
                 # Not all samples will share all alleles.
                 # If there's not genotype, this sample doesn't have this allele
                 if gt is None:
@@ -643,7 +648,6 @@ class AlleleDataLoader(object):
                     allele_data,
                     proband_sample,
                     gt,
-                    genotypesampledata,
                     sample_id_formatted_genotypes[proband_sample.id],
                     allele_ids_p_denovo.get(allele_data["id"]),
                 )
@@ -653,7 +657,6 @@ class AlleleDataLoader(object):
                         allele_data,
                         proband_family_samples["father"],
                         gt,
-                        genotypesampledata,
                         sample_id_formatted_genotypes[proband_family_samples["father"].id],
                     )
                 if proband_family_samples.get("mother"):
@@ -661,7 +664,6 @@ class AlleleDataLoader(object):
                         allele_data,
                         proband_family_samples["mother"],
                         gt,
-                        genotypesampledata,
                         sample_id_formatted_genotypes[proband_family_samples["mother"].id],
                     )
                 if proband_family_samples.get("siblings"):
@@ -672,7 +674,6 @@ class AlleleDataLoader(object):
                                 allele_data,
                                 sibling_sample,
                                 gt,
-                                genotypesampledata,
                                 sample_id_formatted_genotypes[sibling_sample.id],
                             )
                         )
@@ -697,6 +698,7 @@ class AlleleDataLoader(object):
         include_allele_report=True,
         allele_assessment_schema=None,
         only_most_recent_annotation=False,
+        segregation_results=None,
     ):
         """
         Loads data for a list of alleles from the database, and returns a dictionary
@@ -725,6 +727,7 @@ class AlleleDataLoader(object):
         :param include_allele_report: If true, load the ones mentioned in link_filter.allelereport_id or, if not provided, the latest data
         :param allele_assessment_schema: Use this schema for serialization. If None, use default
         :param only_most_recent_annotation: Avoid memory issues (like in dumping variants in export files) by including only most recent annotation
+        :param segregation_results: Precomputed segregation results for the analysis. If None, they're computed if filterconfig_id is given.
         :returns: dict with converted data using schema data.
         """
 
@@ -752,17 +755,18 @@ class AlleleDataLoader(object):
             accumulated_allele_data[al.id] = {KEY_ALLELE: allele_schema.dump(al).data}
             allele_ids.append(al.id)
 
-        segregation_results = None
         if analysis_id and allele_ids:
-            if filterconfig_id is not None:
-                segregation_results = self._get_segregation_results(
-                    allele_ids, analysis_id, filterconfig_id
+            # Segregation results and p-denovo are computed from the same family genotype table
+            with shared_genotype_tables(self.session):
+                if segregation_results is None and filterconfig_id is not None:
+                    segregation_results = self._get_segregation_results(
+                        allele_ids, analysis_id, filterconfig_id
+                    )
+                allele_id_sample_data = self._load_sample_data(
+                    [a["allele"] for a in list(accumulated_allele_data.values())],
+                    analysis_id,
+                    segregation_results,
                 )
-            allele_id_sample_data = self._load_sample_data(
-                [a["allele"] for a in list(accumulated_allele_data.values())],
-                analysis_id,
-                segregation_results,
-            )
             for allele_id, sample_data in allele_id_sample_data.items():
                 accumulated_allele_data[allele_id][KEY_SAMPLES] = sample_data
 
@@ -855,7 +859,7 @@ class AlleleDataLoader(object):
         # Create final data
 
         # If genepanel is provided, get annotation transcripts filtered on genepanel
-        annotation_transcripts = None
+        annotation_transcripts_by_allele_id = defaultdict(set)
         if genepanel:
             # sometimes we need to limit the amount of annotation data to load
             annotation_transcripts_genepanel = queries.annotation_transcripts_genepanel(
@@ -872,8 +876,10 @@ class AlleleDataLoader(object):
                 .filter(annotation_transcripts_genepanel.c.allele_id.in_(allele_ids))
                 .all()
             )
+            for a in annotation_transcripts:
+                annotation_transcripts_by_allele_id[a.allele_id].add(a.annotation_transcript)
 
-        inclusion_regex_filtered = None
+        inclusion_transcripts_by_allele_id = defaultdict(set)
         if self.inclusion_regex:
             inclusion_regex_filtered = (
                 self.session.query(
@@ -889,6 +895,8 @@ class AlleleDataLoader(object):
                 .distinct()
                 .all()
             )
+            for allele_id, transcript in inclusion_regex_filtered:
+                inclusion_transcripts_by_allele_id[allele_id].add(transcript)
 
         final_alleles = list()
         for allele_id in allele_ids:
@@ -916,21 +924,12 @@ class AlleleDataLoader(object):
                 transcripts_in_genepanel = set()
                 if "transcripts" in annotation_data:
                     # 'filtered_transcripts' -> transcripts in our genepanel
-                    if annotation_transcripts:
-                        transcripts_in_genepanel = set(
-                            [
-                                a.annotation_transcript
-                                for a in annotation_transcripts
-                                if a.allele_id == allele_id
-                            ]
-                        )
+                    transcripts_in_genepanel = set(
+                        annotation_transcripts_by_allele_id.get(allele_id, set())
+                    )
 
                     # Filter main transcript list on inclusion regex
-                    inclusion_transcripts = set()
-                    if inclusion_regex_filtered:
-                        inclusion_transcripts = set(
-                            [t[1] for t in inclusion_regex_filtered if t[0] == allele_id]
-                        )
+                    inclusion_transcripts = inclusion_transcripts_by_allele_id.get(allele_id, set())
 
                     to_include_transcripts = transcripts_in_genepanel | inclusion_transcripts
                     if to_include_transcripts:
@@ -972,16 +971,56 @@ class AlleleDataLoader(object):
             self.session, final_alleles, genepanel=genepanel, analysis_id=analysis_id
         ).get_warnings()
 
+        final_alleles_by_id = {f["id"]: f for f in final_alleles}
         for allele_id in allele_ids:
-            final_allele = next(f for f in final_alleles if f["id"] == allele_id)
+            final_allele = final_alleles_by_id[allele_id]
             final_allele["tags"] = sorted(list(allele_ids_tags.get(allele_id, [])))
 
         for allele_id, warnings in allele_ids_warnings.items():
-            final_allele = next(f for f in final_alleles if f["id"] == allele_id)
+            final_allele = final_alleles_by_id[allele_id]
             final_allele["warnings"] = warnings
 
         return final_alleles
 
+    def iter_from_ids(self, allele_ids, chunk_size=DEFAULT_CHUNK_SIZE, **kwargs):
+        """
+        Generator version of from_objs(), taking allele ids instead of allele objects.
+
+        The alleles are loaded and yielded chunk_size at a time, in the order of allele_ids,
+        so only one chunk of database objects and serialized data is kept in memory at once.
+        Ids not found in the database are skipped.
+
+        Segregation results (if filterconfig_id and analysis_id are given) are computed
+        once for all the alleles, since they depend on the other alleles in the set.
+
+        :param allele_ids: List of allele ids.
+        :param chunk_size: Number of alleles to load per chunk.
+        :param kwargs: Passed on to from_objs().
+        """
+        assert chunk_size > 0, "chunk_size must be a positive number"
+        allele_ids = list(allele_ids)
+
+        if (
+            kwargs.get("analysis_id")
+            and kwargs.get("filterconfig_id") is not None
+            and kwargs.get("segregation_results") is None
+            and allele_ids
+        ):
+            kwargs["segregation_results"] = self._get_segregation_results(
+                allele_ids, kwargs["analysis_id"], kwargs["filterconfig_id"]
+            )
+
+        for i in range(0, len(allele_ids), chunk_size):
+            chunk_allele_ids = allele_ids[i : i + chunk_size]
+            alleles_by_id = {
+                a.id: a
+                for a in self.session.query(allele.Allele).filter(
+                    allele.Allele.id.in_(chunk_allele_ids)
+                )
+            }
+            alleles = [alleles_by_id[aid] for aid in chunk_allele_ids if aid in alleles_by_id]
+            yield from self.from_objs(alleles, **kwargs)
+
     def dump(self, accumulator, allowed_allele_ids, items, schema, key, use_list=False):
         """
 
@@ -994,9 +1033,10 @@ class AlleleDataLoader(object):
         :return:
 
         """
+        allowed_allele_ids = set(allowed_allele_ids)
         for item in items:
             if item.allele_id not in allowed_allele_ids:
-                return
+                continue
             if use_list:
                 if key not in accumulator[item.allele_id]:
                     accumulator[item.allele_id][key] = list()
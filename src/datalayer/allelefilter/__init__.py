@@ -1 +1,4 @@
 from .allelefilter import AlleleFilter
+from .filterresultcache import FilterResultCache, filter_result_cache
+from .frequencystore import FrequencyStore, frequency_store
+from .regionindex import RegionIndex, RegionIndexCache, region_index_cache
@@ -1,9 +1,13 @@
 from typing import Any, Dict, List, Optional, Set, Tuple, Sequence, Callable
+import copy
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy.orm.session import Session
 
 from api.config import config as global_config
 from vardb.datamodel import sample
+from vardb.util.extended_query import ExtendedQuery
 
 from datalayer.allelefilter.frequencyfilter import FrequencyFilter
 from datalayer.allelefilter.segregationfilter import SegregationFilter
@@ -15,15 +19,39 @@ from datalayer.allelefilter.polypyrimidinetractfilter import PolypyrimidineTract
 from datalayer.allelefilter.consequencefilter import ConsequenceFilter
 from datalayer.allelefilter.inheritancemodelfilter import InheritanceModelFilter
 from datalayer.allelefilter.genefilter import GeneFilter
+from datalayer.allelefilter.genotypetable import shared_genotype_tables
 
 
 log = logging.getLogger(__name__)
 
 
 class AlleleFilter(object):
-    def __init__(self, session: Session, config: Optional[Dict] = None) -> None:
+    # Filters where the result for an allele does not depend on the other alleles in the input.
+    # Running these on all alleles, and intersecting with the alleles remaining when the filter
+    # is reached, gives the same result as running them on the remaining alleles only.
+    INDEPENDENT_FILTERS = {
+        "frequency",
+        "region",
+        "classification",
+        "external",
+        "ppy",
+        "consequence",
+        "gene",
+    }
+
+    def __init__(self, session: Session, config: Optional[Dict] = None, workers: int = 0) -> None:
+        """
+        :param workers: If > 1, independent filters in filter_analysis() are run concurrently,
+            each on its own session/connection from the session's connection pool.
+            Worker sessions do not see uncommitted data in `session`, so only use this
+            when filtering committed data.
+        """
         self.session = session
         self.config = global_config if not config else config
+        self.workers = workers
+        self.independent_filters = set(self.INDEPENDENT_FILTERS)
+        # Time spent (in seconds) per filter in last call to filter_analysis()
+        self.filter_timings: Dict[str, float] = dict()
 
         self.filter_functions: Dict[str, Tuple[str, Callable]] = {
             "frequency": ("allele", FrequencyFilter(self.session, self.config).filter_alleles),
@@ -72,6 +100,68 @@ class AlleleFilter(object):
 
         return filter_exceptions
 
+    @staticmethod
+    def _bind_to_session(filter_function: Callable, session: Session) -> Callable:
+        """
+        Returns filter_function bound to a copy of its filter object using session instead.
+        Functions not bound to a filter object are returned as is.
+        """
+        filter_obj = getattr(filter_function, "__self__", None)
+        if filter_obj is None or not hasattr(filter_obj, "session"):
+            return filter_function
+        worker_filter_obj = copy.copy(filter_obj)
+        worker_filter_obj.session = session
+        return getattr(worker_filter_obj, filter_function.__name__)
+
+    def _run_independent_filters(
+        self,
+        filters: List[Dict[str, Any]],
+        analysis_genepanel: Tuple[str, str],
+        allele_ids: Set[int],
+    ) -> Dict[int, Set[int]]:
+        """
+        Runs the independent filters among filters concurrently on all allele_ids.
+
+        Returns filter results per index in filters.
+        """
+        planned = [
+            idx
+            for idx, f in enumerate(filters)
+            if f["name"] in self.independent_filters
+            and self.filter_functions[f["name"]][0] == "allele"
+        ]
+        if self.workers < 2 or len(planned) < 2:
+            return {}
+
+        bind = self.session.get_bind()
+
+        def run_filter(idx):
+            name = filters[idx]["name"]
+            start = time.perf_counter()
+            worker_session = Session(bind=bind, query_cls=ExtendedQuery)
+            try:
+                filter_function = self._bind_to_session(
+                    self.filter_functions[name][1], worker_session
+                )
+                result = filter_function(
+                    {analysis_genepanel: set(allele_ids)}, filters[idx]["config"]
+                )
+                return set(result[analysis_genepanel]), time.perf_counter() - start
+            except Exception:
+                log.error("Error while running filter '{}'".format(name))
+                raise
+            finally:
+                worker_session.close()
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(planned))) as executor:
+            futures = {idx: executor.submit(run_filter, idx) for idx in planned}
+            results = dict()
+            for idx, future in futures.items():
+                results[idx], seconds = future.result()
+                name = filters[idx]["name"]
+                self.filter_timings[name] = self.filter_timings.get(name, 0.0) + seconds
+        return results
+
     def filter_analysis(self, filter_config_id: int, analysis_id: int, allele_ids: Sequence[int]):
         """
         Filters alleles for a single analysis.
@@ -85,9 +175,14 @@ class AlleleFilter(object):
                     'segregation': [6, 8],
                 }
             }
+
+        If self.workers > 1, the independent filters are run concurrently up front on all
+        allele_ids. The remaining filters and all filter exceptions are run in order as usual,
+        so the result is identical to running all filters sequentially.
         """
 
         copied_allele_ids = set(allele_ids)
+        self.filter_timings = dict()
 
         analysis_genepanel = (
             self.session.query(sample.Analysis.genepanel_name, sample.Analysis.genepanel_version)
@@ -105,54 +200,75 @@ class AlleleFilter(object):
 
         filters = filter_config["filters"]
         for f in filters:
-            name = f["name"]
-            if name not in self.filter_functions:
-                raise RuntimeError("Requested filter {} is not a valid filter name".format(name))
-
-            try:
-                filter_config = f["config"]
-                exceptions_config = f.get("exceptions", [])
-
-                filter_data_type, filter_function = self.filter_functions[name]
-                assert filter_data_type in [
-                    "allele",
-                    "analysis",
-                ], "Unknown filter data type '{}'".format(filter_data_type)
-
-                if filter_data_type == "analysis":
-                    filtered_allele_ids = filter_function(
-                        {analysis_id: copied_allele_ids}, filter_config
-                    )[analysis_id]
-                elif filter_data_type == "allele":
-                    filtered_allele_ids = filter_function(
-                        {analysis_genepanel: copied_allele_ids}, filter_config
-                    )[analysis_genepanel]
-
-                # We send in copied_allele_ids for the exception analysis filters
-                # since they might need to take all alleles before filtering into account,
-                # not just the result from the filter.
-                # E.g. if excepting compound heterozygote candidates,
-                # while just one was filtered, you need to see all candidates
-                # in the gene to see that they might be compound candidates
-                filter_exceptions = self.get_filter_exceptions(
-                    exceptions_config,
-                    {analysis_genepanel: filtered_allele_ids},
-                    {analysis_id: copied_allele_ids},
+            if f["name"] not in self.filter_functions:
+                raise RuntimeError(
+                    "Requested filter {} is not a valid filter name".format(f["name"])
                 )
 
-                filtered_allele_ids = set(filtered_allele_ids) - filter_exceptions
-                # Ensure that filter doesn't return allele_ids not part of input
-                assert not copied_allele_ids - set(
-                    allele_ids
-                ), f"Filter {name} returned allele_ids not in input"
-
-                result["excluded_allele_ids"][name] = sorted(list(filtered_allele_ids))
-                copied_allele_ids -= filtered_allele_ids
-
-            except Exception:
-                log.error("Error while running filter '{}'".format(name))
-                raise
+        precomputed = self._run_independent_filters(filters, analysis_genepanel, copied_allele_ids)
+
+        # Segregation, inheritance model and quality filters (and their exceptions) work on
+        # genotype tables for the same samples, share them for the whole run
+        with shared_genotype_tables(self.session):
+            for idx, f in enumerate(filters):
+                name = f["name"]
+                start = time.perf_counter()
+                try:
+                    filter_config = f["config"]
+                    exceptions_config = f.get("exceptions", [])
+
+                    filter_data_type, filter_function = self.filter_functions[name]
+                    assert filter_data_type in [
+                        "allele",
+                        "analysis",
+                    ], "Unknown filter data type '{}'".format(filter_data_type)
+
+                    if idx in precomputed:
+                        filtered_allele_ids = precomputed[idx] & copied_allele_ids
+                    elif filter_data_type == "analysis":
+                        filtered_allele_ids = filter_function(
+                            {analysis_id: copied_allele_ids}, filter_config
+                        )[analysis_id]
+                    elif filter_data_type == "allele":
+                        filtered_allele_ids = filter_function(
+                            {analysis_genepanel: copied_allele_ids}, filter_config
+                        )[analysis_genepanel]
+
+                    # We send in copied_allele_ids for the exception analysis filters
+                    # since they might need to take all alleles before filtering into account,
+                    # not just the result from the filter.
+                    # E.g. if excepting compound heterozygote candidates,
+                    # while just one was filtered, you need to see all candidates
+                    # in the gene to see that they might be compound candidates
+                    filter_exceptions = self.get_filter_exceptions(
+                        exceptions_config,
+                        {analysis_genepanel: filtered_allele_ids},
+                        {analysis_id: copied_allele_ids},
+                    )
+
+                    filtered_allele_ids = set(filtered_allele_ids) - filter_exceptions
+                    # Ensure that filter doesn't return allele_ids not part of input
+                    assert not copied_allele_ids - set(
+                        allele_ids
+                    ), f"Filter {name} returned allele_ids not in input"
+
+                    result["excluded_allele_ids"][name] = sorted(list(filtered_allele_ids))
+                    copied_allele_ids -= filtered_allele_ids
+
+                except Exception:
+                    log.error("Error while running filter '{}'".format(name))
+                    raise
+
+                self.filter_timings[name] = (
+                    self.filter_timings.get(name, 0.0) + time.perf_counter() - start
+                )
 
+        log.debug(
+            "Filter timings for analysis {}: {}".format(
+                analysis_id,
+                ", ".join("{}: {:.2f}s".format(k, v) for k, v in self.filter_timings.items()),
+            )
+        )
         result["allele_ids"] = sorted(list(copied_allele_ids))
         return result
 
@@ -0,0 +1,99 @@
+"""
+In-memory evaluation of the compound heterozygous rules (Kamphans T et al. (2013)) on a
+genotype matrix, see SegregationFilter.compound_heterozygous().
+
+Genotypes are integer coded (see GENOTYPE_CODES), with one row per allele and one column
+per sample, so that the per allele rules are vectorized comparisons, and the per gene rules
+are grouped counts over (allele, gene) pairs.
+"""
+from typing import Iterable, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+NULL = 0
+REFERENCE = 1
+HETEROZYGOUS = 2
+HOMOZYGOUS = 3
+NO_COVERAGE = 4
+
+GENOTYPE_CODES = {
+    None: NULL,
+    "Reference": REFERENCE,
+    "Heterozygous": HETEROZYGOUS,
+    "Homozygous": HOMOZYGOUS,
+    "No coverage": NO_COVERAGE,
+}
+
+
+def encode_genotypes(rows: Sequence[Sequence[Optional[str]]], num_samples: int) -> np.ndarray:
+    "Returns the genotype types (e.g. 'Heterozygous') as an integer coded matrix"
+    return np.array([[GENOTYPE_CODES[t] for t in row] for row in rows], dtype=np.int8).reshape(
+        len(rows), num_samples
+    )
+
+
+def compound_heterozygous_candidates(
+    genotypes: np.ndarray,
+    affected: Sequence[int],
+    unaffected: Sequence[int],
+    father: Optional[int] = None,
+    mother: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Returns a boolean mask of the rows in genotypes that are candidates for compound
+    heterozygosity (rules 1-3). Samples are given as column indices in genotypes.
+    """
+    candidates = np.ones(genotypes.shape[0], dtype=bool)
+
+    # 1. A variant has to be in a heterozygous state in all affected individuals.
+    for s in affected:
+        candidates &= genotypes[:, s] == HETEROZYGOUS
+
+    # 2. A variant must not occur in a homozygous state in any of the unaffected individuals.
+    # (missing genotypes are treated as Reference)
+    for s in unaffected:
+        candidates &= genotypes[:, s] != HOMOZYGOUS
+
+    # 3. A variant that is heterozygous in an affected child must be
+    #    heterozygous in exactly one of the parents.
+    # Note: This will also exclude any alleles with 'No coverage' in either parent.
+    if father is not None and mother is not None:
+        candidates &= (
+            (genotypes[:, father] == HETEROZYGOUS) & (genotypes[:, mother] == REFERENCE)
+        ) | ((genotypes[:, father] == REFERENCE) & (genotypes[:, mother] == HETEROZYGOUS))
+
+    return candidates
+
+
+def compound_heterozygous_genes(
+    allele_genes: Iterable[Tuple[int, str]],
+    father_heterozygous: Optional[Set[int]] = None,
+    mother_heterozygous: Optional[Set[int]] = None,
+) -> Set[int]:
+    """
+    Returns the candidate alleles in genes satisfying rules 4 and 5.
+
+    4. A gene must have two or more heterozygous variants in each of the affected individuals.
+    5. There must be at least one variant transmitted from the paternal side
+       and one transmitted from the maternal side.
+
+    :param allele_genes: (allele_id, gene symbol) pairs for the candidate alleles
+    :param father_heterozygous: Candidate alleles heterozygous in father. Rule 5 is only checked
+        if both father_heterozygous and mother_heterozygous are given.
+    """
+    distinct_allele_genes = set((a, g) for a, g in allele_genes if g is not None)
+    if not distinct_allele_genes:
+        return set()
+
+    ids, genes = zip(*distinct_allele_genes)
+    allele_ids = np.array(ids, dtype=np.int64)
+    _, gene_idx = np.unique(np.array(genes, dtype=object), return_inverse=True)
+
+    # Rule 1 already requires the candidates to be heterozygous in all affected
+    gene_passes = np.bincount(gene_idx) > 1
+    if father_heterozygous is not None and mother_heterozygous is not None:
+        for parent_heterozygous in [father_heterozygous, mother_heterozygous]:
+            is_heterozygous = np.array([a in parent_heterozygous for a in allele_ids.tolist()])
+            gene_passes &= np.bincount(gene_idx, weights=is_heterozygous) > 0
+
+    return set(allele_ids[gene_passes[gene_idx]].tolist())
@@ -1,8 +1,105 @@
+from collections import defaultdict
+from functools import lru_cache
 from math import log10
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
 
 MUTATION_PRIOR = 1e-8
 DEFAULT_FREQ = 0.1
 
+GENOTYPES = [(0, 0), (0, 1), (1, 1)]
+GENOTYPES_X = [(0,), (1,)]
+
+
+# A priori probability of mutation
+def _priors(is_x_minus_par):
+    logfr = [log10(1 - DEFAULT_FREQ), log10(DEFAULT_FREQ)]
+    log_hardy_weinberg = [2 * logfr[0], log10(2) + logfr[0] + logfr[1], 2 * logfr[1]]
+    if is_x_minus_par:
+        return log_hardy_weinberg, logfr
+    else:
+        return log_hardy_weinberg, log_hardy_weinberg
+
+
+# Probability of child getting alleles from mother/father given genotypes
+def _single_transmit(parent, child):
+    if child in parent and parent[0] == parent[1]:
+        # Probability of getting an allele from homozygous parent
+        return 1 - MUTATION_PRIOR
+    elif child in parent:
+        # Probability of getting an allele from heterozygous parent
+        return 0.5
+    else:
+        # Probability of a denovo mutation
+        return MUTATION_PRIOR
+
+
+class TrioTransmit(object):
+    def __init__(self, is_x_minus_par, proband_male):
+        self.is_x_minus_par = is_x_minus_par
+        self.proband_male = proband_male
+
+        if self.is_x_minus_par and self.proband_male:
+            # No transmission from father to boy on X (minus PAR) chromosome
+            self.transmit_father = None
+        elif self.is_x_minus_par and not self.proband_male:
+            # Since father only has one copy to inherit from, chance of inheriting is either very high (father has allele)
+            # or very low (father does not have allele)
+            self.transmit_father = lambda f, c: 1 - MUTATION_PRIOR if f == c else MUTATION_PRIOR
+        else:
+            self.transmit_father = _single_transmit
+
+        self.transmit_mother = _single_transmit
+
+    def __call__(self, father, mother, child):
+        if self.is_x_minus_par and self.proband_male:
+            # No transmission from father to boy on X (minus PAR) chromosome
+            return self.transmit_mother(mother, child[0])
+        elif child[0] == child[1]:
+            # Child is homozygous, probability of inheriting from both mother and father
+            return self.transmit_father(father, child[0]) * self.transmit_mother(mother, child[0])
+        else:
+            # Child is heterozygous, probability of inheriting from mother + probability of inheriting from father
+            return self.transmit_father(father, child[0]) * self.transmit_mother(
+                mother, child[1]
+            ) + self.transmit_father(father, child[0]) * self.transmit_mother(mother, child[1])
+
+
+@lru_cache(maxsize=None)
+def log_transmission_matrix(is_x_minus_par: bool, proband_male: bool) -> np.ndarray:
+    """
+    Returns log10 of transmission probabilities as a read-only (father, mother, child) array,
+    indexed by genotype index. Computed once per mode.
+    """
+    if is_x_minus_par and proband_male:
+        child_gt = GENOTYPES_X
+        father_gt = GENOTYPES_X
+    elif is_x_minus_par and not proband_male:
+        father_gt = GENOTYPES_X
+        child_gt = GENOTYPES
+    else:
+        father_gt = GENOTYPES
+        child_gt = GENOTYPES
+    mother_gt = GENOTYPES
+    trio_transmit = TrioTransmit(is_x_minus_par, proband_male)
+
+    matrix = np.array(
+        [[[log10(trio_transmit(f, m, c)) for c in child_gt] for m in mother_gt] for f in father_gt]
+    )
+    matrix.setflags(write=False)
+    return matrix
+
+
+def _remove_x_heterozygous(pl_c, pl_f, is_x_minus_par, proband_male):
+    # Remove PL for genotype 0/1 (if exists) if X chromosome for father and proband if proband is male
+    # If PL length is 2, then this will not change anything
+    if is_x_minus_par:
+        pl_f = [pl_f[0], pl_f[-1]]
+        if proband_male:
+            pl_c = [pl_c[0], pl_c[-1]]
+    return pl_c, pl_f
+
 
 def denovo_probability(pl_c, pl_f, pl_m, is_x_minus_par, proband_male, denovo_mode):
     """
@@ -16,88 +113,10 @@ def denovo_probability(pl_c, pl_f, pl_m, is_x_minus_par, proband_male, denovo_mo
     https://academic.oup.com/bioinformatics/article/32/10/1592/1743466
     """
 
-    # A priori probability of mutation
-    def priors(is_x_minus_par):
-        logfr = [log10(1 - DEFAULT_FREQ), log10(DEFAULT_FREQ)]
-        log_hardy_weinberg = [2 * logfr[0], log10(2) + logfr[0] + logfr[1], 2 * logfr[1]]
-        if is_x_minus_par:
-            return log_hardy_weinberg, logfr
-        else:
-            return log_hardy_weinberg, log_hardy_weinberg
-
-    # Probability of child getting alleles from mother/father given genotypes
-    def _single_transmit(parent, child):
-        if child in parent and parent[0] == parent[1]:
-            # Probability of getting an allele from homozygous parent
-            return 1 - MUTATION_PRIOR
-        elif child in parent:
-            # Probability of getting an allele from heterozygous parent
-            return 0.5
-        else:
-            # Probability of a denovo mutation
-            return MUTATION_PRIOR
-
-    class TrioTransmit(object):
-        def __init__(self, is_x_minus_par, proband_male):
-            self.is_x_minus_par = is_x_minus_par
-            self.proband_male = proband_male
-
-            if self.is_x_minus_par and self.proband_male:
-                # No transmission from father to boy on X (minus PAR) chromosome
-                self.transmit_father = None
-            elif self.is_x_minus_par and not self.proband_male:
-                # Since father only has one copy to inherit from, chance of inheriting is either very high (father has allele)
-                # or very low (father does not have allele)
-                self.transmit_father = lambda f, c: 1 - MUTATION_PRIOR if f == c else MUTATION_PRIOR
-            else:
-                self.transmit_father = _single_transmit
-
-            self.transmit_mother = _single_transmit
-
-        def __call__(self, father, mother, child):
-            if self.is_x_minus_par and self.proband_male:
-                # No transmission from father to boy on X (minus PAR) chromosome
-                return self.transmit_mother(mother, child[0])
-            elif child[0] == child[1]:
-                # Child is homozygous, probability of inheriting from both mother and father
-                return self.transmit_father(father, child[0]) * self.transmit_mother(
-                    mother, child[0]
-                )
-            else:
-                # Child is heterozygous, probability of inheriting from mother + probability of inheriting from father
-                return self.transmit_father(father, child[0]) * self.transmit_mother(
-                    mother, child[1]
-                ) + self.transmit_father(father, child[0]) * self.transmit_mother(mother, child[1])
-
-    class LogTransmissionMatrix(object):
-        def __init__(self, is_x_minus_par, proband_male):
-            gt = [(0, 0), (0, 1), (1, 1)]
-            gtx = [(0,), (1,)]
-
-            if is_x_minus_par and proband_male:
-                self.child_gt = gtx
-                self.father_gt = gtx
-            elif is_x_minus_par and not proband_male:
-                self.father_gt = gtx
-                self.child_gt = gt
-            else:
-                self.father_gt = gt
-                self.child_gt = gt
-            self.mother_gt = gt
-            self.trio_transmit = TrioTransmit(is_x_minus_par, proband_male)
-
-        def __call__(self, f, m, c):
-            return log10(self.trio_transmit(self.father_gt[f], self.mother_gt[m], self.child_gt[c]))
-
-    # Remove PL for genotype 0/1 (if exists) if X chromosome for father and proband if proband is male
-    # If PL length is 2, then this will not change anything
-    if is_x_minus_par:
-        pl_f = [pl_f[0], pl_f[-1]]
-        if proband_male:
-            pl_c = [pl_c[0], pl_c[-1]]
+    pl_c, pl_f = _remove_x_heterozygous(pl_c, pl_f, is_x_minus_par, proband_male)
 
-    mo_prior, fa_prior = priors(is_x_minus_par)
-    log_transmission_matrix = LogTransmissionMatrix(is_x_minus_par, proband_male)
+    mo_prior, fa_prior = _priors(is_x_minus_par)
+    transmission = log_transmission_matrix(is_x_minus_par, proband_male)
 
     # Compute relative likelihoods of all genotype combinations, using the phred scaled genotype likelihoods
     sum_liks = 0
@@ -107,7 +126,7 @@ def denovo_probability(pl_c, pl_f, pl_m, is_x_minus_par, proband_male, denovo_mo
                 lh = (
                     fa_prior[fi]
                     + mo_prior[mi]
-                    + log_transmission_matrix(fi, mi, ci)
+                    + float(transmission[fi, mi, ci])
                     - (_pl_f + _pl_m + _pl_c) / 10
                 )
                 sum_liks += pow(10, lh)
@@ -118,9 +137,84 @@ def denovo_probability(pl_c, pl_f, pl_m, is_x_minus_par, proband_male, denovo_mo
         10,
         fa_prior[f]
         + mo_prior[m]
-        + log_transmission_matrix(f, m, c)
+        + float(transmission[f, m, c])
         - (pl_f[f] + pl_m[m] + pl_c[c]) / 10,
     )
 
     # Normalize likelihood to probability
     return lh / sum_liks
+
+
+def batch_denovo_probability(
+    pl_c: Sequence[Sequence[int]],
+    pl_f: Sequence[Sequence[int]],
+    pl_m: Sequence[Sequence[int]],
+    is_x_minus_par: bool,
+    proband_male: bool,
+    denovo_modes: Sequence[Sequence[int]],
+) -> List[float]:
+    """
+    Vectorized denovo_probability() for many alleles with the same is_x_minus_par and proband_male.
+
+    pl_c, pl_f, pl_m and denovo_modes hold one entry per allele. Alleles are grouped by the
+    number of PLs given, and each group is evaluated as array operations, in the same
+    order as denovo_probability(), so the results are identical.
+    (np.float_power is used, since np.power can differ from math.pow in the last digit.)
+    """
+    assert len(pl_c) == len(pl_f) == len(pl_m) == len(denovo_modes)
+
+    mo_prior, fa_prior = _priors(is_x_minus_par)
+    transmission = log_transmission_matrix(is_x_minus_par, proband_male)
+
+    groups: Dict[Tuple[int, int, int], List[int]] = defaultdict(list)
+    for idx, lengths in enumerate(zip(map(len, pl_f), map(len, pl_m), map(len, pl_c))):
+        groups[lengths].append(idx)
+
+    result = np.empty(len(pl_c))
+    for indexes in groups.values():
+        if len(groups) == 1:
+            group_pl_c, group_pl_f, group_pl_m = np.array(pl_c), np.array(pl_f), np.array(pl_m)
+            modes = np.array(denovo_modes)
+        else:
+            group_pl_c = np.array([pl_c[i] for i in indexes])
+            group_pl_f = np.array([pl_f[i] for i in indexes])
+            group_pl_m = np.array([pl_m[i] for i in indexes])
+            modes = np.array([denovo_modes[i] for i in indexes])
+
+        # Same as _remove_x_heterozygous()
+        if is_x_minus_par:
+            group_pl_f = group_pl_f[:, [0, -1]]
+            if proband_male:
+                group_pl_c = group_pl_c[:, [0, -1]]
+
+        # Compute relative likelihoods of all genotype combinations, using the phred scaled genotype likelihoods
+        sum_liks = np.zeros(len(indexes))
+        for fi in range(group_pl_f.shape[1]):
+            for mi in range(group_pl_m.shape[1]):
+                for ci in range(group_pl_c.shape[1]):
+                    lh = (
+                        fa_prior[fi]
+                        + mo_prior[mi]
+                        + float(transmission[fi, mi, ci])
+                        - (group_pl_f[:, fi] + group_pl_m[:, mi] + group_pl_c[:, ci]) / 10
+                    )
+                    sum_liks += np.float_power(10.0, lh)
+
+        # Compute likelihood of the given denovo modes
+        f, m, c = modes[:, 0], modes[:, 1], modes[:, 2]
+        rows = np.arange(len(indexes))
+        lh = np.float_power(
+            10.0,
+            np.array(fa_prior)[f]
+            + np.array(mo_prior)[m]
+            + transmission[f, m, c]
+            - (group_pl_f[rows, f] + group_pl_m[rows, m] + group_pl_c[rows, c]) / 10,
+        )
+
+        # Normalize likelihood to probability
+        if not sum_liks.all():
+            # Same as denovo_probability() when all likelihoods underflow
+            raise ZeroDivisionError("float division by zero")
+        result[indexes] = lh / sum_liks
+
+    return result.tolist()
@@ -0,0 +1,137 @@
+import copy
+import datetime
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Sequence, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm.session import Session
+
+from vardb.datamodel import annotation, assessment, genotype, sample
+from datalayer.allelefilter.allelefilter import AlleleFilter
+
+log = logging.getLogger(__name__)
+
+
+class FilterResultCache(object):
+    """
+    Process local LRU cache of AlleleFilter.filter_analysis() results.
+
+    Results are keyed on (analysis id, filter config id, data version, allele ids), where the data
+    version is a stamp of the newest annotation, custom annotation, allele assessment, sample and
+    genotype rows relevant for the analysis. Any change to these creates new rows (or removes rows),
+    so cached results are invalidated automatically.
+
+    Filter configs are never changed in place (a new row is created instead), and the application
+    config is only read on startup, so neither needs to be part of the data version.
+    The current date is included, since the classification filter can depend on the
+    age of the assessments.
+    """
+
+    def __init__(self, maxsize: int = 64) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._results: "OrderedDict[Hashable, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def data_version(session: Session, analysis_id: int) -> Tuple:
+        """
+        Returns a stamp that changes whenever the data used by the filters for an analysis changes.
+        All counts and max ids are fetched in a single query.
+        """
+        sample_ids = session.query(sample.Sample.id).filter(
+            sample.Sample.analysis_id == analysis_id
+        )
+        analysis_allele_ids = (
+            session.query(genotype.Genotype.allele_id)
+            .filter(genotype.Genotype.sample_id.in_(sample_ids))
+            .union(
+                session.query(genotype.Genotype.secondallele_id).filter(
+                    genotype.Genotype.sample_id.in_(sample_ids),
+                    genotype.Genotype.secondallele_id.isnot(None),
+                )
+            )
+        )
+
+        stamped = [
+            (sample.Sample, sample.Sample.analysis_id == analysis_id),
+            (genotype.Genotype, genotype.Genotype.sample_id.in_(sample_ids)),
+            (annotation.Annotation, annotation.Annotation.allele_id.in_(analysis_allele_ids)),
+            (
+                annotation.CustomAnnotation,
+                annotation.CustomAnnotation.allele_id.in_(analysis_allele_ids),
+            ),
+            (
+                assessment.AlleleAssessment,
+                assessment.AlleleAssessment.allele_id.in_(analysis_allele_ids),
+            ),
+        ]
+
+        columns = []
+        for model, criterion in stamped:
+            columns.append(session.query(func.count(model.id)).filter(criterion).as_scalar())
+            columns.append(session.query(func.max(model.id)).filter(criterion).as_scalar())
+
+        return tuple(session.query(*columns).one()) + (datetime.date.today(),)
+
+    def filter_analysis(
+        self,
+        session: Session,
+        filter_config_id: int,
+        analysis_id: int,
+        allele_ids: Sequence[int],
+        allele_filter: Optional[AlleleFilter] = None,
+        workers: int = 0,
+    ) -> Dict[str, Any]:
+        """
+        Same as AlleleFilter(session, workers=workers).filter_analysis(
+            filter_config_id, analysis_id, allele_ids
+        ), returning a cached result when the underlying data is unchanged.
+        """
+        allele_ids_digest = hashlib.sha1(
+            ",".join(str(a) for a in sorted(allele_ids)).encode()
+        ).hexdigest()
+        key = (
+            analysis_id,
+            filter_config_id,
+            self.data_version(session, analysis_id),
+            allele_ids_digest,
+        )
+
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(result)
+            self.misses += 1
+
+        if allele_filter is None:
+            allele_filter = AlleleFilter(session, workers=workers)
+        result = allele_filter.filter_analysis(filter_config_id, analysis_id, allele_ids)
+
+        with self._lock:
+            self._results[key] = copy.deepcopy(result)
+            self._results.move_to_end(key)
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+
+        log.debug(
+            "Filter result cache miss for analysis {}, filter config {} ({} hits, {} misses)".format(
+                analysis_id, filter_config_id, self.hits, self.misses
+            )
+        )
+        return result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._results.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+filter_result_cache = FilterResultCache()
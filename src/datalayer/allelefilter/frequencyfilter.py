@@ -1,19 +1,39 @@
 import copy
-from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
 from collections import OrderedDict
-from sqlalchemy import or_, and_, tuple_
+import numpy as np
+from sqlalchemy import or_, and_
 from sqlalchemy.orm.session import Session
 from sqlalchemy.sql.elements import BinaryExpression, BooleanClauseList
 
-from vardb.datamodel import gene, annotationshadow
+from vardb.datamodel import annotationshadow
 from datalayer import queries
+from datalayer.allelefilter.frequencystore import FrequencyStore, frequency_store as global_store
+
+# [(allele ids, thresholds, num_thresholds), ...]
+ThresholdGroups = List[Tuple[Set[int], Dict[str, Dict[str, float]], Dict[str, Dict[str, int]]]]
 
 
 class FrequencyFilter(object):
-    def __init__(self, session: Session, config: Dict[str, Any]) -> None:
+    def __init__(
+        self,
+        session: Session,
+        config: Dict[str, Any],
+        frequency_store: Optional[FrequencyStore] = None,
+    ) -> None:
+        """
+        :param frequency_store: If given, frequencies are classified in memory using the
+            FrequencyStore, instead of in the database. Defaults to the process wide store
+            if 'frequency_store' is enabled in the application config.
+        """
         self.session = session
         self.config = config
-        annotationshadow.check_db_consistency(self.session, self.config)
+        if frequency_store is None and self.config.get("app", {}).get("frequency_store", False):
+            frequency_store = global_store
+        self.frequency_store = frequency_store
+        # A subset, so that filtering keeps working when the shadow tables are rebuilt online
+        # for a config with added frequency groups, until ELLA is restarted with that config
+        annotationshadow.check_db_consistency(self.session, self.config, subset=True)
 
     @staticmethod
     def _get_freq_num_threshold_filter(
@@ -38,16 +58,14 @@ class FrequencyFilter(object):
 
         return None
 
-    def _get_freq_threshold_filter(
-        self,
-        frequency_groups,  # frequency groups tells us what should go into e.g. 'external' and 'internal' groups
-        thresholds: Dict[str, Dict[str, float]],
-        num_thresholds: Dict[str, Dict[str, int]],
-        threshold_func: Callable,
-        combine_func: Callable,
-    ) -> BooleanClauseList:
-
-        filters = list()
+    @staticmethod
+    def _iter_freq_thresholds(
+        frequency_groups, thresholds: Dict[str, Dict[str, float]]
+    ) -> Iterator[Tuple[Dict[str, float], str, str]]:
+        """
+        Yields (group thresholds, freq_provider, freq_key) for all frequency providers and keys
+        in the groups given in thresholds.
+        """
         for (
             group,
             group_thresholds,
@@ -61,12 +79,79 @@ class FrequencyFilter(object):
 
             for freq_provider, freq_keys in frequency_groups[group].items():
                 for freq_key in freq_keys:
-                    filters.append(
-                        threshold_func(num_thresholds, freq_provider, freq_key, group_thresholds)
-                    )
+                    yield group_thresholds, freq_provider, freq_key
+
+    def _get_freq_threshold_filter(
+        self,
+        frequency_groups,  # frequency groups tells us what should go into e.g. 'external' and 'internal' groups
+        thresholds: Dict[str, Dict[str, float]],
+        num_thresholds: Dict[str, Dict[str, int]],
+        threshold_func: Callable,
+        combine_func: Callable,
+    ) -> BooleanClauseList:
+
+        filters = list()
+        for group_thresholds, freq_provider, freq_key in self._iter_freq_thresholds(
+            frequency_groups, thresholds
+        ):
+            filters.append(
+                threshold_func(num_thresholds, freq_provider, freq_key, group_thresholds)
+            )
 
         return combine_func(*filters)
 
+    def _get_freq_threshold_mask(
+        self,
+        frequency_groups,
+        thresholds: Dict[str, Dict[str, float]],
+        num_thresholds: Dict[str, Dict[str, int]],
+        commonness_group: str,
+        values: np.ndarray,
+        column_index: Dict[str, int],
+    ) -> np.ndarray:
+        """
+        Vectorized version of _get_freq_threshold_filter() for frequency data from the
+        FrequencyStore, returning a boolean mask for the rows in values.
+        NaN (NULL) values never pass a threshold, like in the database.
+        """
+        masks = list()
+        with np.errstate(invalid="ignore"):
+            for group_thresholds, freq_provider, freq_key in self._iter_freq_thresholds(
+                frequency_groups, thresholds
+            ):
+                freq = values[:, column_index[freq_provider + "." + freq_key]]
+                if commonness_group == "null_freq":
+                    masks.append(np.isnan(freq))
+                    continue
+
+                if commonness_group == "common":
+                    mask = freq >= group_thresholds["hi_freq_cutoff"]
+                elif commonness_group == "less_common":
+                    mask = (freq < group_thresholds["hi_freq_cutoff"]) & (
+                        freq >= group_thresholds["lo_freq_cutoff"]
+                    )
+                elif commonness_group == "low_freq":
+                    mask = freq < group_thresholds["lo_freq_cutoff"]
+                else:
+                    raise RuntimeError("Unknown commonness group {}".format(commonness_group))
+
+                if freq_provider in num_thresholds and freq_key in num_thresholds[freq_provider]:
+                    num_threshold = num_thresholds[freq_provider][freq_key]
+                    assert isinstance(
+                        num_threshold, int
+                    ), "Provided frequency num threshold is not an integer"
+                    mask &= (
+                        values[:, column_index[freq_provider + "_num." + freq_key]] >= num_threshold
+                    )
+                masks.append(mask)
+
+        # Same as the empty and_()/or_() in the database filters
+        if not masks:
+            return np.ones(values.shape[0], dtype=bool)
+        if commonness_group == "null_freq":
+            return np.logical_and.reduce(masks)
+        return np.logical_or.reduce(masks)
+
     def _common_threshold(
         self,
         provider_numbers: Dict[str, Dict[str, int]],
@@ -164,16 +249,20 @@ class FrequencyFilter(object):
             annotationshadow.AnnotationShadowFrequency, freq_provider + "." + freq_key
         ).is_(None)
 
-    def _create_freq_filter(
-        self,
-        filter_config: Dict[str, Any],
-        genepanels: List[gene.Genepanel],
-        gp_allele_ids: Dict[Tuple[str, str], List[int]],
-        threshold_func: Callable,
-        combine_func: Callable,
-    ) -> Dict[Tuple[str, str], BooleanClauseList]:
+    def _get_threshold_groups(
+        self, filter_config: Dict[str, Any], gp_allele_ids: Dict[Tuple[str, str], List[int]]
+    ) -> Dict[Tuple[str, str], ThresholdGroups]:
+        """
+        Splits the allele ids for every genepanel into groups sharing the same thresholds.
 
-        gp_filter = dict()  # {('HBOC', 'v01'): <SQLAlchemy filter>, ...}
+        We have three types of groups:
+        1. Gene specific treshold overrides. Targets one gene.
+        2. AD specific thresholds. Targets set of genes with _only_ 'AD' inheritance.
+        3. The rest. Uses 'default' threshold, targeting all genes not in 1. and 2.
+        """
+
+        # {('HBOC', 'v01'): [(allele_ids, thresholds, num_thresholds), ...], ...}
+        gp_threshold_groups = dict()
 
         # Filter config could be loaded from json and have string keys for 'genes'
         # hgnc ids. We want to use int, so we convert the config.
@@ -188,13 +277,6 @@ class FrequencyFilter(object):
             allele_ids,
         ) in gp_allele_ids.items():  # loop over every genepanel, with related genes
 
-            # Create the different kinds of frequency filters
-            #
-            # We have three types of filters:
-            # 1. Gene specific treshold overrides. Targets one gene.
-            # 2. AD specific thresholds. Targets set of genes with _only_ 'AD' inheritance.
-            # 3. The rest. Uses 'default' threshold, targeting all genes not in 1. and 2.
-
             # Since the AnnotationShadowFrequency table doesn't include gene symbol,
             # we use AnnotationShadowTranscript to find allele_ids we'll include
             # for a given set of genes, according to genepanel
@@ -205,10 +287,10 @@ class FrequencyFilter(object):
             # "Compiling" queries is slow, so cache the slowest
             ast_gp_alleles = annotationshadow.AnnotationShadowTranscript.allele_id.in_(allele_ids)
 
-            gp_final_filter = list()
+            threshold_groups: ThresholdGroups = list()
 
             # 1. Gene specific thresholds
-            gene_specific_allele_ids = set()
+            gene_specific_allele_ids: Set[int] = set()
             if per_gene_hgnc_ids:
 
                 # Optimization: adding filters for genes not present in our alleles
@@ -237,27 +319,22 @@ class FrequencyFilter(object):
                         )
                     gene_filter_config.update(per_gene_config[hgnc_id])
 
-                    allele_ids_for_genes = self.session.query(
-                        annotationshadow.AnnotationShadowTranscript.allele_id
-                    ).filter(
-                        annotationshadow.AnnotationShadowTranscript.hgnc_id == hgnc_id,
-                        ast_gp_alleles,
+                    allele_ids_for_genes = set(
+                        self.session.query(annotationshadow.AnnotationShadowTranscript.allele_id)
+                        .filter(
+                            annotationshadow.AnnotationShadowTranscript.hgnc_id == hgnc_id,
+                            ast_gp_alleles,
+                        )
+                        .scalar_all()
                     )
 
                     # Update overridden allele ids: This will not be filtered on AD or default
-                    gene_specific_allele_ids.update(set([a[0] for a in allele_ids_for_genes]))
-                    gp_final_filter.append(
-                        and_(
-                            annotationshadow.AnnotationShadowFrequency.allele_id.in_(
-                                allele_ids_for_genes
-                            ),
-                            self._get_freq_threshold_filter(
-                                filter_config["groups"],
-                                gene_filter_config["thresholds"],
-                                gene_filter_config.get("num_thresholds", {}),
-                                threshold_func,
-                                combine_func,
-                            ),
+                    gene_specific_allele_ids.update(allele_ids_for_genes)
+                    threshold_groups.append(
+                        (
+                            allele_ids_for_genes,
+                            gene_filter_config["thresholds"],
+                            gene_filter_config.get("num_thresholds", {}),
                         )
                     )
 
@@ -265,7 +342,7 @@ class FrequencyFilter(object):
             ad_hgnc_ids = queries.distinct_inheritance_hgnc_ids_for_genepanel(
                 self.session, "AD", gp_key[0], gp_key[1]
             ).scalar_all()
-            ad_gene_allele_ids = set()
+            ad_gene_allele_ids: Set[int] = set()
             if ad_hgnc_ids:
                 ad_filters = [
                     annotationshadow.AnnotationShadowTranscript.hgnc_id.in_(ad_hgnc_ids),
@@ -287,40 +364,90 @@ class FrequencyFilter(object):
                     )
                 )
 
+                threshold_groups.append(
+                    (
+                        ad_gene_allele_ids,
+                        filter_config["thresholds"]["AD"],
+                        filter_config.get("num_thresholds", {}),
+                    )
+                )
+
+            # 3. 'default' thresholds (all allele_ids not in the two above cases)
+            default_allele_ids = set(allele_ids) - ad_gene_allele_ids - gene_specific_allele_ids
+            threshold_groups.append(
+                (
+                    default_allele_ids,
+                    filter_config["thresholds"]["default"],
+                    filter_config.get("num_thresholds", {}),
+                )
+            )
+
+            gp_threshold_groups[gp_key] = threshold_groups
+        return gp_threshold_groups
+
+    def _create_freq_filter(
+        self,
+        filter_config: Dict[str, Any],
+        gp_threshold_groups: Dict[Tuple[str, str], ThresholdGroups],
+        threshold_func: Callable,
+        combine_func: Callable,
+    ) -> Dict[Tuple[str, str], BooleanClauseList]:
+
+        gp_filter = dict()  # {('HBOC', 'v01'): <SQLAlchemy filter>, ...}
+
+        for gp_key, threshold_groups in gp_threshold_groups.items():
+            gp_final_filter = list()
+            for allele_ids, thresholds, num_thresholds in threshold_groups:
                 gp_final_filter.append(
                     and_(
-                        annotationshadow.AnnotationShadowFrequency.allele_id.in_(
-                            ad_gene_allele_ids
-                        ),
+                        annotationshadow.AnnotationShadowFrequency.allele_id.in_(allele_ids),
                         self._get_freq_threshold_filter(
                             filter_config["groups"],
-                            filter_config["thresholds"]["AD"],
-                            filter_config.get("num_thresholds", {}),
+                            thresholds,
+                            num_thresholds,
                             threshold_func,
                             combine_func,
                         ),
                     )
                 )
 
-            # 3. 'default' thresholds (all allele_ids not in the two above cases)
-            default_allele_ids = set(allele_ids) - ad_gene_allele_ids - gene_specific_allele_ids
-            gp_final_filter.append(
-                and_(
-                    annotationshadow.AnnotationShadowFrequency.allele_id.in_(default_allele_ids),
-                    self._get_freq_threshold_filter(
-                        filter_config["groups"],
-                        filter_config["thresholds"]["default"],
-                        filter_config.get("num_thresholds", {}),
-                        threshold_func,
-                        combine_func,
-                    ),
-                )
-            )
-
             # Construct final filter for the genepanel
             gp_filter[gp_key] = or_(*gp_final_filter)
         return gp_filter
 
+    def _get_commonness_from_store(
+        self,
+        filter_config: Dict[str, Any],
+        gp_threshold_groups: Dict[Tuple[str, str], ThresholdGroups],
+        commonness_group: str,
+        allele_ids: np.ndarray,
+        values: np.ndarray,
+        column_index: Dict[str, int],
+    ) -> Dict[Tuple[str, str], List[int]]:
+        """
+        Same as querying the database with the filters from _create_freq_filter(), using
+        the frequency data (for allele_ids) from the FrequencyStore.
+        """
+        row_index = {a: idx for idx, a in enumerate(allele_ids.tolist())}
+        gp_result = dict()
+        for gp_key, threshold_groups in gp_threshold_groups.items():
+            result: Set[int] = set()
+            for group_allele_ids, thresholds, num_thresholds in threshold_groups:
+                rows = np.array(
+                    [row_index[a] for a in group_allele_ids if a in row_index], dtype=np.int64
+                )
+                mask = self._get_freq_threshold_mask(
+                    filter_config["groups"],
+                    thresholds,
+                    num_thresholds,
+                    commonness_group,
+                    values[rows],
+                    column_index,
+                )
+                result.update(allele_ids[rows[mask]].tolist())
+            gp_result[gp_key] = list(result)
+        return gp_result
+
     def get_commonness_groups(
         self,
         gp_allele_ids: Dict[Tuple[str, str], List[int]],
@@ -397,14 +524,10 @@ class FrequencyFilter(object):
             self.session, {"frequencies": filter_config}, subset=True
         )
 
-        # First get all genepanel object for the genepanels given in input
-        genepanels = (
-            self.session.query(gene.Genepanel)
-            .filter(
-                tuple_(gene.Genepanel.name, gene.Genepanel.version).in_(list(gp_allele_ids.keys()))
-            )
-            .all()
-        )
+        for al_ids in gp_allele_ids.values():
+            assert all(isinstance(a, int) for a in al_ids)
+
+        gp_threshold_groups = self._get_threshold_groups(filter_config, gp_allele_ids)
 
         commonness_entries: List[Tuple[str, Dict]] = [("common", dict())]
         if not common_only:
@@ -417,6 +540,15 @@ class FrequencyFilter(object):
             commonness_entries
         )  # Ordered to get final_result processing correct later
 
+        if self.frequency_store is not None:
+            columns = [
+                c for c, _ in annotationshadow.iter_config_columns({"frequencies": filter_config})
+            ]
+            column_index = {c: idx for idx, c in enumerate(columns)}
+            store_allele_ids, values = self.frequency_store.get(
+                self.session, [a for al_ids in gp_allele_ids.values() for a in al_ids], columns
+            )
+
         threshold_funcs = {
             "common": (self._common_threshold, or_),
             "less_common": (self._less_common_threshold, or_),
@@ -426,17 +558,28 @@ class FrequencyFilter(object):
 
         for commonness_group, result in commonness_result.items():
 
+            if self.frequency_store is not None:
+                result.update(
+                    self._get_commonness_from_store(
+                        filter_config,
+                        gp_threshold_groups,
+                        commonness_group,
+                        store_allele_ids,
+                        values,
+                        column_index,
+                    )
+                )
+                continue
+
             # Create query filter this genepanel
             gp_filters = self._create_freq_filter(
                 filter_config,
-                genepanels,
-                gp_allele_ids,
+                gp_threshold_groups,
                 threshold_funcs[commonness_group][0],
                 combine_func=threshold_funcs[commonness_group][1],
             )
 
             for gp_key, al_ids in gp_allele_ids.items():
-                assert all(isinstance(a, int) for a in al_ids)
                 allele_ids = (
                     self.session.query(annotationshadow.AnnotationShadowFrequency.allele_id)
                     .filter(
@@ -0,0 +1,160 @@
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm.session import Session
+
+from vardb.datamodel import annotationshadow
+
+log = logging.getLogger(__name__)
+
+
+class FrequencyStore(object):
+    """
+    Process local, columnar copy of the annotationshadowfrequency table.
+
+    The frequency columns ('provider.key' and 'provider_num.key') are kept in a 2D float array
+    (NULL as NaN), with one row per allele, so that the frequency filter can classify a set of
+    alleles using vectorized comparisons instead of building large SQL expressions.
+
+    The store is filled lazily for the alleles requested, and is refreshed incrementally:
+    on every call, the shadow row ids of the requested alleles are fetched, and only alleles
+    with new (or removed) rows are reloaded. The triggers on the annotation table replace the
+    shadow row when an allele gets a new annotation, so the result is always the same as
+    querying the table directly. Recreating the shadow tables (new table oid) or changing
+    the mapped frequency columns clears the store.
+    """
+
+    def __init__(self, max_alleles: int = 2000000) -> None:
+        self.max_alleles = max_alleles
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self, stamp: Optional[Tuple] = None) -> None:
+        self._stamp = stamp
+        self._columns: Tuple[str, ...] = stamp[2] if stamp else tuple()
+        self._column_index = {c: idx for idx, c in enumerate(self._columns)}
+        self._slots: Dict[int, int] = dict()  # {allele_id: row in self._values}
+        self._free_slots: List[int] = list()
+        self._size = 0
+        self._row_ids = np.zeros(0, dtype=np.int64)
+        self._values = np.zeros((0, len(self._columns)), dtype=np.float64)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    @staticmethod
+    def _table_stamp(session: Session) -> Tuple:
+        columns = tuple(
+            c.name
+            for c in annotationshadow.AnnotationShadowFrequency.__table__.columns
+            if c.name not in ("id", "allele_id")
+        )
+        oid = session.execute("SELECT 'annotationshadowfrequency'::regclass::oid").scalar()
+        return (str(session.get_bind().url), oid, columns)
+
+    def _allocate(self, count: int) -> List[int]:
+        slots = self._free_slots[:count]
+        del self._free_slots[:count]
+        start = self._size
+        self._size += count - len(slots)
+        if self._size > self._values.shape[0]:
+            capacity = max(self._size, 2 * self._values.shape[0], 1024)
+            values = np.full((capacity, len(self._columns)), np.nan, dtype=np.float64)
+            values[: self._values.shape[0]] = self._values
+            row_ids = np.zeros(capacity, dtype=np.int64)
+            row_ids[: self._row_ids.shape[0]] = self._row_ids
+            self._values, self._row_ids = values, row_ids
+        return slots + list(range(start, self._size))
+
+    def _remove(self, allele_ids: Sequence[int]) -> None:
+        for allele_id in allele_ids:
+            if allele_id in self._slots:
+                self._free_slots.append(self._slots.pop(allele_id))
+
+    def _refresh(self, session: Session, allele_ids: Sequence[int]) -> None:
+        stamp = self._table_stamp(session)
+        if stamp != self._stamp:
+            self._clear(stamp)
+
+        table = annotationshadow.AnnotationShadowFrequency.__table__
+        current_row_ids = dict(
+            session.query(table.c.allele_id, func.max(table.c.id))
+            .filter(table.c.allele_id.in_(allele_ids))
+            .group_by(table.c.allele_id)
+            .all()
+        )
+
+        new_count = sum(1 for a in current_row_ids if a not in self._slots)
+        if len(self._slots) + new_count > self.max_alleles:
+            log.debug("Frequency store is full, clearing {} alleles".format(len(self._slots)))
+            self._clear(stamp)
+
+        outdated = {
+            allele_id: row_id
+            for allele_id, row_id in current_row_ids.items()
+            if allele_id not in self._slots or self._row_ids[self._slots[allele_id]] != row_id
+        }
+        # Alleles without a shadow row, or with a new one, are removed until (re)loaded below
+        self._remove([a for a in allele_ids if a not in current_row_ids or a in outdated])
+        self.hits += len(current_row_ids) - len(outdated)
+        self.misses += len(outdated)
+        if not outdated:
+            return
+
+        rows = (
+            session.query(table.c.allele_id, table.c.id, *[table.c[c] for c in self._columns])
+            .filter(table.c.id.in_(list(outdated.values())))
+            .all()
+        )
+        if not rows:
+            return
+
+        slots = self._allocate(len(rows))
+        for row, slot in zip(rows, slots):
+            self._slots[row[0]] = slot
+
+        self._row_ids[slots] = [r[1] for r in rows]
+        # None is converted to NaN
+        self._values[slots] = np.array([r[2:] for r in rows], dtype=np.float64).reshape(
+            len(rows), len(self._columns)
+        )
+
+    def get(
+        self, session: Session, allele_ids: Sequence[int], columns: Sequence[str]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the frequency data for allele_ids, as an array of the allele ids having a row
+        in annotationshadowfrequency, and a 2D array with the values for the given columns
+        (e.g. 'ExAC.G' and 'ExAC_num.G') for these alleles. NULL values are given as NaN.
+
+        The data is read using session, i.e. it includes uncommitted changes in session.
+        """
+        allele_ids = list(set(allele_ids))
+        with self._lock:
+            self._refresh(session, allele_ids)
+            missing_columns = set(columns) - set(self._columns)
+            if missing_columns:
+                raise RuntimeError(
+                    "Columns {} not found in annotationshadowfrequency".format(
+                        ", ".join(sorted(missing_columns))
+                    )
+                )
+            present = [a for a in allele_ids if a in self._slots]
+            slots = np.array([self._slots[a] for a in present], dtype=np.int64)
+            column_idx = [self._column_index[c] for c in columns]
+            values = self._values[np.ix_(slots, column_idx)]
+        return np.array(present, dtype=np.int64), values
+
+
+frequency_store = FrequencyStore()
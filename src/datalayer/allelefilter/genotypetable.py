@@ -1,3 +1,4 @@
+from contextlib import contextmanager
 from typing import List, Optional, Dict
 from sqlalchemy.orm import aliased
 from sqlalchemy.sql.schema import Table
@@ -5,6 +6,9 @@ from sqlalchemy import literal, and_
 from vardb.util.extended_query import ExtendedQuery
 from vardb.datamodel import genotype, allele, sample
 
+# Key in session.info holding genotype tables shared within shared_genotype_tables()
+SHARED_GENOTYPE_TABLES_KEY = "shared_genotype_tables"
+
 
 def extend_genotype_table_with_allele(session, genotype_table: Table) -> ExtendedQuery:
     genotype_with_allele = session.query(
@@ -17,6 +21,88 @@ def extend_genotype_table_with_allele(session, genotype_table: Table) -> Extende
     return genotype_with_allele
 
 
+@contextmanager
+def shared_genotype_tables(session):
+    """
+    Within this context, get_genotype_temp_table() reuses the genotype tables it has
+    already created on this session, instead of building the same multi-way join again.
+
+    A table created for the same samples is reused if it covers all the requested alleles and
+    extra columns. If it covers more alleles, the requested ones are copied into a new
+    (much cheaper) temp table, so the result has exactly the same rows as a freshly built table.
+
+    Typically used around one filter run or one data loader call.
+    Nested contexts share the tables of the outermost one.
+
+    :warning: The tables are temporary tables dropped on commit, and are not updated when
+              the underlying data changes. Don't commit, roll back or modify genotype data
+              on the session inside the context.
+    """
+    if SHARED_GENOTYPE_TABLES_KEY in session.info:
+        yield
+        return
+
+    session.info[SHARED_GENOTYPE_TABLES_KEY] = list()
+    try:
+        yield
+    finally:
+        session.info.pop(SHARED_GENOTYPE_TABLES_KEY, None)
+
+
+def _get_shared_genotype_table(
+    session, allele_ids, sample_ids, genotype_extras, genotypesampledata_extras
+):
+    shared_tables = session.info[SHARED_GENOTYPE_TABLES_KEY]
+    allele_id_set = frozenset(allele_ids)
+    sample_id_set = frozenset(sample_ids)
+    genotype_extras = dict(genotype_extras)
+    genotypesampledata_extras = dict(genotypesampledata_extras)
+
+    same_samples = [t for t in shared_tables if t["sample_ids"] == sample_id_set]
+    for shared in same_samples:
+        if (
+            allele_id_set <= shared["allele_ids"]
+            and genotype_extras.items() <= shared["genotype_extras"].items()
+            and genotypesampledata_extras.items() <= shared["genotypesampledata_extras"].items()
+        ):
+            if allele_id_set == shared["allele_ids"]:
+                return shared["table"]
+            genotype_table = (
+                session.query(shared["table"])
+                .filter(shared["table"].c.allele_id.in_(allele_ids))
+                .temp_table("genotype_query")
+            )
+            assert session.query(genotype_table.c.allele_id.distinct()).count() == len(allele_ids)
+            genotype_extras = shared["genotype_extras"]
+            genotypesampledata_extras = shared["genotypesampledata_extras"]
+            break
+    else:
+        # Include the extra columns of other tables for these samples,
+        # making it more likely that the new table can be reused later
+        for shared in same_samples:
+            for extras, shared_extras in [
+                (genotype_extras, shared["genotype_extras"]),
+                (genotypesampledata_extras, shared["genotypesampledata_extras"]),
+            ]:
+                for key, field in shared_extras.items():
+                    extras.setdefault(key, field)
+
+        genotype_table = _create_genotype_temp_table(
+            session, allele_ids, sample_ids, genotype_extras, genotypesampledata_extras
+        )
+
+    shared_tables.append(
+        {
+            "allele_ids": allele_id_set,
+            "sample_ids": sample_id_set,
+            "genotype_extras": genotype_extras,
+            "genotypesampledata_extras": genotypesampledata_extras,
+            "table": genotype_table,
+        }
+    )
+    return genotype_table
+
+
 def get_genotype_temp_table(
     session,
     allele_ids: List[int],
@@ -42,6 +128,7 @@ def get_genotype_temp_table(
 
     :note: All samples must belong to same analysis.
     :note: allele_id and secondallele_id are union'ed together into one table.
+    :note: Inside shared_genotype_tables(), previously created tables are reused when possible.
     """
 
     assert (
@@ -58,6 +145,18 @@ def get_genotype_temp_table(
     if genotypesampledata_extras is None:
         genotypesampledata_extras = {}
 
+    if SHARED_GENOTYPE_TABLES_KEY in session.info:
+        return _get_shared_genotype_table(
+            session, allele_ids, sample_ids, genotype_extras, genotypesampledata_extras
+        )
+    return _create_genotype_temp_table(
+        session, allele_ids, sample_ids, genotype_extras, genotypesampledata_extras
+    )
+
+
+def _create_genotype_temp_table(
+    session, allele_ids, sample_ids, genotype_extras, genotypesampledata_extras
+):
     def create_query(secondallele=False):
 
         samples = session.query(sample.Sample).filter(sample.Sample.id.in_(sample_ids)).all()
@@ -6,6 +6,7 @@ from sqlalchemy import or_, and_, tuple_, func, case, Column, MetaData, Integer
 
 from vardb.datamodel import gene, annotationshadow, allele
 from datalayer import queries
+from datalayer.allelefilter.regionindex import RegionIndex, region_index_cache
 
 
 class RegionFilter(object):
@@ -56,12 +57,13 @@ class RegionFilter(object):
         return t
 
     def create_genepanel_transcripts_table(
-        self, gp_key: Tuple[str, str], allele_ids: List[int], max_padding: int
+        self, gp_key: Tuple[str, str], allele_ids: Optional[List[int]], max_padding: int
     ) -> TableClause:
         # Extract transcripts associated with the genepanel. Unnest all exons (start, end).
         # To potentially limit the number of regions we need to check, exclude transcripts where we have no alleles
         # overlapping in the region [tx_start-max_padding, tx_end+max_padding]. The filter clause in the query
         # should have no effect on the result, but is included only for performance
+        # If allele_ids is None, all transcripts are included (without the allele_id column).
         #
         # Note: Exons and coding regions are transformed to closed intervals [start, end], rather than the half-open database representation [start, end)
         #
@@ -76,29 +78,32 @@ class RegionFilter(object):
         # | 329     | NM_198576.3     | +      | 955552    | 990360  | 976552     | 976776   | 1         |
         # | 329     | NM_198576.3     | +      | 955552    | 990360  | 976857     | 977081   | 1         |
 
-        return (
-            self.session.query(
-                gene.Transcript.gene_id,
-                gene.Transcript.transcript_name,
-                gene.Transcript.strand,
-                gene.Transcript.cds_start,
-                (gene.Transcript.cds_end - 1).label("cds_end"),
-                func.unnest(gene.Transcript.exon_starts).label("exon_start"),
-                (func.unnest(gene.Transcript.exon_ends) - 1).label("exon_end"),
-                allele.Allele.id.label("allele_id"),
-            )
-            .join(
-                gene.genepanel_transcript,
-                and_(
-                    gene.genepanel_transcript.c.transcript_id == gene.Transcript.id,
-                    tuple_(
-                        gene.genepanel_transcript.c.genepanel_name,
-                        gene.genepanel_transcript.c.genepanel_version,
-                    )
-                    == gp_key,
-                ),
-            )
-            .join(
+        columns = [
+            gene.Transcript.gene_id,
+            gene.Transcript.transcript_name,
+            gene.Transcript.strand,
+            gene.Transcript.cds_start,
+            (gene.Transcript.cds_end - 1).label("cds_end"),
+            func.unnest(gene.Transcript.exon_starts).label("exon_start"),
+            (func.unnest(gene.Transcript.exon_ends) - 1).label("exon_end"),
+        ]
+        if allele_ids is not None:
+            columns.append(allele.Allele.id.label("allele_id"))
+
+        genepanel_transcripts = self.session.query(*columns).join(
+            gene.genepanel_transcript,
+            and_(
+                gene.genepanel_transcript.c.transcript_id == gene.Transcript.id,
+                tuple_(
+                    gene.genepanel_transcript.c.genepanel_name,
+                    gene.genepanel_transcript.c.genepanel_version,
+                )
+                == gp_key,
+            ),
+        )
+
+        if allele_ids is not None:
+            genepanel_transcripts = genepanel_transcripts.join(
                 allele.Allele,
                 and_(
                     allele.Allele.id.in_(allele_ids),
@@ -117,8 +122,8 @@ class RegionFilter(object):
                     ),
                 ),
             )
-            .temp_table("tmp_region_filter_internal_genepanel_regions")
-        )
+
+        return genepanel_transcripts.temp_table("tmp_region_filter_internal_genepanel_regions")
 
     def get_coding_regions(self, genepanel_tx_regions):
         # Coding regions
@@ -314,6 +319,81 @@ class RegionFilter(object):
 
         return utr_region_upstream.union(utr_region_downstream)
 
+    def create_region_index(
+        self, gp_key: Tuple[str, str], filter_config: Dict[str, Any]
+    ) -> RegionIndex:
+        """
+        Creates a RegionIndex with all coding, splice and UTR regions of the genepanel,
+        using the same queries as for filtering in the database.
+        """
+        gp_gene_ids = (
+            self.session.query(gene.Transcript.gene_id)
+            .join(gene.Genepanel.transcripts)
+            .filter(tuple_(gene.Genepanel.name, gene.Genepanel.version) == gp_key)
+            .distinct()
+            .scalar_all()
+        )
+        if not gp_gene_ids:
+            return RegionIndex([])
+
+        max_padding = max(
+            abs(x) for x in (*filter_config["splice_region"], *filter_config["utr_region"])
+        )
+        tmp_gene_padding = self.create_gene_padding_table(gp_gene_ids, filter_config)
+        genepanel_tx_regions = self.create_genepanel_transcripts_table(gp_key, None, max_padding)
+
+        transcript_coding_regions = self.get_coding_regions(genepanel_tx_regions)
+        splicing_regions = self.get_splice_regions(genepanel_tx_regions, tmp_gene_padding)
+        utr_regions = self.get_utr_regions(genepanel_tx_regions, tmp_gene_padding)
+        all_regions = transcript_coding_regions.union(splicing_regions, utr_regions).subquery()
+
+        # Regions are only compared against alleles within the transcript (+ padding), see
+        # create_genepanel_transcripts_table()
+        regions = (
+            self.session.query(
+                gene.Transcript.chromosome,
+                all_regions.c.region_start,
+                all_regions.c.region_end,
+                gene.Transcript.tx_start - max_padding,
+                gene.Transcript.tx_end - 1 + max_padding,
+            )
+            .join(all_regions, all_regions.c.transcript_name == gene.Transcript.transcript_name)
+            .all()
+        )
+
+        self.session.execute("DROP TABLE IF EXISTS tmp_gene_padding;")
+        self.session.execute("DROP TABLE IF EXISTS {};".format(genepanel_tx_regions.name))
+        return RegionIndex(regions)
+
+    def get_region_index(
+        self, gp_key: Tuple[str, str], filter_config: Dict[str, Any]
+    ) -> RegionIndex:
+        """
+        Returns the (process wide) cached RegionIndex for the genepanel and padding in filter_config.
+        """
+        stamp = (
+            self.session.query(
+                func.count(gene.genepanel_transcript.c.transcript_id),
+                func.max(gene.genepanel_transcript.c.transcript_id),
+            )
+            .filter(
+                tuple_(
+                    gene.genepanel_transcript.c.genepanel_name,
+                    gene.genepanel_transcript.c.genepanel_version,
+                )
+                == gp_key
+            )
+            .one()
+        )
+        key = (
+            str(self.session.get_bind().url),
+            gp_key,
+            tuple(stamp),
+            tuple(filter_config["splice_region"]),
+            tuple(filter_config["utr_region"]),
+        )
+        return region_index_cache.get(key, lambda: self.create_region_index(gp_key, filter_config))
+
     def filter_alleles(
         self, gp_allele_ids: Dict[Tuple[str, str], List[int]], filter_config: Dict[str, Any]
     ) -> Dict[Tuple[str, str], Set[int]]:
@@ -342,95 +422,35 @@ class RegionFilter(object):
         """
 
         region_filtered: Dict[Tuple[str, str], Set[int]] = {}
+
+        # Gene specific padding (the same for all genes)
+        exon_upstream, exon_downstream = filter_config["splice_region"]
+        coding_region_upstream, coding_region_downstream = filter_config["utr_region"]
+
+        all_allele_ids = set(a for allele_ids in gp_allele_ids.values() for a in allele_ids)
+        allele_positions = {
+            a[0]: a
+            for a in self.session.query(
+                allele.Allele.id,
+                allele.Allele.chromosome,
+                allele.Allele.start_position,
+                allele.Allele.open_end_position,
+            ).filter(allele.Allele.id.in_(all_allele_ids))
+        }
+
         for gp_key, allele_ids in gp_allele_ids.items():
             if not allele_ids:
                 region_filtered[gp_key] = set()
                 continue
 
-            # Fetch all gene ids associated with the genepanel
-            gp_genes = (
-                self.session.query(gene.Transcript.gene_id, gene.Gene.hgnc_symbol)
-                .join(gene.Genepanel.transcripts)
-                .join(gene.Gene)
-                .filter(tuple_(gene.Genepanel.name, gene.Genepanel.version) == gp_key)
-            )
-
-            gp_gene_ids, gp_gene_symbols = list(zip(*[(g[0], g[1]) for g in gp_genes]))
-
-            # Create temporary gene padding table for the genes in the genepanel
-            tmp_gene_padding = self.create_gene_padding_table(gp_gene_ids, filter_config)
-
-            max_padding = self.session.query(
-                func.abs(func.max(tmp_gene_padding.c.exon_upstream)),
-                func.abs(func.max(tmp_gene_padding.c.exon_downstream)),
-                func.abs(func.max(tmp_gene_padding.c.coding_region_upstream)),
-                func.abs(func.max(tmp_gene_padding.c.coding_region_downstream)),
-            )
-            max_padding = max(*max_padding.all())
-
-            # Create temp tables
-            genepanel_tx_regions = self.create_genepanel_transcripts_table(
-                gp_key, allele_ids, max_padding
-            )
-
-            # Create queries for
-            # - Coding regions
-            # - Splice regions
-            # - UTR regions
-
-            transcript_coding_regions = self.get_coding_regions(genepanel_tx_regions)
-            splicing_regions = self.get_splice_regions(genepanel_tx_regions, tmp_gene_padding)
-            utr_regions = self.get_utr_regions(genepanel_tx_regions, tmp_gene_padding)
-
-            all_regions = transcript_coding_regions.union(splicing_regions, utr_regions).temp_table(
-                "all_regions", index=["transcript_name"]
-            )
-
-            # Find allele ids within genomic region
-            # We need to restrict comparison for each allele to happen on positions
-            # inside the transcript(s) (or else we could compare across same position on different chromosomes)
-            # (using transcript(s) rather than chromosome as key is a lot faster)
-            allele_transcripts = (
-                self.session.query(
-                    genepanel_tx_regions.c.allele_id, genepanel_tx_regions.c.transcript_name
-                )
-                .distinct()
-                .subquery()
-            )
-
-            allele_ids_in_genomic_region = (
-                self.session.query(allele.Allele.id)
-                .join(allele_transcripts, allele_transcripts.c.allele_id == allele.Allele.id)
-                .join(
-                    all_regions,
-                    all_regions.c.transcript_name == allele_transcripts.c.transcript_name,
-                )
-                .filter(
-                    # The following filter should be redundant, since allele_transcripts is
-                    # already limited to allele_ids, but we'll keep it for extra safety
-                    allele.Allele.id.in_(allele_ids),
-                    or_(
-                        # Contained within or overlapping region
-                        and_(
-                            allele.Allele.start_position >= all_regions.c.region_start,
-                            allele.Allele.start_position <= all_regions.c.region_end,
-                        ),
-                        and_(
-                            allele.Allele.open_end_position > all_regions.c.region_start,
-                            allele.Allele.open_end_position < all_regions.c.region_end,
-                        ),
-                        # Region contained within variant
-                        and_(
-                            allele.Allele.start_position <= all_regions.c.region_start,
-                            allele.Allele.open_end_position >= all_regions.c.region_end,
-                        ),
-                    ),
-                )
+            # Find allele ids within genomic region, using the cached region index of the
+            # genepanel (see create_region_index() for how the regions are defined)
+            region_index = self.get_region_index(gp_key, filter_config)
+            allele_ids_in_genomic_region = region_index.alleles_in_region(
+                [allele_positions[a] for a in allele_ids if a in allele_positions]
             )
 
-            allele_ids_outside_region = set(allele_ids) - set(
-                allele_ids_in_genomic_region.scalar_all()
-            )
+            allele_ids_outside_region = set(allele_ids) - allele_ids_in_genomic_region
 
             # Discard the next filters if there are no variants left to filter on
             if not allele_ids_outside_region:
@@ -461,10 +481,6 @@ class RegionFilter(object):
                     annotationshadow.AnnotationShadowTranscript.hgvsc,
                     annotationshadow.AnnotationShadowTranscript.exon_distance,
                     annotationshadow.AnnotationShadowTranscript.coding_region_distance,
-                    tmp_gene_padding.c.exon_upstream,
-                    tmp_gene_padding.c.exon_downstream,
-                    tmp_gene_padding.c.coding_region_upstream,
-                    tmp_gene_padding.c.coding_region_downstream,
                 )
                 .join(
                     # Join in transcripts used in annotation
@@ -480,20 +496,12 @@ class RegionFilter(object):
                         == annotationshadow.AnnotationShadowTranscript.allele_id,
                     ),
                 )
-                .join(
-                    # Join in gene padding table, to use gene specific padding
-                    tmp_gene_padding,
-                    tmp_gene_padding.c.hgnc_id
-                    == annotation_transcripts_genepanel.c.genepanel_hgnc_id,
-                )
                 .filter(
                     annotationshadow.AnnotationShadowTranscript.allele_id.in_(
                         allele_ids_outside_region
                     ),
-                    annotationshadow.AnnotationShadowTranscript.exon_distance
-                    >= tmp_gene_padding.c.exon_upstream,
-                    annotationshadow.AnnotationShadowTranscript.exon_distance
-                    <= tmp_gene_padding.c.exon_downstream,
+                    annotationshadow.AnnotationShadowTranscript.exon_distance >= exon_upstream,
+                    annotationshadow.AnnotationShadowTranscript.exon_distance <= exon_downstream,
                     or_(
                         # We do not save exonic UTR alleles if they are
                         # outside [coding_region_upstream, coding_region_downstream]
@@ -503,9 +511,9 @@ class RegionFilter(object):
                         ),
                         and_(
                             annotationshadow.AnnotationShadowTranscript.coding_region_distance
-                            >= tmp_gene_padding.c.coding_region_upstream,
+                            >= coding_region_upstream,
                             annotationshadow.AnnotationShadowTranscript.coding_region_distance
-                            <= tmp_gene_padding.c.coding_region_downstream,
+                            <= coding_region_downstream,
                         ),
                     ),
                 )
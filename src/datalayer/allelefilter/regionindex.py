@@ -0,0 +1,139 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Sequence, Set, Tuple
+
+import numpy as np
+
+
+class RegionIndex(object):
+    """
+    In-memory index of the regions of interest (coding, splice and UTR regions, with padding
+    applied) of the transcripts in a genepanel.
+
+    Regions are given as closed intervals, together with the window of the transcript they
+    belong to ([tx_start - max_padding, tx_end - 1 + max_padding]). As in the database
+    query of RegionFilter, a region is only compared against alleles that start or end
+    within the window of its transcript.
+
+    Per chromosome, the regions are kept in arrays sorted on region start. Looking up the alleles
+    within any region is then a binary search for the candidate regions of every allele,
+    followed by a vectorized overlap check.
+    """
+
+    def __init__(self, regions: Sequence[Tuple[str, int, int, int, int]]) -> None:
+        """
+        :param regions: [(chromosome, region_start, region_end, window_start, window_end), ...]
+        """
+        per_chromosome: Dict[str, list] = dict()
+        for chromosome, *region in set(regions):
+            per_chromosome.setdefault(chromosome, []).append(region)
+
+        # {chromosome: (region_start, region_end, window_start, window_end, max region length)}
+        self.regions: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, int]] = dict()
+        for chromosome, chromosome_regions in per_chromosome.items():
+            data = np.array(sorted(chromosome_regions), dtype=np.int64).reshape(-1, 4)
+            region_start, region_end, window_start, window_end = data.T
+            self.regions[chromosome] = (
+                region_start,
+                region_end,
+                window_start,
+                window_end,
+                int(np.max(region_end - region_start)),
+            )
+
+    def __len__(self) -> int:
+        return sum(len(r[0]) for r in self.regions.values())
+
+    def alleles_in_region(self, alleles: Sequence[Tuple[int, str, int, int]]) -> Set[int]:
+        """
+        Returns the ids of the alleles overlapping any region.
+
+        :param alleles: [(allele_id, chromosome, start_position, open_end_position), ...]
+        """
+        per_chromosome: Dict[str, list] = dict()
+        for allele_id, chromosome, start_position, open_end_position in alleles:
+            per_chromosome.setdefault(chromosome, []).append(
+                (allele_id, start_position, open_end_position)
+            )
+
+        in_region: Set[int] = set()
+        for chromosome, chromosome_alleles in per_chromosome.items():
+            if chromosome not in self.regions:
+                continue
+            region_start, region_end, window_start, window_end, max_length = self.regions[
+                chromosome
+            ]
+            allele_ids, start, open_end = np.array(chromosome_alleles, dtype=np.int64).T
+
+            # Candidate regions: All regions starting within [min(start, open_end) - max_length,
+            # max(start, open_end)]. This includes all regions the allele can overlap.
+            lo = np.searchsorted(region_start, np.minimum(start, open_end) - max_length, "left")
+            hi = np.searchsorted(region_start, np.maximum(start, open_end), "right")
+            counts = hi - lo
+            allele_idx = np.repeat(np.arange(len(allele_ids)), counts)
+            region_idx = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(
+                counts.sum()
+            )
+
+            s = start[allele_idx]
+            e = open_end[allele_idx]
+            rs = region_start[region_idx]
+            re = region_end[region_idx]
+            ws = window_start[region_idx]
+            we = window_end[region_idx]
+
+            in_window = ((s >= ws) & (s <= we)) | ((e > ws) & (e < we + 1))
+            overlaps = (
+                # Contained within or overlapping region
+                ((s >= rs) & (s <= re))
+                | ((e > rs) & (e < re))
+                # Region contained within variant
+                | ((s <= rs) & (e >= re))
+            )
+            in_region.update(allele_ids[np.unique(allele_idx[in_window & overlaps])].tolist())
+
+        return in_region
+
+
+class RegionIndexCache(object):
+    """
+    Process local LRU cache of RegionIndex objects.
+
+    The regions of a genepanel only depend on its transcripts and the padding in the filter
+    config. Genepanels are not changed once deposited, so the caller only needs to include
+    a cheap stamp of the genepanel's transcripts in the key.
+    """
+
+    def __init__(self, maxsize: int = 32) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._indexes: "OrderedDict[Hashable, RegionIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, create: Callable[[], RegionIndex]) -> RegionIndex:
+        with self._lock:
+            region_index = self._indexes.get(key)
+            if region_index is not None:
+                self._indexes.move_to_end(key)
+                self.hits += 1
+                return region_index
+            self.misses += 1
+
+        region_index = create()
+
+        with self._lock:
+            self._indexes[key] = region_index
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.maxsize:
+                self._indexes.popitem(last=False)
+        return region_index
+
+    def clear(self) -> None:
+        with self._lock:
+            self._indexes.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+region_index_cache = RegionIndexCache()
@@ -1,13 +1,20 @@
 from typing import List, Optional, Set, Dict, Any
+import numpy as np
 from sqlalchemy.orm.session import Session
-from sqlalchemy.sql.elements import BooleanClauseList, BinaryExpression
+from sqlalchemy.sql.elements import BooleanClauseList
 from sqlalchemy.sql.schema import Table
 from sqlalchemy.sql.selectable import Alias
 from sqlalchemy import or_, and_, text, func
 
 from vardb.datamodel import sample, annotationshadow
 
-from datalayer.allelefilter.denovo_probability import denovo_probability
+from datalayer.allelefilter.compoundheterozygous import (
+    HETEROZYGOUS,
+    compound_heterozygous_candidates,
+    compound_heterozygous_genes,
+    encode_genotypes,
+)
+from datalayer.allelefilter.denovo_probability import batch_denovo_probability
 from datalayer.allelefilter.genotypetable import (
     get_genotype_temp_table,
     extend_genotype_table_with_allele,
@@ -46,6 +53,9 @@ class SegregationFilter(object):
 
         def _compute_denovo_probabilities(genotype_with_allele_table, x_minus_par=False):
             dp = dict()
+            # Candidates are grouped on whether the proband is male,
+            # and the probabilities for each group computed in one batch
+            candidates: Dict[bool, List] = {False: [], True: []}
             for row in genotype_with_allele_table:
                 if not all(
                     [
@@ -57,7 +67,8 @@ class SegregationFilter(object):
                     dp[row.allele_id] = "-"
                     continue
 
-                if x_minus_par and getattr(row, f"{proband_sample_id}_sex") == "Male":
+                proband_male = getattr(row, f"{proband_sample_id}_sex") == "Male"
+                if x_minus_par and proband_male:
                     denovo_mode = [
                         denovo_mode_map["Xmale"][getattr(row, f"{father_sample_id}_type")],
                         denovo_mode_map["Xmale"][getattr(row, f"{mother_sample_id}_type")],
@@ -73,15 +84,24 @@ class SegregationFilter(object):
                 # It should not come up as a denovo candidate if either mother or father has the same called genotype
                 assert denovo_mode.count(denovo_mode[2]) == 1
 
-                p = denovo_probability(
-                    getattr(row, f"{proband_sample_id}_gl"),
-                    getattr(row, f"{father_sample_id}_gl"),
-                    getattr(row, f"{mother_sample_id}_gl"),
-                    x_minus_par,
-                    getattr(row, f"{proband_sample_id}_sex") == "Male",
-                    denovo_mode,
+                candidates[proband_male].append(
+                    (
+                        row.allele_id,
+                        getattr(row, f"{proband_sample_id}_gl"),
+                        getattr(row, f"{father_sample_id}_gl"),
+                        getattr(row, f"{mother_sample_id}_gl"),
+                        denovo_mode,
+                    )
+                )
+
+            for proband_male, rows in candidates.items():
+                if not rows:
+                    continue
+                allele_ids, pl_c, pl_f, pl_m, denovo_modes = zip(*rows)
+                p = batch_denovo_probability(
+                    pl_c, pl_f, pl_m, x_minus_par, proband_male, denovo_modes
                 )
-                dp[row.allele_id] = p
+                dp.update(zip(allele_ids, p))
             return dp
 
         genotype_with_denovo_allele_table = self.session.query(*genotype_with_allele_table.c)
@@ -625,50 +645,37 @@ class SegregationFilter(object):
         if len(sample_ids) == 1:
             return set()
 
+        # The genotype matrix for the family is loaded once, and the rules are evaluated
+        # in memory on integer coded genotypes (see compoundheterozygous.py)
+        genotype_rows = self.session.query(
+            genotype_table.c.allele_id,
+            *[getattr(genotype_table.c, f"{s}_type") for s in sample_ids],
+        ).all()
+        if not genotype_rows:
+            return set()
+
+        allele_ids = np.array([r[0] for r in genotype_rows], dtype=np.int64)
+        genotypes = encode_genotypes([r[1:] for r in genotype_rows], len(sample_ids))
+        sample_idx = {s: idx for idx, s in enumerate(sample_ids)}
+
         # Get candidates for compound heterozygosity. Covers the following rules:
         # 1. A variant has to be in a heterozygous state in all affected individuals.
         # 2. A variant must not occur in a homozygous state in any of the unaffected individuals.
         # 3. A variant that is heterozygous in an affected child must be
         #    heterozygous in exactly one of the parents.
-
-        compound_candidates_filters: List[BinaryExpression] = []
-        # Heterozygous in affected
-        compound_candidates_filters += [
-            getattr(genotype_table.c, f"{s}_type") == "Heterozygous" for s in affected_sample_ids
-        ]
-        # Not homozygous in unaffected
-        compound_candidates_filters += [
-            # Normally null would be included in below filter,
-            # set as Reference to make comparison work
-            func.coalesce(getattr(genotype_table.c, f"{s}_type"), "Reference") != "Homozygous"
-            for s in unaffected_sample_ids
-        ]
-        if father_sample_id and mother_sample_id:
-            # Heterozygous in _exactly one_ parent.
-            # Note: This will also exclude any alleles with 'No coverage' in either parent.
-            compound_candidates_filters.append(
-                or_(
-                    and_(
-                        getattr(genotype_table.c, f"{father_sample_id}_type") == "Heterozygous",
-                        getattr(genotype_table.c, f"{mother_sample_id}_type") == "Reference",
-                    ),
-                    and_(
-                        getattr(genotype_table.c, f"{father_sample_id}_type") == "Reference",
-                        getattr(genotype_table.c, f"{mother_sample_id}_type") == "Heterozygous",
-                    ),
-                )
-            )
-
-        compound_candidates = (
-            self.session.query(
-                genotype_table.c.allele_id,
-                *[getattr(genotype_table.c, f"{s}_type") for s in sample_ids],
-            )
-            .filter(*compound_candidates_filters)
-            .subquery("compound_candidates")
+        has_parents = bool(father_sample_id and mother_sample_id)
+        candidates = compound_heterozygous_candidates(
+            genotypes,
+            [sample_idx[s] for s in affected_sample_ids],
+            [sample_idx[s] for s in unaffected_sample_ids],
+            sample_idx[father_sample_id] if has_parents else None,
+            sample_idx[mother_sample_id] if has_parents else None,
         )
+        candidate_allele_ids = allele_ids[candidates].tolist()
+        if not candidate_allele_ids:
+            return set()
 
-        # Group per gene and get the gene symbols with >= 2 candidates.
+        # Get the genes of the candidates, and keep the candidates in genes with >= 2 candidates.
         #
         # Covers the following rules:
         # 4. A gene must have two or more heterozygous variants in each of the affected individuals.
@@ -679,76 +686,41 @@ class SegregationFilter(object):
         #  symbols have no id in the annotation data
         #  One allele can be in several genes, and the gene symbol set is more extensive than only
         #  the symbols having HGNC ids so it should be safer to user.
-        #
-        # candidates_with_genes example:
-        # ----------------------------------------------------------------------
-        # | allele_id | Proband_type | Father_type  | Mother_type   | symbol   |
-        # ----------------------------------------------------------------------
-        # | 6006      | Heterozygous | Heterozygous | Reference     | KIAA0586 |
-        # | 6005      | Heterozygous | Reference    | Heterozygous  | KIAA0586 |
-        # | 6004      | Heterozygous | Reference    | Heterozygous  | KIAA0586 |
-        # | 5528      | Heterozygous | Heterozygous | Reference     | TUBA1A   |
-        # | 5529      | Heterozygous | Heterozygous | Reference     | TUBA1A   |
-        #
-        # In the above example, 6004, 6005 and 6006 satisfy the rules.
 
-        filters = []
+        filters = [annotationshadow.AnnotationShadowTranscript.allele_id.in_(candidate_allele_ids)]
         if "inclusion_regex" in self.config["transcripts"]:
             filters.append(
                 text("annotationshadowtranscript.transcript ~ :reg").params(
                     reg=self.config["transcripts"]["inclusion_regex"]
                 )
             )
-        candidates_with_genes_columns = [
-            compound_candidates.c.allele_id,
-            annotationshadow.AnnotationShadowTranscript.symbol,
-        ]
-        if father_sample_id and mother_sample_id:
-            candidates_with_genes_columns += [
-                getattr(compound_candidates.c, f"{father_sample_id}_type"),
-                getattr(compound_candidates.c, f"{mother_sample_id}_type"),
-            ]
-        candidates_with_genes = (
-            self.session.query(*candidates_with_genes_columns)
-            .join(
-                annotationshadow.AnnotationShadowTranscript,
-                compound_candidates.c.allele_id
-                == annotationshadow.AnnotationShadowTranscript.allele_id,
+        allele_genes = (
+            self.session.query(
+                annotationshadow.AnnotationShadowTranscript.allele_id,
+                annotationshadow.AnnotationShadowTranscript.symbol,
             )
             .filter(*filters)
             .distinct()
+            .all()
         )
 
-        candidates_with_genes = candidates_with_genes.subquery("candidates_with_genes")
-
-        # General criteria, 2 or more alleles in this gene
-        # (rule 1 above covered that they are heterozygous in affected)
-        compound_heterozygous_symbols_having = [func.count(candidates_with_genes.c.allele_id) > 1]
-
-        # If parents, heterozygous in both
-        if father_sample_id and mother_sample_id:
-            compound_heterozygous_symbols_having += [
-                # bool_or: at least one allele in this gene is 'Heterozygous'
-                func.bool_or(
-                    getattr(candidates_with_genes.c, f"{father_sample_id}_type") == "Heterozygous"
-                ),
-                func.bool_or(
-                    getattr(candidates_with_genes.c, f"{mother_sample_id}_type") == "Heterozygous"
-                ),
-            ]
-        compound_heterozygous_symbols = (
-            self.session.query(candidates_with_genes.c.symbol)
-            .group_by(candidates_with_genes.c.symbol)
-            .having(and_(*compound_heterozygous_symbols_having))
-        )
-
-        compound_heterozygous_allele_ids = (
-            self.session.query(candidates_with_genes.c.allele_id)
-            .filter(candidates_with_genes.c.symbol.in_(compound_heterozygous_symbols))
-            .distinct()
-        )
+        if has_parents:
+            candidate_genotypes = genotypes[candidates]
+            candidate_ids = allele_ids[candidates]
+            father_heterozygous: Optional[Set[int]] = set(
+                candidate_ids[
+                    candidate_genotypes[:, sample_idx[father_sample_id]] == HETEROZYGOUS
+                ].tolist()
+            )
+            mother_heterozygous: Optional[Set[int]] = set(
+                candidate_ids[
+                    candidate_genotypes[:, sample_idx[mother_sample_id]] == HETEROZYGOUS
+                ].tolist()
+            )
+        else:
+            father_heterozygous = mother_heterozygous = None
 
-        return set([a[0] for a in compound_heterozygous_allele_ids.all()])
+        return compound_heterozygous_genes(allele_genes, father_heterozygous, mother_heterozygous)
 
     def no_coverage_father_mother(self, genotype_table, father_sample_id, mother_sample_id):
 
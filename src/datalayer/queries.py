@@ -56,13 +56,8 @@ def workflow_by_status(
     :param model: AlleleInterpretation or AnalysisInterpretation
     :param model_id_attr: 'allele_id' or 'analysis_id'
 
-    Query resembles something like this:
-     SELECT s.id FROM (select DISTINCT ON (analysis_id) id, workflow_status, status
-     from analysisinterpretation order by analysis_id, date_last_update desc) AS
-     s where s.workflow_status = :status;
-
-    Using DISTINCT ON and ORDER BY will select one row, giving us the latest interpretation workflow status.
-    See https://www.postgresql.org/docs/10.0/static/sql-select.html#SQL-DISTINCT
+    The state of the last interpretation is kept in the [allele|analysis]workflowstate tables,
+    maintained by triggers on the interpretation tables (see create_workflow_state_triggers()).
     """
 
     if workflow_status is None and status is None and finalized is None:
@@ -71,34 +66,31 @@ def workflow_by_status(
         )
 
     assert model_id_attr in ["allele_id", "analysis_id"]
+    assert model in [workflow.AlleleInterpretation, workflow.AnalysisInterpretation]
 
-    latest_interpretation = (
-        session.query(
-            getattr(model, model_id_attr), model.workflow_status, model.status, model.finalized
-        )
-        .order_by(getattr(model, model_id_attr), model.date_created.desc())
-        .distinct(getattr(model, model_id_attr))  # DISTINCT ON
-        .subquery()
-    )
+    state_model = workflow_state_model(model)
 
     filters = []
     if workflow_status:
-        filters.append(latest_interpretation.c.workflow_status == workflow_status)
+        filters.append(state_model.workflow_status == workflow_status)
     if status:
-        filters.append(latest_interpretation.c.status == status)
+        filters.append(state_model.status == status)
     if finalized is not None:
         if finalized:
-            filters.append(latest_interpretation.c.finalized.is_(True))
+            filters.append(state_model.finalized.is_(True))
         else:
-            filters.append(
-                or_(
-                    latest_interpretation.c.finalized.is_(None),
-                    latest_interpretation.c.finalized.is_(False),
-                )
-            )
-    return session.query(
-        getattr(latest_interpretation.c, model_id_attr).label(model_id_attr)
-    ).filter(*filters)
+            filters.append(or_(state_model.finalized.is_(None), state_model.finalized.is_(False)))
+    return session.query(getattr(state_model, model_id_attr).label(model_id_attr)).filter(*filters)
+
+
+def workflow_state_model(model):
+    """
+    Returns the workflow state model (latest interpretation per allele/analysis)
+    for AlleleInterpretation or AnalysisInterpretation.
+    """
+    if model is workflow.AnalysisInterpretation:
+        return workflow.AnalysisWorkflowState
+    return workflow.AlleleWorkflowState
 
 
 def workflow_analyses_finalized(session):
@@ -0,0 +1,74 @@
+import copy
+
+from sqlalchemy import tuple_
+
+from datalayer import ACMGCodeCache, ACMGDataLoader
+from vardb.datamodel import allele, annotation, gene, user
+
+
+def test_acmg_code_cache(session):
+    acmgconfig = (
+        session.query(user.UserGroup.config)
+        .filter(user.UserGroup.name == "testgroup01")
+        .scalar()["acmg"]
+    )
+    genepanel = (
+        session.query(gene.Genepanel)
+        .filter(tuple_(gene.Genepanel.name, gene.Genepanel.version) == ("HBOC", "v01"))
+        .one()
+    )
+    alleles = (
+        session.query(allele.Allele)
+        .join(annotation.Annotation)
+        .filter(annotation.Annotation.date_superceeded.is_(None))
+        .order_by(allele.Allele.id)
+        .limit(5)
+        .all()
+    )
+    assert len(alleles) == 5
+    reference_assessments = [
+        {
+            "allele_id": alleles[0].id,
+            "reference_id": 1,
+            "evaluation": {"ref_segregation": "segr+++"},
+        }
+    ]
+
+    expected = ACMGDataLoader(session).from_objs(
+        alleles, copy.deepcopy(reference_assessments), genepanel, acmgconfig
+    )
+
+    cache = ACMGCodeCache()
+    result = cache.from_objs(session, alleles, reference_assessments, genepanel, acmgconfig)
+    assert result == expected
+    assert list(result) == [a.id for a in alleles]
+    assert (cache.hits, cache.misses) == (0, 5)
+
+    # Unchanged input: codes are served from cache, and are not affected by
+    # changes to previously returned codes
+    result[alleles[0].id]["codes"].append({"code": "FOO"})
+    result = cache.from_objs(session, alleles, reference_assessments, genepanel, acmgconfig)
+    assert result == expected
+    assert (cache.hits, cache.misses) == (5, 5)
+
+    # Changed reference assessment only recomputes the codes of its allele
+    reference_assessments[0]["evaluation"] = {"ref_segregation": "segr+"}
+    result = cache.from_objs(session, alleles, reference_assessments, genepanel, acmgconfig)
+    assert result == ACMGDataLoader(session).from_objs(
+        alleles, copy.deepcopy(reference_assessments), genepanel, acmgconfig
+    )
+    assert (cache.hits, cache.misses) == (9, 6)
+
+    # Changed ACMG config recomputes all codes
+    other_acmgconfig = copy.deepcopy(acmgconfig)
+    other_acmgconfig["disease_mode"] = "ANY"
+    cache.from_objs(session, alleles, reference_assessments, genepanel, other_acmgconfig)
+    assert (cache.hits, cache.misses) == (9, 11)
+
+    # LRU eviction
+    cache = ACMGCodeCache(maxsize=3)
+    cache.from_objs(session, alleles, reference_assessments, genepanel, acmgconfig)
+    cache.from_objs(session, alleles[2:], reference_assessments, genepanel, acmgconfig)
+    assert (cache.hits, cache.misses) == (3, 5)
+    cache.from_objs(session, alleles[:2], reference_assessments, genepanel, acmgconfig)
+    assert (cache.hits, cache.misses) == (3, 7)
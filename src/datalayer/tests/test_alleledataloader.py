@@ -367,3 +367,105 @@ def test_inconsistent_ensembl_transcript(test_database, session):
     ] == "Annotation for {} does not match corresponding transcript: {}:{} ({})".format(
         q.annotation_transcript, ast.transcript, ast.hgvsc, ast.hgvsp
     )
+
+
+def test_iter_from_ids(test_database, session):
+    test_database.refresh()
+    analysis_id = 1
+
+    alleles = get_analysis_alleles(session, analysis_id).all()
+    genepanel = get_analysis_genepanel(session, analysis_id)
+    adl = AlleleDataLoader(session)
+
+    expected = adl.from_objs(alleles, analysis_id=analysis_id, genepanel=genepanel)
+    for chunk_size in [1, 3, len(alleles)]:
+        loaded = list(
+            adl.iter_from_ids(
+                [a.id for a in alleles],
+                chunk_size=chunk_size,
+                analysis_id=analysis_id,
+                genepanel=genepanel,
+            )
+        )
+        assert loaded == expected
+
+    # Order of ids is kept, unknown ids are skipped
+    allele_ids = [a.id for a in reversed(alleles)] + [-1]
+    loaded = list(adl.iter_from_ids(allele_ids, chunk_size=2, genepanel=genepanel))
+    assert [a["id"] for a in loaded] == allele_ids[:-1]
+
+
+def test_load_sample_data_family(session):
+    session.rollback()
+
+    an = sample.Analysis(
+        name="AlleleDataLoaderFamily", genepanel_name="HBOC", genepanel_version="v01"
+    )
+    session.add(an)
+    session.flush()
+
+    def add_sample(identifier, proband, **kwargs):
+        s = sample.Sample(
+            identifier=identifier,
+            analysis_id=an.id,
+            proband=proband,
+            affected=proband,
+            sample_type="HTS",
+            **kwargs,
+        )
+        session.add(s)
+        session.flush()
+        return s
+
+    father = add_sample("Father", False)
+    mother = add_sample("Mother", False)
+    proband = add_sample("Proband", True, father_id=father.id, mother_id=mother.id)
+    siblings = [add_sample("Sibling{}".format(i), False, sibling_id=proband.id) for i in range(2)]
+    family = [proband, father, mother] + siblings
+
+    # Genotypes differ between alleles, so that sample data is looked up per allele
+    n_alleles = 100
+    genotype_types = ["Heterozygous", "Homozygous"]
+    alleles = []
+    for i in range(n_alleles):
+        position = 1000 + 10 * i
+        a = mock_allele(
+            session,
+            {
+                "start_position": position,
+                "open_end_position": position + 1,
+                "vcf_pos": position + 1,
+            },
+        )
+        gt = genotype.Genotype(allele_id=a.id, sample_id=proband.id)
+        session.add(gt)
+        session.flush()
+        session.add_all(
+            [
+                genotype.GenotypeSampleData(
+                    genotype_id=gt.id,
+                    secondallele=False,
+                    multiallelic=False,
+                    sample_id=s.id,
+                    type=genotype_types[i % 2],
+                )
+                for s in family
+            ]
+        )
+        alleles.append(a)
+    session.flush()
+
+    adl = AlleleDataLoader(session)
+    loaded_alleles = adl.from_objs(alleles, analysis_id=an.id, genepanel=an.genepanel)
+
+    assert [a["id"] for a in loaded_alleles] == [a.id for a in alleles]
+    for i, loaded_allele in enumerate(loaded_alleles):
+        assert len(loaded_allele["samples"]) == 1
+        proband_data = loaded_allele["samples"][0]
+        assert proband_data["identifier"] == "Proband"
+        assert proband_data["father"]["identifier"] == "Father"
+        assert proband_data["mother"]["identifier"] == "Mother"
+        assert sorted(s["identifier"] for s in proband_data["siblings"]) == ["Sibling0", "Sibling1"]
+        assert proband_data["genotype"]["type"] == genotype_types[i % 2]
+        assert proband_data["father"]["genotype"]["type"] == genotype_types[i % 2]
+    session.rollback()
@@ -2,10 +2,14 @@
 Integration/unit test for the AlleleFilter module.
 Since it consists mostly of database queries, it's tested on a live database.
 """
+import datetime
+
 import pytest
+import pytz
 
 from datalayer import AlleleFilter
-from vardb.datamodel import sample, jsonschema
+from datalayer.allelefilter import FilterResultCache
+from vardb.datamodel import annotation, genotype, sample, jsonschema
 
 FILTER_CONFIG_NUM = 0
 
@@ -400,3 +404,122 @@ class TestAlleleFilter(object):
             "excluded_allele_ids": {"allele_one_two": [1, 2], "allele_filter_one_three_if_one": []},
         }
         assert result == expected_result
+
+    @pytest.mark.aa(order=2)
+    def test_filter_result_cache(self, session, allele_filter):
+        filter_config = {"filters": [{"name": "analysis_one_two"}]}
+        filter_config_id = insert_filter_config(session, filter_config)
+
+        analysis_allele_id = (
+            session.query(genotype.Genotype.allele_id)
+            .join(sample.Sample)
+            .filter(sample.Sample.analysis_id == 1)
+            .first()[0]
+        )
+
+        cache = FilterResultCache()
+        testdata = [1, 2, 3, 4]
+        expected_result = {
+            "allele_ids": [3, 4],
+            "excluded_allele_ids": {"analysis_one_two": [1, 2]},
+        }
+
+        result = cache.filter_analysis(session, filter_config_id, 1, testdata, allele_filter)
+        assert result == expected_result
+        assert (cache.hits, cache.misses) == (0, 1)
+
+        # Unchanged data: result is served from cache, and is not affected by
+        # changes to previously returned results
+        result["allele_ids"].append(5)
+        result = cache.filter_analysis(session, filter_config_id, 1, testdata, allele_filter)
+        assert result == expected_result
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        # Different input or filter config is a miss
+        cache.filter_analysis(session, filter_config_id, 1, [1, 2, 3], allele_filter)
+        other_filter_config_id = insert_filter_config(session, filter_config)
+        cache.filter_analysis(session, other_filter_config_id, 1, testdata, allele_filter)
+        assert (cache.hits, cache.misses) == (1, 3)
+
+        # New annotation for an allele in the analysis invalidates the cached result
+        existing = (
+            session.query(annotation.Annotation)
+            .filter(
+                annotation.Annotation.allele_id == analysis_allele_id,
+                annotation.Annotation.date_superceeded.is_(None),
+            )
+            .one()
+        )
+        existing.date_superceeded = datetime.datetime.now(pytz.utc)
+        session.flush()
+        session.add(
+            annotation.Annotation(
+                allele_id=analysis_allele_id,
+                annotations=existing.annotations,
+                annotation_config_id=existing.annotation_config_id,
+                previous_annotation_id=existing.id,
+            )
+        )
+        session.flush()
+
+        result = cache.filter_analysis(session, filter_config_id, 1, testdata, allele_filter)
+        assert result == expected_result
+        assert (cache.hits, cache.misses) == (1, 4)
+
+        result = cache.filter_analysis(session, filter_config_id, 1, testdata, allele_filter)
+        assert (cache.hits, cache.misses) == (2, 4)
+
+        # Least recently used entries are evicted
+        cache.maxsize = 1
+        cache.filter_analysis(session, other_filter_config_id, 1, testdata, allele_filter)
+        cache.filter_analysis(session, filter_config_id, 1, testdata, allele_filter)
+        assert (cache.hits, cache.misses) == (2, 6)
+
+    @pytest.mark.aa(order=3)
+    def test_filter_analysis_parallel(self, session, allele_filter):
+        allele_filter.independent_filters = {
+            "allele_one_two",
+            "allele_duplicate_one_two",
+            "allele_three_four",
+            "allele_five_six",
+            "allele_none",
+            # Analysis filters are never run up front
+            "analysis_three_four",
+        }
+
+        filter_configs = [
+            {
+                "filters": [
+                    {"name": "allele_one_two"},
+                    {"name": "analysis_filter_one_three_if_one"},
+                    {"name": "allele_duplicate_one_two"},
+                    {"name": "allele_three_four", "exceptions": [{"name": "allele_one"}]},
+                    {"name": "analysis_three_four"},
+                    {"name": "allele_five_six", "exceptions": [{"name": "analysis_five_six"}]},
+                    {"name": "allele_none"},
+                ]
+            },
+            {
+                "filters": [
+                    {"name": "analysis_one_two", "exceptions": [{"name": "allele_one"}]},
+                    {"name": "allele_duplicate_one_two"},
+                    {"name": "allele_filter_one_three_if_one"},
+                    {"name": "allele_three_four"},
+                    {"name": "allele_one_two"},
+                ]
+            },
+        ]
+
+        testdata = [1, 2, 3, 4, 5, 6, 7, 8, 9]
+        for filter_config in filter_configs:
+            filter_config_id = insert_filter_config(session, filter_config)
+
+            allele_filter.workers = 0
+            expected_result = allele_filter.filter_analysis(filter_config_id, 1, testdata)
+
+            allele_filter.workers = 4
+            result = allele_filter.filter_analysis(filter_config_id, 1, testdata)
+            assert result == expected_result
+            assert set(allele_filter.filter_timings) == set(
+                f["name"] for f in filter_config["filters"]
+            )
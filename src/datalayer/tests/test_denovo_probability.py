@@ -0,0 +1,84 @@
+import random
+
+import hypothesis as ht
+import hypothesis.strategies as st
+
+from datalayer.allelefilter.denovo_probability import (
+    denovo_probability,
+    batch_denovo_probability,
+)
+
+
+def denovo_modes(is_x_minus_par, proband_male):
+    # Called genotypes (father, mother, proband) where proband differs from both parents
+    if is_x_minus_par and proband_male:
+        father_genotypes = proband_genotypes = [0, 1]
+    elif is_x_minus_par:
+        father_genotypes, proband_genotypes = [0, 1], [0, 1, 2]
+    else:
+        father_genotypes = proband_genotypes = [0, 1, 2]
+    return [
+        (f, m, c)
+        for f in father_genotypes
+        for m in [0, 1, 2]
+        for c in proband_genotypes
+        if c != f and c != m
+    ]
+
+
+@st.composite
+def denovo_candidates(draw):
+    is_x_minus_par = draw(st.booleans())
+    proband_male = draw(st.booleans())
+    pl = st.lists(st.integers(min_value=0, max_value=500), min_size=3, max_size=3)
+    candidates = draw(
+        st.lists(
+            st.tuples(pl, pl, pl, st.sampled_from(denovo_modes(is_x_minus_par, proband_male))),
+            min_size=1,
+            max_size=20,
+        )
+    )
+    return is_x_minus_par, proband_male, candidates
+
+
+@ht.given(denovo_candidates())
+def test_batch_denovo_probability(data):
+    is_x_minus_par, proband_male, candidates = data
+    pl_c, pl_f, pl_m, modes = zip(*candidates)
+
+    expected = [
+        denovo_probability(c, f, m, is_x_minus_par, proband_male, mode)
+        for c, f, m, mode in candidates
+    ]
+    actual = batch_denovo_probability(pl_c, pl_f, pl_m, is_x_minus_par, proband_male, modes)
+    # Results must be identical, not just close
+    assert actual == expected
+
+
+def test_batch_denovo_probability_many_alleles():
+    rng = random.Random(0)
+    n_alleles = 5000
+
+    for is_x_minus_par in [False, True]:
+        for proband_male in [False, True]:
+            modes = denovo_modes(is_x_minus_par, proband_male)
+            pl_c, pl_f, pl_m, denovo_mode = zip(
+                *[
+                    (
+                        [rng.randint(0, 300) for _ in range(3)],
+                        [rng.randint(0, 300) for _ in range(3)],
+                        [rng.randint(0, 300) for _ in range(3)],
+                        rng.choice(modes),
+                    )
+                    for _ in range(n_alleles)
+                ]
+            )
+
+            expected = [
+                denovo_probability(c, f, m, is_x_minus_par, proband_male, mode)
+                for c, f, m, mode in zip(pl_c, pl_f, pl_m, denovo_mode)
+            ]
+            actual = batch_denovo_probability(
+                pl_c, pl_f, pl_m, is_x_minus_par, proband_male, denovo_mode
+            )
+            assert actual == expected
@@ -2,10 +2,13 @@
 Integration/unit test for the AlleleFilter module.
 Since it consists mostly of database queries, it's tested on a live database.
 """
+import datetime
+
 import pytest
 
 from datalayer.allelefilter.frequencyfilter import FrequencyFilter
-from vardb.datamodel import gene, annotationshadow
+from datalayer.allelefilter.frequencystore import FrequencyStore
+from vardb.datamodel import annotation, gene, annotationshadow
 from conftest import mock_allele_with_annotation
 
 
@@ -741,3 +744,66 @@ class TestFrequencyFilter(object):
         result = ff.filter_alleles({gp_key: allele_ids}, FILTER_ALLELES_FILTER_CONFIG)
 
         assert not result[gp_key]
+
+    @pytest.mark.aa(order=3)
+    def test_frequency_store(self, session):
+        # All alleles created by the tests above
+        allele_ids = session.query(
+            annotationshadow.AnnotationShadowFrequency.allele_id
+        ).scalar_all()
+        allele_ids += [max(allele_ids) + 1]  # Allele without annotation
+        gp_key = ("testpanel", "v01")
+
+        store = FrequencyStore()
+        ff = FrequencyFilter(session, GLOBAL_CONFIG)
+        ff_store = FrequencyFilter(session, GLOBAL_CONFIG, frequency_store=store)
+
+        def check_same_result():
+            for common_only in [False, True]:
+                assert ff.get_commonness_groups(
+                    {gp_key: allele_ids}, COMMONESS_FILTER_CONFIG, common_only=common_only
+                ) == ff_store.get_commonness_groups(
+                    {gp_key: allele_ids}, COMMONESS_FILTER_CONFIG, common_only=common_only
+                )
+            assert ff.filter_alleles(
+                {gp_key: allele_ids}, FILTER_ALLELES_FILTER_CONFIG
+            ) == ff_store.filter_alleles({gp_key: allele_ids}, FILTER_ALLELES_FILTER_CONFIG)
+
+        check_same_result()
+        assert len(store) == len(allele_ids) - 1
+        assert store.misses == len(allele_ids) - 1
+
+        # New annotation for an allele is picked up by the store
+        common_allele_id = next(
+            iter(
+                ff.get_commonness_groups({gp_key: allele_ids}, COMMONESS_FILTER_CONFIG)[gp_key][
+                    "common"
+                ]
+            )
+        )
+        session.query(annotation.Annotation).filter(
+            annotation.Annotation.allele_id == common_allele_id,
+            annotation.Annotation.date_superceeded.is_(None),
+        ).update({"date_superceeded": datetime.datetime.now()}, synchronize_session=False)
+        session.add(
+            annotation.Annotation(
+                allele_id=common_allele_id,
+                annotation_config_id=1,
+                annotations={
+                    "external": {},
+                    "frequencies": {"ExAC": {"freq": {"G": 0.00001}, "num": {"G": 9000}}},
+                    "prediction": {},
+                    "references": [],
+                    "transcripts": [],
+                },
+            )
+        )
+        session.flush()
+
+        misses = store.misses
+        check_same_result()
+        result = ff_store.filter_alleles({gp_key: allele_ids}, FILTER_ALLELES_FILTER_CONFIG)
+        assert common_allele_id not in result[gp_key]
+        # Only the updated allele is reloaded, and only once
+        assert store.misses == misses + 1
+        session.rollback()
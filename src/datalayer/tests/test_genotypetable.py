@@ -0,0 +1,89 @@
+from vardb.datamodel import sample, genotype
+from datalayer.allelefilter.genotypetable import get_genotype_temp_table, shared_genotype_tables
+
+
+def get_rows(session, genotype_table, columns):
+    return sorted(
+        session.query(*[getattr(genotype_table.c, c) for c in columns]).all(),
+        key=lambda r: tuple(str(v) for v in r),
+    )
+
+
+def test_shared_genotype_tables(test_database, session):
+    test_database.refresh()
+    analysis_id = 1
+
+    sample_ids = (
+        session.query(sample.Sample.id)
+        .filter(sample.Sample.analysis_id == analysis_id)
+        .scalar_all()
+    )
+    allele_ids = (
+        session.query(genotype.Genotype.allele_id)
+        .filter(genotype.Genotype.sample_id.in_(sample_ids))
+        .union(
+            session.query(genotype.Genotype.secondallele_id).filter(
+                genotype.Genotype.sample_id.in_(sample_ids),
+                ~genotype.Genotype.secondallele_id.is_(None),
+            )
+        )
+        .scalar_all()
+    )
+    assert len(allele_ids) > 2
+    subset_allele_ids = allele_ids[: len(allele_ids) // 2]
+
+    columns = ["allele_id"] + [f"{s}_type" for s in sample_ids] + [f"{s}_ar" for s in sample_ids]
+    gsd_extras = {"ar": "allele_ratio"}
+
+    expected_all = get_rows(
+        session,
+        get_genotype_temp_table(
+            session, allele_ids, sample_ids, genotypesampledata_extras=gsd_extras
+        ),
+        columns,
+    )
+    expected_subset = get_rows(
+        session,
+        get_genotype_temp_table(
+            session, subset_allele_ids, sample_ids, genotypesampledata_extras=gsd_extras
+        ),
+        columns,
+    )
+
+    with shared_genotype_tables(session):
+        table_all = get_genotype_temp_table(
+            session, allele_ids, sample_ids, genotypesampledata_extras=gsd_extras
+        )
+        assert get_rows(session, table_all, columns) == expected_all
+
+        # Same alleles, samples and (a subset of the) extras -> same table
+        assert get_genotype_temp_table(session, list(reversed(allele_ids)), sample_ids) is table_all
+        assert (
+            get_genotype_temp_table(
+                session, allele_ids, sample_ids, genotypesampledata_extras=gsd_extras
+            )
+            is table_all
+        )
+
+        # Subset of alleles -> copied from shared table, same rows as created from scratch
+        table_subset = get_genotype_temp_table(
+            session, subset_allele_ids, sample_ids, genotypesampledata_extras=gsd_extras
+        )
+        assert table_subset is not table_all
+        assert get_rows(session, table_subset, columns) == expected_subset
+
+        # New extras -> new table, including the previous extras
+        table_gl = get_genotype_temp_table(
+            session, allele_ids, sample_ids, genotypesampledata_extras={"gl": "genotype_likelihood"}
+        )
+        assert table_gl is not table_all
+        assert get_rows(session, table_gl, columns) == expected_all
+        assert all(f"{s}_gl" in table_gl.columns.keys() for s in sample_ids)
+
+        # Nested contexts share tables
+        with shared_genotype_tables(session):
+            assert get_genotype_temp_table(session, allele_ids, sample_ids) in [table_all, table_gl]
+
+    # Outside the context, a new table is created every time
+    assert get_genotype_temp_table(session, allele_ids, sample_ids) is not table_all
+    assert "shared_genotype_tables" not in session.info
@@ -581,10 +581,9 @@ def test_regions(
         },
     )
 
+    filter_config = {"splice_region": splice_region, "utr_region": utr_region}
     rf = RegionFilter(session, None)
-    tmp_gene_padding = rf.create_gene_padding_table(
-        [transcript.gene_id], {"splice_region": splice_region, "utr_region": utr_region}
-    )
+    tmp_gene_padding = rf.create_gene_padding_table([transcript.gene_id], filter_config)
 
     assert session.query(*tmp_gene_padding.c).all() == [
         (transcript.gene_id, splice_region[0], splice_region[1], utr_region[0], utr_region[1])
@@ -702,3 +701,12 @@ def test_regions(
 
     # Check that regions are the same
     assert set(expected_splice_regions) == set(splice_regions)
+
+    # Check that the region index used for filtering has the same regions
+    region_index = rf.create_region_index(("testpanel", "v02"), filter_config)
+    region_starts, region_ends, *_ = region_index.regions.get(
+        transcript.chromosome, ([], [], [], [], 0)
+    )
+    assert set(zip(list(region_starts), list(region_ends))) == set(
+        coding_regions + splice_regions + utr_regions
+    )
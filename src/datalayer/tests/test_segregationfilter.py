@@ -1,5 +1,7 @@
 from collections import defaultdict, namedtuple
+from functools import partial
 import pytest
+import random
 import uuid
 
 import hypothesis as ht
@@ -448,6 +450,94 @@ def replace_annotationshadowtranscript_table(session, entries):
     session.flush()
 
 
+def compound_heterozygous_result(entries, entries_allele_ids, sample_names):
+    """
+    Parallell implementation of the five rules to compare against database queries
+    in the actual implementation
+    """
+    affected_samples = [sample_names["proband"]] + sample_names.get("affected_siblings", [])
+    unaffected_samples = list(sample_names.get("unaffected_siblings", []))
+    if sample_names.get("father"):
+        unaffected_samples.append(sample_names["father"])
+    if sample_names.get("mother"):
+        unaffected_samples.append(sample_names["mother"])
+
+    candidates = set(entries_allele_ids)
+
+    rule_one_result = set()
+    # 1. A variant has to be in a heterozygous state in all affected individuals.
+    for allele_id, entry in zip(entries_allele_ids, entries):
+        het_in_affected = True
+        for name in affected_samples:
+            es = next(s for s in entry["genotypes"] if s.name == name)
+            if es.genotype != "Heterozygous":
+                het_in_affected = False
+        if het_in_affected:
+            rule_one_result.add(allele_id)
+
+    candidates = candidates & rule_one_result
+
+    # 2. A variant must not occur in a homozygous state in any of the unaffected individuals.
+    rule_two_result = set()
+    for allele_id, entry in zip(entries_allele_ids, entries):
+        not_hom_in_unaffected = True
+        for name in unaffected_samples:
+            es = next(s for s in entry["genotypes"] if s.name == name)
+            if es.genotype == "Homozygous":
+                not_hom_in_unaffected = False
+        if not_hom_in_unaffected:
+            rule_two_result.add(allele_id)
+
+    candidates = candidates & rule_two_result
+
+    # 3. A variant that is heterozygous in an affected child must be heterozygous in exactly one of the parents.
+    if sample_names.get("father") and sample_names.get("mother"):
+        rule_three_result = set()
+        for allele_id, entry in zip(entries_allele_ids, entries):
+            fs = next(s for s in entry["genotypes"] if s.name == sample_names["father"])
+            ms = next(s for s in entry["genotypes"] if s.name == sample_names["mother"])
+            if (fs.genotype == "Heterozygous" and ms.genotype == "Reference") or (
+                fs.genotype == "Reference" and ms.genotype == "Heterozygous"
+            ):
+                rule_three_result.add(allele_id)
+    else:
+        # If no parents, all entries "pass" this rule
+        rule_three_result = set(entries_allele_ids)
+
+    candidates = candidates & rule_three_result
+
+    # 4. A gene must have two or more heterozygous variants in each of the affected individuals.
+    #  Rule 1 checked for heterozygous in affected already.
+    #  We just need to check that we have two or more variants in the gene left in candidates
+    # 5. There must be at least one variant transmitted from the paternal side and one transmitted from the maternal side.
+    allele_ids_per_gene = defaultdict(set)
+    father_per_gene = defaultdict(int)
+    mother_per_gene = defaultdict(int)
+    for allele_id, entry in zip(entries_allele_ids, entries):
+        if allele_id not in candidates:
+            continue
+        allele_ids_per_gene[entry["gene"]].add(allele_id)
+        if sample_names.get("father") and sample_names.get("mother"):
+            fs = next(s for s in entry["genotypes"] if s.name == sample_names["father"])
+            # Homozygous is checked already per rule 2
+            if fs.genotype == "Heterozygous":
+                father_per_gene[entry["gene"]] += 1
+            ms = next(s for s in entry["genotypes"] if s.name == sample_names["mother"])
+            if ms.genotype == "Heterozygous":
+                mother_per_gene[entry["gene"]] += 1
+
+    rule_four_five_result = set()
+    for gene_symbol, allele_ids in allele_ids_per_gene.items():
+        if len(allele_ids) > 1:
+            if sample_names.get("father") and sample_names.get("mother"):
+                if father_per_gene[gene_symbol] > 0 and mother_per_gene[gene_symbol] > 0:
+                    rule_four_five_result.update(allele_ids)
+            else:
+                rule_four_five_result.update(allele_ids)
+
+    return candidates & rule_four_five_result
+
+
 class TestInheritanceFilter(object):
     @pytest.mark.i(order=0)
     def test_reset_database(self, test_database):
@@ -891,91 +981,62 @@ class TestInheritanceFilter(object):
             matched_allele_ids = set([entries_allele_ids[idx] for idx in manually_curated_result])
             assert result_allele_ids == matched_allele_ids
 
-        # Parallell implementation of the five rules to compare against database queries
-        # in the actual implementation
-        affected_samples = [sample_names["proband"]] + sample_names.get("affected_siblings", [])
-        unaffected_samples = sample_names.get("unaffected_siblings", [])
-        if sample_names.get("father"):
-            unaffected_samples.append(sample_names["father"])
-        if sample_names.get("mother"):
-            unaffected_samples.append(sample_names["mother"])
-
-        candidates = set(entries_allele_ids)
-
-        rule_one_result = set()
-        # 1. A variant has to be in a heterozygous state in all affected individuals.
-        for allele_id, entry in zip(entries_allele_ids, entries):
-            het_in_affected = True
-            for name in affected_samples:
-                es = next(s for s in entry["genotypes"] if s.name == name)
-                if es.genotype != "Heterozygous":
-                    het_in_affected = False
-            if het_in_affected:
-                rule_one_result.add(allele_id)
-
-        candidates = candidates & rule_one_result
-
-        # 2. A variant must not occur in a homozygous state in any of the unaffected individuals.
-        rule_two_result = set()
-        for allele_id, entry in zip(entries_allele_ids, entries):
-            not_hom_in_unaffected = True
-            for name in unaffected_samples:
-                es = next(s for s in entry["genotypes"] if s.name == name)
-                if es.genotype == "Homozygous":
-                    not_hom_in_unaffected = False
-            if not_hom_in_unaffected:
-                rule_two_result.add(allele_id)
+        assert result_allele_ids == compound_heterozygous_result(
+            entries, entries_allele_ids, sample_names
+        )
 
-        candidates = candidates & rule_two_result
+    def test_compound_heterozygous_many_alleles(self, session):
+        session.rollback()
+        rng = random.Random(0)
+        n_alleles = 1000
+        genotypes = ["Heterozygous"] * 3 + ["Reference"] * 3 + ["Homozygous", "No coverage", None]
+        # Many alleles per gene, so that all families have compound heterozygous candidates
+        genes = ["GENE{}".format(i) for i in range(20)]
+
+        entries_allele_ids = [10000 + idx for idx in range(n_alleles)]
+        allele_entries = [
+            (allele_id, "1", 1 + idx, 2 + idx) for idx, allele_id in enumerate(entries_allele_ids)
+        ]
+        annotationshadow_entries = [
+            (allele_id, allele_id, rng.choice(genes)) for allele_id in entries_allele_ids
+        ]
+        replace_allele_table(session, allele_entries)
+        replace_annotationshadowtranscript_table(session, annotationshadow_entries)
 
-        # 3. A variant that is heterozygous in an affected child must be heterozygous in exactly one of the parents.
-        if sample_names.get("father") and sample_names.get("mother"):
-            rule_three_result = set()
+        for family in [
+            (ps,),
+            (ps, fs, ms),
+            (ps, fs, ms, ass, uss, partial(uss, num=2)),
+        ]:
+            entries = [
+                {
+                    "gene": gene,
+                    "genotypes": tuple(sample(rng.choice(genotypes)) for sample in family),
+                }
+                for _, _, gene in annotationshadow_entries
+            ]
+            samples = [(s.name, s.sex) for s in entries[0]["genotypes"]]
+            genotype_entries = list()
             for allele_id, entry in zip(entries_allele_ids, entries):
-                fs = next(s for s in entry["genotypes"] if s.name == sample_names["father"])
-                ms = next(s for s in entry["genotypes"] if s.name == sample_names["mother"])
-                if (fs.genotype == "Heterozygous" and ms.genotype == "Reference") or (
-                    fs.genotype == "Reference" and ms.genotype == "Heterozygous"
-                ):
-                    rule_three_result.add(allele_id)
-        else:
-            # If no parents, all entries "pass" this rule
-            rule_three_result = set(entries_allele_ids)
-
-        candidates = candidates & rule_three_result
-
-        # 4. A gene must have two or more heterozygous variants in each of the affected individuals.
-        #  Rule 1 checked for heterozygous in affected already.
-        #  We just need to check that we have two or more variants in the gene left in candidates
-        # 5. There must be at least one variant transmitted from the paternal side and one transmitted from the maternal side.
-        allele_ids_per_gene = defaultdict(set)
-        father_per_gene = defaultdict(int)
-        mother_per_gene = defaultdict(int)
-        for allele_id, entry in zip(entries_allele_ids, entries):
-            if allele_id not in candidates:
-                continue
-            allele_ids_per_gene[entry["gene"]].add(allele_id)
-            if sample_names.get("father") and sample_names.get("mother"):
-                fs = next(s for s in entry["genotypes"] if s.name == sample_names["father"])
-                # Homozygous is checked already per rule 2
-                if fs.genotype == "Heterozygous":
-                    father_per_gene[entry["gene"]] += 1
-                ms = next(s for s in entry["genotypes"] if s.name == sample_names["mother"])
-                if ms.genotype == "Heterozygous":
-                    mother_per_gene[entry["gene"]] += 1
-
-        rule_four_five_result = set()
-        for gene_symbol, allele_ids in allele_ids_per_gene.items():
-            if len(allele_ids) > 1:
-                if sample_names.get("father") and sample_names.get("mother"):
-                    if father_per_gene[gene_symbol] > 0 and mother_per_gene[gene_symbol] > 0:
-                        rule_four_five_result.update(allele_ids)
-                else:
-                    rule_four_five_result.update(allele_ids)
-
-        final_candidates = candidates & rule_four_five_result
-
-        assert result_allele_ids == final_candidates
+                genotype_entry = [allele_id]
+                for s in entry["genotypes"]:
+                    genotype_entry += [s.genotype, 0.0, 0]
+                genotype_entries.append(genotype_entry)
+            genotype_table = create_genotype_table(session, samples, genotype_entries)
+
+            sample_names = get_sample_names(entries[0]["genotypes"])
+            result_allele_ids = SegregationFilter(session, GLOBAL_CONFIG).compound_heterozygous(
+                genotype_table,
+                sample_names["proband"],
+                sample_names.get("father"),
+                sample_names.get("mother"),
+                affected_sibling_sample_ids=sample_names.get("affected_siblings"),
+                unaffected_sibling_sample_ids=sample_names.get("unaffected_siblings"),
+            )
+            assert result_allele_ids == compound_heterozygous_result(
+                entries, entries_allele_ids, sample_names
+            )
+            assert result_allele_ids
 
     # Outside PAR
     @ht.example(
@@ -1,5 +1,10 @@
+import copy
+import fnmatch
+import re
+
 from .gra import GRA
 from .grl import GRL
+from .grm import GRM
 
 """
 GenAP Rule Engine, GRE
@@ -15,4 +20,101 @@ class GRE:
     """
 
     def query(self, rules, data):
-        return GRA().applyRules(GRL().parseRules(rules), GRA().parseNodeToSourceKeyedDict(data))
+        return self.compile(rules).query(data)
+
+    """
+    Parses the rules once, for evaluating many datasets with CompiledRules.query()/query_batch()
+    """
+
+    @staticmethod
+    def compile(rules):
+        return CompiledRules(rules)
+
+
+class CompiledRules:
+
+    """
+    Rules parsed with GRL, indexed for repeated evaluation. Gives the same result as
+    GRA().applyRules(GRL().parseRules(rules), data), but without parsing the rules for every dataset.
+
+    Rules with a wildcard source (like refassessment.*.ref_segregation) are bucketed on the literal
+    prefix of the source (refassessment.), so that only data sources with a matching prefix are
+    matched against the pattern.
+
+    The compiled rules are never modified: the rules are copied before being applied to the data,
+    and the returned rules are the copies.
+    """
+
+    def __init__(self, rules):
+        self.rules = tuple(
+            rul for resultlist in GRL().parseRules(rules).values() for rul in resultlist
+        )
+        # {prefix: [(index in self.rules, compiled pattern), ...]}
+        self.wildcard_rules = dict()
+        for idx, rule in enumerate(self.rules):
+            if rule.source and ".*." in rule.source:
+                prefix = re.split(r"[*?\[]", rule.source, maxsplit=1)[0]
+                self.wildcard_rules.setdefault(prefix, []).append(
+                    (idx, re.compile(fnmatch.translate(rule.source)))
+                )
+
+    @staticmethod
+    def _copy(rule):
+        # Composite rules apply their subrules, which store the matching values
+        if isinstance(rule, (GRM.CompositeRule, GRM.NotRule)):
+            return copy.deepcopy(rule)
+        return copy.copy(rule)
+
+    def _expand_sources(self, dataflattened):
+        # {index in self.rules: [matching data sources, in data order]}
+        expanded = {idx: [] for rules in self.wildcard_rules.values() for idx, _ in rules}
+        for datasource in dataflattened:
+            for prefix, rules in self.wildcard_rules.items():
+                if not datasource.startswith(prefix):
+                    continue
+                for idx, pattern in rules:
+                    if pattern.match(datasource):
+                        expanded[idx].append(datasource)
+        return expanded
+
+    """
+    Applies the rules to data (nested dicts, as for GRE.query()), returns (passed, notpassed) tuple
+    """
+
+    def query(self, data):
+        passed = list()
+        notpassed = list()
+        dataflattened = {".".join(k): v for k, v in GRA().parseNodeToSourceKeyedDict(data).items()}
+        expanded = self._expand_sources(dataflattened)
+        for idx, template in enumerate(self.rules):
+            if idx in expanded:
+                # One rule per matching data source, no rule if none match
+                rules = list()
+                for datasource in expanded[idx]:
+                    rule = self._copy(template)
+                    rule.source = datasource
+                    rules.append(rule)
+            else:
+                rules = [self._copy(template)]
+
+            for rule in rules:
+                if rule.aggregate:
+                    if rule.query([r.code for r in passed]):
+                        passed.append(rule)
+                    else:
+                        notpassed.append(rule)
+                elif rule.source in dataflattened:
+                    if rule.query(dataflattened[rule.source]):
+                        passed.append(rule)
+                    else:
+                        notpassed.append(rule)
+                else:
+                    notpassed.append(rule)
+        return (passed, notpassed)
+
+    """
+    Applies the rules to each dataset in data_list, returns a list of (passed, notpassed) tuples
+    """
+
+    def query_batch(self, data_list):
+        return [self.query(data) for data in data_list]
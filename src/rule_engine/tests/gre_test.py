@@ -0,0 +1,54 @@
+import unittest
+from ..gra import GRA
+from ..gre import GRE
+from ..grl import GRL
+from .gra_test import GraTest
+
+
+class GreTest(unittest.TestCase):
+    def _codes(self, rules):
+        return [(rule.code, rule.source) for rule in rules]
+
+    def testCompiledEqualsApplyRules(self):
+        (expected_passed, expected_notpassed) = GRA().applyRules(
+            GRL().parseRules(GraTest.jsonrules), GRA().parseNodeToSourceKeyedDict(GraTest.jsondata)
+        )
+        (passed, notpassed) = GRE.compile(GraTest.jsonrules).query(GraTest.jsondata)
+        self.assertEqual(self._codes(passed), self._codes(expected_passed))
+        self.assertEqual(self._codes(notpassed), self._codes(expected_notpassed))
+        self.assertEqual(passed[0].match, ["synonymous_variant"])
+
+    def testQueryBatch(self):
+        compiled = GRE.compile(GraTest.jsonrules)
+        no_refassessment = dict(GraTest.jsondata)
+        no_refassessment.pop("refassessment")
+        multiple_refassessment = dict(GraTest.jsondata)
+        multiple_refassessment["refassessment"] = {
+            "3": {"ref_segregation": "segr+"},
+            "1": {"ref_ihc": "mmr_loss++"},
+            "2": {"ref_segregation": "segr+++"},
+        }
+
+        results = compiled.query_batch([GraTest.jsondata, no_refassessment, multiple_refassessment])
+        self.assertEqual(len(results), 3)
+        for data, (passed, notpassed) in zip(
+            [GraTest.jsondata, no_refassessment, multiple_refassessment], results
+        ):
+            (expected_passed, expected_notpassed) = GRE().query(GraTest.jsonrules, data)
+            self.assertEqual(self._codes(passed), self._codes(expected_passed))
+            self.assertEqual(self._codes(notpassed), self._codes(expected_notpassed))
+
+        # Wildcard rules are dropped when no source matches
+        self.assertNotIn("PP13", [r.code for r in results[1][0] + results[1][1]])
+        # ...and expanded for every matching source
+        self.assertIn(("PP13", "refassessment.2.ref_segregation"), self._codes(results[2][0]))
+        self.assertIn(("PP13", "refassessment.3.ref_segregation"), self._codes(results[2][1]))
+        self.assertIn(("PP14", "refassessment.1.ref_ihc"), self._codes(results[2][0]))
+
+    def testCompiledRulesNotModified(self):
+        compiled = GRE.compile(GraTest.jsonrules)
+        sources = [(rule.source, getattr(rule, "match", None)) for rule in compiled.rules]
+        compiled.query_batch([GraTest.jsondata, GraTest.jsondata])
+        self.assertEqual(
+            [(rule.source, getattr(rule, "match", None)) for rule in compiled.rules], sources
+        )
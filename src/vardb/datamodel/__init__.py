@@ -1,5 +1,5 @@
 from vardb.util import DB
-from sqlalchemy import MetaData
+from sqlalchemy import DDL, MetaData, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
@@ -56,6 +56,8 @@ convention = {
 Base: Any = declarative_base(cls=CustomBase)  # NB! Use this Base instance always.
 Base.metadata = MetaData(naming_convention=convention)
 make_searchable(Base.metadata)  # Create triggers to keep search vectors up to date
+# Trigram indexes (gin_trgm_ops) are used for substring search
+event.listen(Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
 
 # Don't remove!
 from vardb.datamodel import (
@@ -1,3 +1,4 @@
+from contextlib import contextmanager
 from vardb.datamodel import Base
 from vardb.datamodel import sample, user
 from sqlalchemy import Column, Integer, Text, Float, String, ForeignKey, Index, func, Table
@@ -5,11 +6,15 @@ from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import mapper, class_mapper
 from sqlalchemy.orm.exc import UnmappedClassError
 from sqlalchemy.ext.declarative.api import _declarative_constructor
-from typing import Any
+from typing import Any, List, Sequence, Tuple
 
 from api.config import config as global_config
 
 
+# Transaction local setting for skipping the annotationshadow INSERT trigger
+SKIP_TRIGGER_SETTING = "ella.skip_annotationshadow_trigger"
+
+
 # Note: not subclassing Base, this is handled by explicitly mapping below
 class _AnnotationShadowTranscript(object):
     def __init__(self, **kwargs):
@@ -95,10 +100,23 @@ def get_annotationshadowtranscript_table(name="annotationshadowtranscript"):
         Column("consequences", ARRAY(Text)),
         Column("exon_distance", Integer),
         Column("coding_region_distance", Integer),
+        # Trigram indexes, supporting substring search (ILIKE '%...%')
         Index(
-            "ix_{}_hgvsc".format(name),
-            func.lower(Column("hgvsc", String)),
-            postgresql_ops={"data": "text_pattern_ops"},
+            "ix_{}_hgvsc_trgm".format(name),
+            "hgvsc",
+            postgresql_using="gin",
+            postgresql_ops={"hgvsc": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_{}_hgvsp_trgm".format(name),
+            "hgvsp",
+            postgresql_using="gin",
+            postgresql_ops={"hgvsp": "gin_trgm_ops"},
+        ),
+        # Transcript without version, as used in search
+        Index(
+            "ix_{}_transcript_unversioned".format(name),
+            func.split_part(Column("transcript", String), ".", 1),
         ),
     )
 
@@ -111,12 +129,17 @@ mapper(AnnotationShadowTranscript, _annotationshadowtranscript_table)
 AnnotationShadowTranscript.__table__ = _annotationshadowtranscript_table
 
 
-def check_db_consistency(session, config, subset=False):
-    "Check that the config defines the same (or a subset) frequency shadow table as the current table in the database"
+def get_db_frequency_columns(session):
+    "Frequency columns of the current annotationshadowfrequency table in the database"
     column_res = session.execute(
         "SELECT column_name FROM information_schema.columns WHERE table_schema='public' AND table_name='annotationshadowfrequency';"
     )
-    db_column_names = set([c[0] for c in column_res]) - set(["id", "allele_id"])
+    return set([c[0] for c in column_res]) - set(["id", "allele_id"])
+
+
+def check_db_consistency(session, config, subset=False):
+    "Check that the config defines the same (or a subset) frequency shadow table as the current table in the database"
+    db_column_names = get_db_frequency_columns(session)
 
     if subset:
         assert set([c[0] for c in iter_config_columns(config)]) - set(db_column_names) == set()
@@ -126,30 +149,60 @@ def check_db_consistency(session, config, subset=False):
         ), "{}\n{}".format(db_column_names, set([c[0] for c in iter_config_columns(config)]))
 
 
+# Transcript columns and their values, given a transcript element "a" of annotations->'transcripts'
+TRANSCRIPT_COLUMNS: List[Tuple[str, str]] = [
+    ("hgnc_id", "(a->>'hgnc_id')::integer"),
+    ("symbol", "a->>'symbol'"),
+    ("transcript", "a->>'transcript'"),
+    ("hgvsc", "a->>'HGVSc'"),
+    ("protein", "a->>'protein'"),
+    ("hgvsp", "a->>'HGVSp'"),
+    ("consequences", "ARRAY(SELECT jsonb_array_elements_text(a->'consequences'))"),
+    ("exon_distance", "(a->>'exon_distance')::integer"),
+    ("coding_region_distance", "(a->>'coding_region_distance')::integer"),
+]
+
+
+def get_frequency_columns(config) -> List[Tuple[str, str]]:
+    "Frequency columns (quoted) and their values, given the annotation data as annotations"
+    columns = []
+    for freq_provider, freq_key in iter_freq_groups(config["frequencies"]["groups"]):
+        columns.append(
+            (
+                '"{}.{}"'.format(freq_provider, freq_key),
+                "(annotations->'frequencies'->'{}'->'freq'->>'{}')::float".format(
+                    freq_provider, freq_key
+                ),
+            )
+        )
+        columns.append(
+            (
+                '"{}_num.{}"'.format(freq_provider, freq_key),
+                "(annotations->'frequencies'->'{}'->'num'->>'{}')::integer".format(
+                    freq_provider, freq_key
+                ),
+            )
+        )
+    return columns
+
+
 def create_trigger_sql(config, for_tmp=False):
     """
     Set up triggers to update annotationshadow tables upon
     changes (INSERT, UPDATE, or DELETE) to the annotation table.
 
+    For the (non-tmp) shadow tables, the INSERT trigger can be skipped for a transaction
+    with skip_annotationshadow_trigger(), filling the tables for a batch of annotations
+    at once with insert_annotationshadow_bulk() instead.
+
     :warning: Not SQL injection safe, do not provide user input.
     """
-    freq_insert_into = []
-    freq_values = []
-    for freq_provider, freq_key in iter_freq_groups(config["frequencies"]["groups"]):
-        freq_insert_into.append('"{}.{}"'.format(freq_provider, freq_key))
-        freq_insert_into.append('"{}_num.{}"'.format(freq_provider, freq_key))
-        freq_values.append(
-            "(annotations->'frequencies'->'{}'->'freq'->>'{}')::float".format(
-                freq_provider, freq_key
-            )
-        )
-        freq_values.append(
-            "(annotations->'frequencies'->'{}'->'num'->>'{}')::integer".format(
-                freq_provider, freq_key
-            )
-        )
-    frequency_insert_into = ",\n".join(freq_insert_into)
-    frequency_values = ",\n".join(freq_values)
+    frequency_columns = get_frequency_columns(config)
+    separator = ",\n" + " " * 20
+    frequency_insert_into = separator.join(c for c, _ in frequency_columns)
+    frequency_values = separator.join(v for _, v in frequency_columns)
+    transcript_insert_into = separator.join(c for c, _ in TRANSCRIPT_COLUMNS)
+    transcript_values = separator.join(v for _, v in TRANSCRIPT_COLUMNS)
 
     if not for_tmp:
         annotationshadow = "annotationshadow"
@@ -160,6 +213,12 @@ def create_trigger_sql(config, for_tmp=False):
         annotationshadowtranscript = "tmp_annotationshadowtranscript"
         annotationshadowfrequency = "tmp_annotationshadowfrequency"
 
+    # Triggers for the tmp tables (used while rebuilding the shadow tables) are never skipped
+    if not for_tmp:
+        skip_insert_condition = "current_setting('{}', true) = 'on'".format(SKIP_TRIGGER_SETTING)
+    else:
+        skip_insert_condition = "false"
+
     return f"""
     CREATE OR REPLACE FUNCTION insert_{annotationshadowtranscript}(allele_id INTEGER, annotations JSONB) RETURNS void
     LANGUAGE plpgsql
@@ -168,26 +227,10 @@ def create_trigger_sql(config, for_tmp=False):
             INSERT INTO {annotationshadowtranscript}
                 (
                     allele_id,
-                    hgnc_id,
-                    symbol,
-                    transcript,
-                    hgvsc,
-                    protein,
-                    hgvsp,
-                    consequences,
-                    exon_distance,
-                    coding_region_distance
+                    {transcript_insert_into}
                 )
                 SELECT allele_id,
-                    (a->>'hgnc_id')::integer,
-                    a->>'symbol',
-                    a->>'transcript',
-                    a->>'HGVSc',
-                    a->>'protein',
-                    a->>'HGVSp',
-                    ARRAY(SELECT jsonb_array_elements_text(a->'consequences')),
-                    (a->>'exon_distance')::integer,
-                    (a->>'coding_region_distance')::integer
+                    {transcript_values}
                 FROM jsonb_array_elements(annotations->'transcripts') as a;
         END;
     $$;
@@ -218,9 +261,53 @@ def create_trigger_sql(config, for_tmp=False):
         END;
     $$;
 
+    -- Same result as running the INSERT trigger for the given annotations, in order of id
+    CREATE OR REPLACE FUNCTION insert_{annotationshadow}_bulk(annotation_ids INTEGER[]) RETURNS void
+    LANGUAGE plpgsql
+    AS $$
+        BEGIN
+            CREATE TEMP TABLE bulk_{annotationshadow} ON COMMIT DROP AS
+                SELECT DISTINCT ON (allele_id) id, allele_id, annotations
+                FROM annotation
+                WHERE id = ANY(annotation_ids)
+                ORDER BY allele_id, id DESC;
+
+            DELETE FROM {annotationshadowtranscript}
+                WHERE allele_id IN (SELECT allele_id FROM bulk_{annotationshadow});
+            DELETE FROM {annotationshadowfrequency}
+                WHERE allele_id IN (SELECT allele_id FROM bulk_{annotationshadow});
+
+            INSERT INTO {annotationshadowtranscript}
+                (
+                    allele_id,
+                    {transcript_insert_into}
+                )
+                SELECT an.allele_id,
+                    {transcript_values}
+                FROM bulk_{annotationshadow} AS an,
+                    jsonb_array_elements(an.annotations->'transcripts') WITH ORDINALITY AS t(a, idx)
+                ORDER BY an.id, t.idx;
+
+            INSERT INTO {annotationshadowfrequency}
+                (
+                    allele_id,
+                    {frequency_insert_into}
+                )
+                SELECT allele_id,
+                    {frequency_values}
+                FROM bulk_{annotationshadow}
+                ORDER BY id;
+
+            DROP TABLE bulk_{annotationshadow};
+        END;
+    $$;
+
     CREATE OR REPLACE FUNCTION annotation_to_{annotationshadow}() RETURNS TRIGGER AS $annotation_to_{annotationshadow}$
         BEGIN
             IF (TG_OP = 'INSERT') THEN
+                IF ({skip_insert_condition}) THEN
+                    RETURN NEW;
+                END IF;
                 PERFORM delete_{annotationshadow}(NEW.allele_id);
                 PERFORM insert_{annotationshadowtranscript}(NEW.allele_id, NEW.annotations);
                 PERFORM insert_{annotationshadowfrequency}(NEW.allele_id, NEW.annotations);
@@ -248,6 +335,76 @@ def create_trigger_sql(config, for_tmp=False):
     """
 
 
+@contextmanager
+def skip_annotationshadow_trigger(session):
+    """
+    Skip the annotationshadow INSERT trigger for annotations inserted within the context.
+    The caller is responsible for filling the shadow tables, see insert_annotationshadow_bulk().
+
+    The setting is local to the current transaction, and is not reset if an exception is raised.
+    """
+    session.execute("SET LOCAL {} = 'on'".format(SKIP_TRIGGER_SETTING))
+    yield
+    session.execute("SET LOCAL {} = 'off'".format(SKIP_TRIGGER_SETTING))
+
+
+def insert_annotationshadow_bulk(session, annotation_ids: Sequence[int]):
+    "Update the shadow tables for annotations inserted with skip_annotationshadow_trigger()"
+    if annotation_ids:
+        session.execute(
+            "SELECT insert_annotationshadow_bulk(:annotation_ids)",
+            {"annotation_ids": list(annotation_ids)},
+        )
+
+
+def check_annotationshadow_consistency(session, config, allele_ids=None) -> List[int]:
+    """
+    Check that the shadow tables contain what the annotationshadow trigger would give
+    for the current annotations. Returns the (sorted) allele ids with differences.
+
+    :param allele_ids: Only check these alleles. If None, check all shadow table rows.
+    """
+    if allele_ids is None:
+        allele_filter = "true"
+        params = {}
+    else:
+        allele_filter = "allele_id = ANY(:allele_ids)"
+        params = {"allele_ids": list(allele_ids)}
+
+    frequency_columns = get_frequency_columns(config)
+    differences = set()
+    for table, columns, from_annotation in [
+        (
+            "annotationshadowtranscript",
+            TRANSCRIPT_COLUMNS,
+            "current_annotation AS an, jsonb_array_elements(an.annotations->'transcripts') AS a",
+        ),
+        ("annotationshadowfrequency", frequency_columns, "current_annotation AS an"),
+    ]:
+        column_names = ", ".join(c for c, _ in columns)
+        column_values = ", ".join(v for _, v in columns)
+        res = session.execute(
+            f"""
+            WITH current_annotation AS (
+                SELECT allele_id, annotations FROM annotation
+                WHERE date_superceeded IS NULL AND {allele_filter}
+            ),
+            expected AS (
+                SELECT an.allele_id, {column_values} FROM {from_annotation}
+            ),
+            actual AS (
+                SELECT allele_id, {column_names} FROM {table} WHERE {allele_filter}
+            )
+            SELECT allele_id FROM (SELECT * FROM expected EXCEPT ALL SELECT * FROM actual) AS d
+            UNION
+            SELECT allele_id FROM (SELECT * FROM actual EXCEPT ALL SELECT * FROM expected) AS d
+            """,
+            params,
+        )
+        differences.update(r[0] for r in res)
+    return sorted(differences)
+
+
 def check_filterconfig(filterconfig, config):
     """Verify that the frequency groups to be used for frequency filtering are a subset of the
     global frequency groups, used to build the annotationshadowfrequency table"""
@@ -403,9 +560,10 @@ def create_shadow_tables(session, config, use_prepared_tmp_tables=False):
 
     session.execute(create_trigger_sql(config))
     session.execute(
-        "DROP TRIGGER annotation_to_tmp_annotationshadow ON annotation;"
-        "DROP FUNCTION annotation_to_tmp_annotationshadow;"
-        "DROP FUNCTION delete_tmp_annotationshadow;"
+        "DROP TRIGGER IF EXISTS annotation_to_tmp_annotationshadow ON annotation;"
+        "DROP FUNCTION IF EXISTS annotation_to_tmp_annotationshadow;"
+        "DROP FUNCTION IF EXISTS delete_tmp_annotationshadow;"
+        "DROP FUNCTION IF EXISTS insert_tmp_annotationshadow_bulk;"
     )
 
     rename_tmp("annotationshadowfrequency")
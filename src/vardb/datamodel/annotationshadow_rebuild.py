@@ -0,0 +1,429 @@
+"""
+Online rebuild of the annotation shadow tables.
+
+create_shadow_tables() rebuilds the shadow tables in one transaction, which blocks filtering (and
+annotation import) for the whole rebuild. ShadowTableRebuild instead:
+
+1. Creates empty tmp_annotationshadow* tables for the new config, and a change log capturing
+   allele ids of annotations inserted or deleted from now on (prepare)
+2. Fills the tmp tables in chunks of allele id ranges, each chunk in its own transaction.
+   Chunks can be processed by several workers (threads in this process, or several processes
+   running the rebuild concurrently), as each worker claims its chunks with SKIP LOCKED (fill)
+3. Creates the indexes on the tmp tables, and recomputes shadow rows for alleles in the change
+   log, until the change log is (close to) empty (finalize)
+4. Locks annotation for writes, replays the rest of the change log and replaces the shadow
+   tables with the tmp tables in one transaction (swap)
+
+Steps 1, 3 and 4 are serialized between processes with an advisory lock, taken at the start of
+every transaction. With several processes, finalize and swap are done by the process filling
+the last chunk, the other processes return when their chunks are filled.
+
+All state is kept in the database, so an interrupted rebuild is resumed by running it again
+with the same config. Use abort() to drop a rebuild in progress.
+
+:warning: Every step commits the session given.
+"""
+import datetime
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.schema import Table
+
+from vardb.datamodel import Base
+from vardb.datamodel.annotationshadow import (
+    TRANSCRIPT_COLUMNS,
+    check_filterconfig_and_acmg_groups,
+    create_shadow_tables,
+    get_annotationshadowfrequency_table,
+    get_annotationshadowtranscript_table,
+    get_frequency_columns,
+    update_annotation_shadow_columns,
+)
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 50000
+CHANGELOG_BATCH_SIZE = 10000
+# Number of change log entries left when locking annotation for the swap
+MAX_CHANGELOG_AT_SWAP = 1000
+
+STATE_TABLE = "annotationshadow_rebuild"
+CHUNK_TABLE = "annotationshadow_rebuild_chunk"
+CHANGELOG_TABLE = "annotationshadow_rebuild_changelog"
+
+# Key for pg_advisory_xact_lock(), serializing prepare/finalize/swap between processes
+REBUILD_LOCK_ID = 74220117
+
+TMP_TRANSCRIPT_TABLE = "tmp_annotationshadowtranscript"
+TMP_FREQUENCY_TABLE = "tmp_annotationshadowfrequency"
+
+
+def format_duration(seconds: float) -> str:
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+class ShadowTableRebuild(object):
+    def __init__(
+        self,
+        session: Session,
+        config: Dict[str, Any],
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        workers: int = 0,
+        progress: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        """
+        :param chunk_size: Size of the allele id range filled per transaction
+        :param workers: If > 1, number of threads (each with its own connection) filling chunks
+        :param progress: Called with progress messages (default: log.info)
+        """
+        self.session = session
+        self.config = config
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.progress = progress if progress is not None else log.info
+
+    @staticmethod
+    def in_progress(session: Session) -> bool:
+        return (
+            session.execute("SELECT to_regclass(:table)", {"table": STATE_TABLE}).scalar()
+            is not None
+        )
+
+    def run(self) -> None:
+        self.prepare()
+        self.fill()
+        if self.finalize():
+            self.swap()
+
+    def _lock(self) -> bool:
+        """
+        Lock the rebuild until the end of the current transaction.
+        Returns whether a rebuild is (still) in progress.
+        """
+        self.session.execute("SELECT pg_advisory_xact_lock(:id)", {"id": REBUILD_LOCK_ID})
+        return self.in_progress(self.session)
+
+    def prepare(self) -> None:
+        """Create tmp tables, change log and chunks, or verify the config of a rebuild in progress"""
+        groups = self.config["frequencies"]["groups"]
+        if self._lock():
+            stored_groups = self.session.execute(
+                "SELECT frequency_groups FROM {}".format(STATE_TABLE)
+            ).scalar()
+            if stored_groups != groups:
+                self.session.rollback()
+                raise RuntimeError(
+                    "A shadow table rebuild with a different frequency group config is in progress. "
+                    "Abort it before starting a new rebuild."
+                )
+            self.session.commit()
+            self.progress("Resuming shadow table rebuild")
+            return
+
+        # Fail early if filterconfigs or usergroups use frequency groups not in config
+        check_filterconfig_and_acmg_groups(self.session, self.config)
+
+        conn = self.session.connection()
+        for table in self._tmp_tables():
+            table.create(conn)
+            # Indexes are created after the tables are filled, see finalize()
+            for index in table.indexes:
+                index.drop(conn)
+            Base.metadata.remove(table)
+
+        self.session.execute(
+            f"""
+            CREATE TABLE {STATE_TABLE} (
+                frequency_groups JSONB NOT NULL,
+                started TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+            );
+            CREATE TABLE {CHUNK_TABLE} (
+                id SERIAL PRIMARY KEY,
+                start_allele_id INTEGER NOT NULL,
+                end_allele_id INTEGER NOT NULL,
+                done BOOLEAN NOT NULL DEFAULT false
+            );
+            CREATE TABLE {CHANGELOG_TABLE} (
+                id SERIAL PRIMARY KEY,
+                allele_id INTEGER NOT NULL
+            );
+
+            CREATE OR REPLACE FUNCTION annotation_to_{CHANGELOG_TABLE}() RETURNS TRIGGER AS $f$
+                BEGIN
+                    IF (TG_OP = 'DELETE') THEN
+                        INSERT INTO {CHANGELOG_TABLE} (allele_id) VALUES (OLD.allele_id);
+                        RETURN OLD;
+                    END IF;
+                    INSERT INTO {CHANGELOG_TABLE} (allele_id) VALUES (NEW.allele_id);
+                    RETURN NEW;
+                END;
+            $f$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER annotation_to_{CHANGELOG_TABLE}
+            AFTER INSERT OR DELETE ON annotation
+                FOR EACH ROW EXECUTE PROCEDURE annotation_to_{CHANGELOG_TABLE}();
+            """
+        )
+        self.session.execute(
+            "INSERT INTO {} (frequency_groups) VALUES (CAST(:groups AS jsonb))".format(STATE_TABLE),
+            {"groups": json.dumps(groups)},
+        )
+
+        # Creating the trigger waits for concurrent writes to annotation, so all annotations
+        # inserted after this are either in the chunks below or in the change log
+        min_allele_id, max_allele_id = self.session.execute(
+            "SELECT min(allele_id), max(allele_id) FROM annotation"
+        ).fetchone()
+        if min_allele_id is not None:
+            self.session.execute(
+                f"""
+                INSERT INTO {CHUNK_TABLE} (start_allele_id, end_allele_id)
+                SELECT s, s + :chunk_size FROM generate_series(:min, :max, :chunk_size) AS s
+                """,
+                {"min": min_allele_id, "max": max_allele_id, "chunk_size": self.chunk_size},
+            )
+        self.session.commit()
+        self.progress("Prepared shadow table rebuild")
+
+    def fill(self) -> None:
+        """Fill the tmp tables for all chunks not yet done"""
+        total, done = self.session.execute(
+            "SELECT count(*), count(*) FILTER (WHERE done) FROM {}".format(CHUNK_TABLE)
+        ).fetchone()
+        self.session.commit()
+
+        start = time.perf_counter()
+        lock = threading.Lock()
+        counter = {"done": done, "filled": 0}
+
+        def on_chunk_done():
+            with lock:
+                counter["done"] += 1
+                counter["filled"] += 1
+                elapsed = time.perf_counter() - start
+                remaining = total - counter["done"]
+                eta = elapsed / counter["filled"] * remaining
+                self.progress(
+                    "Filled chunk {}/{} ({:.1f}%), elapsed {}, ETA {}".format(
+                        counter["done"],
+                        total,
+                        100.0 * counter["done"] / total,
+                        format_duration(elapsed),
+                        format_duration(eta),
+                    )
+                )
+
+        if self.workers < 2:
+            self._fill_chunks(self.session, on_chunk_done)
+        else:
+            bind = self.session.get_bind()
+
+            def run_worker(_):
+                worker_session = Session(bind=bind)
+                try:
+                    self._fill_chunks(worker_session, on_chunk_done)
+                finally:
+                    worker_session.close()
+
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                # Reraise worker exceptions
+                list(executor.map(run_worker, range(self.workers)))
+
+    def finalize(self) -> bool:
+        """
+        Create indexes on the tmp tables and catch up on the change log.
+
+        Returns False if there's nothing left to do for this process, i.e. if chunks are still
+        being filled by other processes (which will finalize the rebuild), or if the rebuild
+        was already completed by another process.
+        """
+        if not self._lock():
+            self.session.commit()
+            self.progress("Shadow table rebuild was completed by another process")
+            return False
+
+        pending = self.session.execute(
+            "SELECT count(*) FROM {} WHERE NOT done".format(CHUNK_TABLE)
+        ).scalar()
+        if pending:
+            self.session.commit()
+            self.progress(
+                "{} chunks are being filled by other processes, "
+                "leaving the rest of the rebuild to them".format(pending)
+            )
+            return False
+
+        self.progress("Creating indexes on tmp shadow tables")
+        conn = self.session.connection()
+        for table in self._tmp_tables():
+            existing = set(
+                r[0]
+                for r in self.session.execute(
+                    "SELECT indexname FROM pg_catalog.pg_indexes WHERE tablename = :table",
+                    {"table": table.name},
+                )
+            )
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(conn)
+            Base.metadata.remove(table)
+        self.session.commit()
+
+        while True:
+            if not self._lock():
+                self.session.commit()
+                self.progress("Shadow table rebuild was completed by another process")
+                return False
+            replayed = self._replay_changelog(self.session)
+            self.session.commit()
+            if replayed <= MAX_CHANGELOG_AT_SWAP:
+                return True
+
+    def swap(self) -> None:
+        """
+        Replace the shadow tables with the tmp tables.
+
+        Running ELLA processes keep using the frequency columns of their own config. If the new
+        config removes any frequency groups, filtering fails in those processes until they are
+        restarted with the new config.
+        """
+        start = time.perf_counter()
+        if not self._lock():
+            self.session.commit()
+            self.progress("Shadow table rebuild was completed by another process")
+            return
+        # Blocks concurrent annotation writes (not reads) until commit
+        self.session.execute("LOCK TABLE annotation IN SHARE ROW EXCLUSIVE MODE")
+        while self._replay_changelog(self.session):
+            pass
+        self._drop_rebuild_tables(self.session)
+        create_shadow_tables(self.session, self.config, use_prepared_tmp_tables=True)
+        self.session.commit()
+        update_annotation_shadow_columns(self.config)
+        self.progress(
+            "Replaced shadow tables (annotation locked for {:.1f}s)".format(
+                time.perf_counter() - start
+            )
+        )
+
+    @staticmethod
+    def abort(session: Session) -> None:
+        "Drop a rebuild in progress, including the tmp tables"
+        ShadowTableRebuild._drop_rebuild_tables(session)
+        session.execute(
+            "DROP TABLE IF EXISTS {};DROP TABLE IF EXISTS {};".format(
+                TMP_TRANSCRIPT_TABLE, TMP_FREQUENCY_TABLE
+            )
+        )
+        session.commit()
+
+    @staticmethod
+    def _drop_rebuild_tables(session: Session) -> None:
+        session.execute(
+            f"""
+            DROP TRIGGER IF EXISTS annotation_to_{CHANGELOG_TABLE} ON annotation;
+            DROP FUNCTION IF EXISTS annotation_to_{CHANGELOG_TABLE};
+            DROP TABLE IF EXISTS {CHANGELOG_TABLE};
+            DROP TABLE IF EXISTS {CHUNK_TABLE};
+            DROP TABLE IF EXISTS {STATE_TABLE};
+            """
+        )
+
+    def _tmp_tables(self) -> List[Table]:
+        "Table definitions of the tmp tables. Remove from Base.metadata after use."
+        return [
+            get_annotationshadowtranscript_table(TMP_TRANSCRIPT_TABLE),
+            get_annotationshadowfrequency_table(self.config, name=TMP_FREQUENCY_TABLE),
+        ]
+
+    def _fill_chunks(self, session: Session, on_chunk_done: Callable[[], None]) -> None:
+        while True:
+            chunk = session.execute(
+                f"""
+                SELECT id, start_allele_id, end_allele_id FROM {CHUNK_TABLE}
+                WHERE NOT done ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED
+                """
+            ).first()
+            if chunk is None:
+                session.commit()
+                return
+            chunk_id, start_allele_id, end_allele_id = chunk
+            self._insert_shadow_rows(
+                session,
+                "an.allele_id >= :start AND an.allele_id < :end",
+                {"start": start_allele_id, "end": end_allele_id},
+            )
+            session.execute(
+                "UPDATE {} SET done = true WHERE id = :id".format(CHUNK_TABLE), {"id": chunk_id}
+            )
+            session.commit()
+            on_chunk_done()
+
+    def _replay_changelog(self, session: Session) -> int:
+        """
+        Recompute the shadow rows for a batch of alleles in the change log.
+        Returns the number of change log entries processed.
+        """
+        changes = session.execute(
+            "SELECT id, allele_id FROM {} ORDER BY id LIMIT :limit".format(CHANGELOG_TABLE),
+            {"limit": CHANGELOG_BATCH_SIZE},
+        ).fetchall()
+        if not changes:
+            return 0
+
+        allele_ids = sorted(set(c.allele_id for c in changes))
+        for table in [TMP_TRANSCRIPT_TABLE, TMP_FREQUENCY_TABLE]:
+            session.execute(
+                "DELETE FROM {} WHERE allele_id = ANY(:allele_ids)".format(table),
+                {"allele_ids": allele_ids},
+            )
+        self._insert_shadow_rows(
+            session, "an.allele_id = ANY(:allele_ids)", {"allele_ids": allele_ids}
+        )
+        # Only delete the entries read, entries committed since are processed in the next batch
+        session.execute(
+            "DELETE FROM {} WHERE id = ANY(:ids)".format(CHANGELOG_TABLE),
+            {"ids": [c.id for c in changes]},
+        )
+        self.progress("Replayed {} changes from change log".format(len(changes)))
+        return len(changes)
+
+    def _insert_shadow_rows(self, session: Session, where: str, params: Dict[str, Any]) -> None:
+        "Insert shadow rows into the tmp tables for current annotations matching where"
+        for table, columns, from_annotation in [
+            (
+                TMP_TRANSCRIPT_TABLE,
+                TRANSCRIPT_COLUMNS,
+                "annotation AS an, jsonb_array_elements(an.annotations->'transcripts') AS a",
+            ),
+            (TMP_FREQUENCY_TABLE, get_frequency_columns(self.config), "annotation AS an"),
+        ]:
+            column_names = ", ".join(c for c, _ in columns)
+            column_values = ", ".join(v for _, v in columns)
+            session.execute(
+                f"""
+                INSERT INTO {table} (allele_id, {column_names})
+                SELECT an.allele_id, {column_values}
+                FROM {from_annotation}
+                WHERE an.date_superceeded IS NULL AND {where}
+                """,
+                params,
+            )
+
+
+def rebuild_shadow_tables(
+    session: Session,
+    config: Dict[str, Any],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    workers: int = 0,
+    progress: Optional[Callable[[str], None]] = None,
+) -> None:
+    "Rebuild (or resume rebuilding) the shadow tables for config, see ShadowTableRebuild"
+    ShadowTableRebuild(
+        session, config, chunk_size=chunk_size, workers=workers, progress=progress
+    ).run()
@@ -27,6 +27,12 @@ class Gene(Base):
             unique=True,
             postgresql_ops={"data": "text_pattern_ops"},
         ),
+        Index(
+            "ix_gene_hgnc_symbol_trgm",
+            hgnc_symbol,
+            postgresql_using="gin",
+            postgresql_ops={"hgnc_symbol": "gin_trgm_ops"},
+        ),
     )
 
     def __repr__(self):
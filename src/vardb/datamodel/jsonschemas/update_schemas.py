@@ -348,6 +348,11 @@ def create_schema_triggers(session):
     sql_template = """
         CREATE OR REPLACE FUNCTION {table}_schema_version() RETURNS TRIGGER AS $f$
             BEGIN
+                -- Data already validated by the application (see validator.py)
+                IF NEW.{version_column} IS NOT NULL
+                    AND current_setting('ella.skip_json_validation', true) = 'on' THEN
+                    RETURN NEW;
+                END IF;
                 NEW.{version_column} = schema_version(NEW.{json_column}, '{table}', false);
                 RETURN NEW;
             END;
@@ -0,0 +1,106 @@
+"""
+Python side validation of JSON data against the schemas in the jsonschema table.
+
+The schema version triggers on annotation and filterconfig validate every row with the
+plpgsql function validate_json_schema, which is slow for large documents. Bulk writers can
+instead validate their rows here (with compiled, cached validators), set the schema version
+themselves and skip the trigger validation for their writes using skip_db_validation().
+"""
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Hashable, List, Sequence, Tuple
+
+import jsonschema
+from sqlalchemy import func
+from sqlalchemy.orm.session import Session
+
+from vardb.datamodel import jsonschema as dbjsonschema
+from vardb.datamodel.jsonschemas.jsonvalidationerror import JSONValidationError
+
+# Transaction local setting checked by the schema version triggers (see update_schemas.py)
+SKIP_DB_VALIDATION_SETTING = "ella.skip_json_validation"
+
+
+class SchemaValidator(object):
+    """
+    Compiled validators for all versions of a named schema.
+
+    Mirrors schema_version(data, name, false) in the database: returns the largest version
+    the data is valid against, and raises JSONValidationError if no version matches.
+    """
+
+    def __init__(self, name: str, schemas: Sequence[Tuple[int, Dict[str, Any]]]) -> None:
+        self.name = name
+        # Same validator class as jsonschema.validate() would use
+        self.validators: List[Tuple[int, Any]] = [
+            (version, jsonschema.validators.validator_for(schema)(schema))
+            for version, schema in sorted(schemas, key=lambda x: x[0], reverse=True)
+        ]
+
+    def schema_version(self, data: Any) -> int:
+        for version, validator in self.validators:
+            if validator.is_valid(data):
+                return version
+        raise JSONValidationError(self.error_message(data))
+
+    def error_message(self, data: Any) -> str:
+        # Same format as concatenate_json_validation_errors
+        error_message = []
+        for version, validator in self.validators:
+            error_message.append(
+                "\n*** Schema ({}, {}) failed with the exception:".format(self.name, version)
+            )
+            error_message.append(
+                format(jsonschema.exceptions.best_match(validator.iter_errors(data)))
+            )
+        return "\n".join(error_message)
+
+
+_validators: Dict[Hashable, Tuple[Tuple, SchemaValidator]] = {}
+_validators_lock = threading.Lock()
+
+
+def get_schema_validator(session: Session, name: str) -> SchemaValidator:
+    """
+    Returns a (process wide) cached SchemaValidator for the schemas named name.
+
+    Schemas are never changed in place, so the cache is invalidated by a stamp of
+    count and max id of the schema rows, which is cheap to query.
+    """
+    key = (str(session.get_bind().url), name)
+    stamp = tuple(
+        session.query(func.count(dbjsonschema.JSONSchema.id), func.max(dbjsonschema.JSONSchema.id))
+        .filter(dbjsonschema.JSONSchema.name == name)
+        .one()
+    )
+    with _validators_lock:
+        cached = _validators.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+    schemas = (
+        session.query(dbjsonschema.JSONSchema.version, dbjsonschema.JSONSchema.schema)
+        .filter(dbjsonschema.JSONSchema.name == name)
+        .all()
+    )
+    if not schemas:
+        raise RuntimeError("No JSON schemas found with name {}".format(name))
+    validator = SchemaValidator(name, schemas)
+    with _validators_lock:
+        _validators[key] = (stamp, validator)
+    return validator
+
+
+@contextmanager
+def skip_db_validation(session: Session):
+    """
+    Skip the JSON validation in the schema version triggers for rows written within the
+    context, as long as the rows have schema_version set. The caller is responsible for
+    validating the data, see get_schema_validator().
+
+    The setting is local to the current transaction. If an exception is raised, the setting
+    is not reset, since the transaction has to be rolled back anyway.
+    """
+    session.execute("SET LOCAL {} = 'on'".format(SKIP_DB_VALIDATION_SETTING))
+    yield
+    session.execute("SET LOCAL {} = 'off'".format(SKIP_DB_VALIDATION_SETTING))
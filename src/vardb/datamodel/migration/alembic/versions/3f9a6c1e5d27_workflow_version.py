@@ -0,0 +1,35 @@
+"""Add workflow version table, incremented on changes to overview data
+
+Revision ID: 3f9a6c1e5d27
+Revises: b7d3e9f2a614
+Create Date: 2026-10-18 20:03:17.845512
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "3f9a6c1e5d27"
+down_revision = "b7d3e9f2a614"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+from vardb.datamodel.workflow import create_workflow_version_triggers
+
+
+def upgrade():
+    conn = op.get_bind()
+
+    op.create_table(
+        "workflowversion",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("version", sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_workflowversion")),
+    )
+
+    # Inserts the version row and creates the triggers
+    create_workflow_version_triggers(conn)
+
+
+def downgrade():
+    raise NotImplementedError()
@@ -0,0 +1,29 @@
+"""Allow skipping json validation in schema version triggers
+
+Revision ID: 5c2f8e1a9b47
+Revises: d394766ada41
+Create Date: 2026-10-18 10:12:31.482913
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "5c2f8e1a9b47"
+down_revision = "d394766ada41"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+from sqlalchemy.orm.session import Session
+from vardb.datamodel.jsonschemas.update_schemas import create_schema_triggers
+
+
+def upgrade():
+    # Triggers now accept an application provided schema_version when the transaction local
+    # setting ella.skip_json_validation is 'on' (see vardb/datamodel/jsonschemas/validator.py)
+    session = Session(bind=op.get_bind())
+    create_schema_triggers(session)
+    session.flush()
+
+
+def downgrade():
+    raise NotImplementedError()
@@ -0,0 +1,27 @@
+"""Allow bulk updates of annotation shadow tables
+
+Revision ID: 8e4b1d3c7a52
+Revises: 5c2f8e1a9b47
+Create Date: 2026-10-18 17:45:02.118390
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "8e4b1d3c7a52"
+down_revision = "5c2f8e1a9b47"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+from api.config import config
+from vardb.datamodel.annotationshadow import create_trigger_sql
+
+
+def upgrade():
+    # Adds insert_annotationshadow_bulk(), and lets the INSERT trigger be skipped
+    # using the transaction local setting ella.skip_annotationshadow_trigger
+    op.execute(create_trigger_sql(config))
+
+
+def downgrade():
+    raise NotImplementedError()
@@ -0,0 +1,52 @@
+"""Add trigram indexes for substring search
+
+Revision ID: 9c2e4a7b1f38
+Revises: 3f9a6c1e5d27
+Create Date: 2026-10-18 21:14:52.331907
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "9c2e4a7b1f38"
+down_revision = "3f9a6c1e5d27"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+
+
+def upgrade():
+    print("Creating indexes, this can take a while...")
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute(
+        "CREATE INDEX ix_annotationshadowtranscript_hgvsc_trgm ON annotationshadowtranscript USING gin(hgvsc gin_trgm_ops)"
+    )
+    op.execute(
+        "CREATE INDEX ix_annotationshadowtranscript_hgvsp_trgm ON annotationshadowtranscript USING gin(hgvsp gin_trgm_ops)"
+    )
+    op.execute(
+        "CREATE INDEX ix_annotationshadowtranscript_transcript_unversioned ON annotationshadowtranscript (split_part(transcript, '.', 1))"
+    )
+    op.execute("CREATE INDEX ix_gene_hgnc_symbol_trgm ON gene USING gin(hgnc_symbol gin_trgm_ops)")
+    op.execute("CREATE INDEX ix_analysis_name_trgm ON analysis USING gin(name gin_trgm_ops)")
+    # Prefix search on lower(hgvsc) is replaced by substring search, using the trigram index.
+    # ix_gene_hgnc_symbol is kept, as it enforces unique gene symbols.
+    op.execute("DROP INDEX IF EXISTS ix_annotationshadowtranscript_hgvsc")
+
+
+def downgrade():
+    op.execute(
+        "CREATE INDEX ix_annotationshadowtranscript_hgvsc ON annotationshadowtranscript USING btree(lower(hgvsc) text_pattern_ops)"
+    )
+    op.drop_index("ix_analysis_name_trgm", table_name="analysis")
+    op.drop_index("ix_gene_hgnc_symbol_trgm", table_name="gene")
+    op.drop_index(
+        "ix_annotationshadowtranscript_transcript_unversioned",
+        table_name="annotationshadowtranscript",
+    )
+    op.drop_index(
+        "ix_annotationshadowtranscript_hgvsp_trgm", table_name="annotationshadowtranscript"
+    )
+    op.drop_index(
+        "ix_annotationshadowtranscript_hgvsc_trgm", table_name="annotationshadowtranscript"
+    )
@@ -0,0 +1,121 @@
+"""Add workflow state tables with the latest interpretation per analysis/allele
+
+Revision ID: b7d3e9f2a614
+Revises: 8e4b1d3c7a52
+Create Date: 2026-10-18 19:12:40.532107
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "b7d3e9f2a614"
+down_revision = "8e4b1d3c7a52"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from vardb.datamodel.workflow import create_workflow_state_triggers
+
+
+def upgrade():
+    conn = op.get_bind()
+
+    interpretation_status = postgresql.ENUM(
+        "Not started", "Ongoing", "Done", name="interpretation_status", create_type=False
+    )
+
+    op.create_table(
+        "analysisworkflowstate",
+        sa.Column("analysis_id", sa.Integer(), nullable=False),
+        sa.Column("analysisinterpretation_id", sa.Integer(), nullable=False),
+        sa.Column(
+            "workflow_status",
+            postgresql.ENUM(
+                "Not ready",
+                "Interpretation",
+                "Review",
+                "Medical review",
+                name="analysisinterpretation_workflow_status",
+                create_type=False,
+            ),
+            nullable=False,
+        ),
+        sa.Column("status", interpretation_status, nullable=False),
+        sa.Column("finalized", sa.Boolean(), nullable=True),
+        sa.Column("interpretation_count", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["analysis_id"],
+            ["analysis.id"],
+            name=op.f("fk_analysisworkflowstate_analysis_id_analysis"),
+            ondelete="CASCADE",
+        ),
+        sa.ForeignKeyConstraint(
+            ["analysisinterpretation_id"],
+            ["analysisinterpretation.id"],
+            name=op.f("fk_analysisworkflowstate_analysisinterpretation_id_anal_b5f6"),
+            ondelete="CASCADE",
+        ),
+        sa.PrimaryKeyConstraint("analysis_id", name=op.f("pk_analysisworkflowstate")),
+    )
+    op.create_index(
+        "ix_analysisworkflowstate_status",
+        "analysisworkflowstate",
+        ["status", "workflow_status"],
+        unique=False,
+    )
+
+    op.create_table(
+        "alleleworkflowstate",
+        sa.Column("allele_id", sa.Integer(), nullable=False),
+        sa.Column("alleleinterpretation_id", sa.Integer(), nullable=False),
+        sa.Column(
+            "workflow_status",
+            postgresql.ENUM(
+                "Interpretation",
+                "Review",
+                name="alleleinterpretation_workflow_status",
+                create_type=False,
+            ),
+            nullable=False,
+        ),
+        sa.Column("status", interpretation_status, nullable=False),
+        sa.Column("finalized", sa.Boolean(), nullable=True),
+        sa.Column("interpretation_count", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["allele_id"], ["allele.id"], name=op.f("fk_alleleworkflowstate_allele_id_allele")
+        ),
+        sa.ForeignKeyConstraint(
+            ["alleleinterpretation_id"],
+            ["alleleinterpretation.id"],
+            name=op.f("fk_alleleworkflowstate_alleleinterpretation_id_allelein_6690"),
+            ondelete="CASCADE",
+        ),
+        sa.PrimaryKeyConstraint("allele_id", name=op.f("pk_alleleworkflowstate")),
+    )
+    op.create_index(
+        "ix_alleleworkflowstate_status",
+        "alleleworkflowstate",
+        ["status", "workflow_status"],
+        unique=False,
+    )
+
+    op.create_index(
+        "ix_analysisinterpretation_analysisid_datecreated",
+        "analysisinterpretation",
+        ["analysis_id", "date_created"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_alleleinterpretation_alleleid_datecreated",
+        "alleleinterpretation",
+        ["allele_id", "date_created"],
+        unique=False,
+    )
+
+    # Creates the triggers and fills the tables from the existing interpretations
+    create_workflow_state_triggers(conn)
+
+
+def downgrade():
+    raise NotImplementedError()
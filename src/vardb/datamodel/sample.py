@@ -76,6 +76,12 @@ class Analysis(Base):
         ForeignKeyConstraint(
             [genepanel_name, genepanel_version], ["genepanel.name", "genepanel.version"]
         ),
+        Index(
+            "ix_analysis_name_trgm",
+            name,
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        ),
     )
 
     def __repr__(self):
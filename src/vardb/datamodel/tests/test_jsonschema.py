@@ -3,7 +3,9 @@ import hypothesis as ht
 import hypothesis.strategies as st
 import pytest
 import jsonschema
+from vardb.datamodel.jsonschemas.jsonvalidationerror import JSONValidationError
 from vardb.datamodel.jsonschemas.load_schema import load_schema
+from vardb.datamodel.jsonschemas.validator import get_schema_validator
 
 
 @pytest.fixture(scope="module")
@@ -138,3 +140,20 @@ def test_failing_jsonschema_filterconfig(filterconfig_schema, filterconfig, modi
 
         traverse(modified, path)
         raise
+
+
+def test_schema_validator_matches_database(session, filterconfig):
+    validator = get_schema_validator(session, "filterconfig")
+    assert get_schema_validator(session, "filterconfig") is validator
+
+    invalid = {"!!INVALID!!": "!!INVALID!!"}
+    for fc in [f["filterconfig"] for f in filterconfig] + [invalid]:
+        db_version = session.execute(
+            "SELECT schema_version(CAST(:data AS jsonb), 'filterconfig', true)",
+            {"data": json.dumps(fc)},
+        ).scalar()
+        if db_version is None:
+            with pytest.raises(JSONValidationError):
+                validator.schema_version(fc)
+        else:
+            assert validator.schema_version(fc) == db_version
@@ -2,11 +2,13 @@
 
 import datetime
 import pytz
-from sqlalchemy import Column, Integer, DateTime, Enum, String, Boolean
+from typing import Dict, List, Optional
+from sqlalchemy import Column, Integer, BigInteger, DateTime, Enum, String, Boolean
 from sqlalchemy import ForeignKey, ForeignKeyConstraint, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy.orm.session import Session
 
 from vardb.datamodel import Base
 from vardb.util.mutjson import JSONMutableDict
@@ -137,6 +139,46 @@ Index(
     unique=True,
 )
 
+Index(
+    "ix_analysisinterpretation_analysisid_datecreated",
+    AnalysisInterpretation.analysis_id,
+    AnalysisInterpretation.date_created,
+)
+
+
+class AnalysisWorkflowState(Base):
+    """
+    Holds the state of the latest interpretation for each analysis.
+
+    Maintained by triggers on analysisinterpretation (see create_workflow_state_triggers()),
+    so that lookups on the current workflow state don't need to sort the whole
+    interpretation history.
+    """
+
+    __tablename__ = "analysisworkflowstate"
+
+    analysis_id = Column(Integer, ForeignKey("analysis.id", ondelete="CASCADE"), primary_key=True)
+    analysisinterpretation_id = Column(
+        Integer, ForeignKey("analysisinterpretation.id", ondelete="CASCADE"), nullable=False
+    )
+    workflow_status = Column(
+        Enum(
+            "Not ready",
+            "Interpretation",
+            "Review",
+            "Medical review",
+            name="analysisinterpretation_workflow_status",
+        ),
+        nullable=False,
+    )
+    status = Column(
+        Enum("Not started", "Ongoing", "Done", name="interpretation_status"), nullable=False
+    )
+    finalized = Column(Boolean)
+    interpretation_count = Column(Integer, nullable=False)
+
+    __table_args__ = (Index("ix_analysisworkflowstate_status", "status", "workflow_status"),)
+
 
 class AnalysisInterpretationSnapshot(Base, InterpretationSnapshotMixin):
     """
@@ -186,6 +228,38 @@ Index(
     unique=True,
 )
 
+Index(
+    "ix_alleleinterpretation_alleleid_datecreated",
+    AlleleInterpretation.allele_id,
+    AlleleInterpretation.date_created,
+)
+
+
+class AlleleWorkflowState(Base):
+    """
+    Holds the state of the latest interpretation for each allele.
+
+    See AnalysisWorkflowState.
+    """
+
+    __tablename__ = "alleleworkflowstate"
+
+    allele_id = Column(Integer, ForeignKey("allele.id"), primary_key=True)
+    alleleinterpretation_id = Column(
+        Integer, ForeignKey("alleleinterpretation.id", ondelete="CASCADE"), nullable=False
+    )
+    workflow_status = Column(
+        Enum("Interpretation", "Review", name="alleleinterpretation_workflow_status"),
+        nullable=False,
+    )
+    status = Column(
+        Enum("Not started", "Ongoing", "Done", name="interpretation_status"), nullable=False
+    )
+    finalized = Column(Boolean)
+    interpretation_count = Column(Integer, nullable=False)
+
+    __table_args__ = (Index("ix_alleleworkflowstate_status", "status", "workflow_status"),)
+
 
 class AlleleInterpretationSnapshot(Base, InterpretationSnapshotMixin):
     """
@@ -249,3 +323,178 @@ class InterpretationLog(Base):
     warning_cleared = Column(Boolean)
     alleleassessment_id = Column(Integer, ForeignKey("alleleassessment.id"))
     allelereport_id = Column(Integer, ForeignKey("allelereport.id"))
+
+
+class WorkflowVersion(Base):
+    """
+    Single row table with a version number, which is incremented on commit of every
+    transaction changing data shown in the workflow overviews
+    (see create_workflow_version_triggers()).
+    """
+
+    __tablename__ = "workflowversion"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+
+WORKFLOW_STATE_TABLES = [
+    {
+        "state": "analysisworkflowstate",
+        "interpretation": "analysisinterpretation",
+        "model": "analysis",
+    },
+    {"state": "alleleworkflowstate", "interpretation": "alleleinterpretation", "model": "allele"},
+]
+
+
+def create_workflow_state_triggers(session: Session) -> None:
+    """
+    Set up triggers to update the [analysis|allele]workflowstate tables upon changes
+    (INSERT, UPDATE or DELETE) to the interpretation tables, and (re)populate the
+    tables from the existing interpretations.
+
+    The latest interpretation is the one last created, as in the workflow queries.
+    """
+
+    sql_template = """
+        CREATE OR REPLACE FUNCTION refresh_{state}(model_id INTEGER) RETURNS void
+        LANGUAGE plpgsql
+        AS $$
+            BEGIN
+                INSERT INTO {state}
+                    ({model}_id, {interpretation}_id, workflow_status, status, finalized, interpretation_count)
+                    SELECT i.{model}_id, i.id, i.workflow_status, i.status, i.finalized, count(*) OVER ()
+                    FROM {interpretation} AS i
+                    WHERE i.{model}_id = model_id
+                    ORDER BY i.date_created DESC, i.id DESC
+                    LIMIT 1
+                ON CONFLICT ({model}_id) DO UPDATE SET
+                    {interpretation}_id = EXCLUDED.{interpretation}_id,
+                    workflow_status = EXCLUDED.workflow_status,
+                    status = EXCLUDED.status,
+                    finalized = EXCLUDED.finalized,
+                    interpretation_count = EXCLUDED.interpretation_count;
+                IF NOT FOUND THEN
+                    DELETE FROM {state} WHERE {model}_id = model_id;
+                END IF;
+            END;
+        $$;
+
+        CREATE OR REPLACE FUNCTION {interpretation}_workflow_state() RETURNS TRIGGER AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    PERFORM refresh_{state}(NEW.{model}_id);
+                ELSIF TG_OP = 'DELETE' THEN
+                    PERFORM refresh_{state}(OLD.{model}_id);
+                ELSE
+                    PERFORM refresh_{state}(NEW.{model}_id);
+                    IF NEW.{model}_id != OLD.{model}_id THEN
+                        PERFORM refresh_{state}(OLD.{model}_id);
+                    END IF;
+                END IF;
+                RETURN NULL;
+            END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS {interpretation}_workflow_state ON {interpretation};
+        CREATE TRIGGER {interpretation}_workflow_state
+        AFTER INSERT OR DELETE OR UPDATE OF {model}_id, workflow_status, status, finalized, date_created
+        ON {interpretation}
+            FOR EACH ROW EXECUTE PROCEDURE {interpretation}_workflow_state();
+
+        DELETE FROM {state};
+        INSERT INTO {state}
+            ({model}_id, {interpretation}_id, workflow_status, status, finalized, interpretation_count)
+            SELECT DISTINCT ON (i.{model}_id)
+                i.{model}_id,
+                i.id,
+                i.workflow_status,
+                i.status,
+                i.finalized,
+                count(*) OVER (PARTITION BY i.{model}_id)
+            FROM {interpretation} AS i
+            ORDER BY i.{model}_id, i.date_created DESC, i.id DESC;
+        """
+
+    for tables in WORKFLOW_STATE_TABLES:
+        session.execute(sql_template.format(**tables))
+
+
+# Tables with data shown in the workflow overviews, with the columns shown (None for all columns).
+# Interpretations are updated on every save of the interpretation state, so only the columns
+# shown in the overviews are included (the state columns are not). Note that saving also sets
+# date_last_update, which is shown, so saving still increments the version.
+# The allele overview includes the current annotation, but not custom annotation.
+WORKFLOW_VERSION_TABLES: Dict[str, Optional[List[str]]] = {
+    "analysis": None,
+    "sample": None,
+    "analysisinterpretation": [
+        "analysis_id",
+        "workflow_status",
+        "status",
+        "finalized",
+        "date_created",
+        "date_last_update",
+        "user_id",
+        "genepanel_name",
+        "genepanel_version",
+    ],
+    "alleleinterpretation": [
+        "allele_id",
+        "workflow_status",
+        "status",
+        "finalized",
+        "date_created",
+        "date_last_update",
+        "user_id",
+        "genepanel_name",
+        "genepanel_version",
+    ],
+    "interpretationlog": None,
+    "alleleassessment": None,
+    "annotation": ["date_superceeded"],
+    # Interpretation users are shown with name and group, not changed on login
+    "user": ["username", "first_name", "last_name", "active", "group_id"],
+}
+
+
+def create_workflow_version_triggers(session: Session) -> None:
+    """
+    Set up triggers to increment workflowversion.version once for every transaction
+    changing (INSERT, UPDATE or DELETE) any of WORKFLOW_VERSION_TABLES.
+    For tables with columns given, only updates of those columns increment the version.
+
+    The triggers are deferred to commit, so that the version row is only locked briefly
+    at the end of the transaction, and versions are incremented in commit order.
+    A reader seeing version N therefore sees all changes up to and including N.
+    """
+
+    session.execute(
+        """
+        INSERT INTO workflowversion (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
+
+        CREATE OR REPLACE FUNCTION increment_workflowversion() RETURNS TRIGGER AS $$
+            BEGIN
+                IF current_setting('ella.workflowversion_incremented', true) IS DISTINCT FROM 'on' THEN
+                    UPDATE workflowversion SET version = version + 1 WHERE id = 1;
+                    PERFORM set_config('ella.workflowversion_incremented', 'on', true);
+                END IF;
+                RETURN NULL;
+            END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+
+    sql_template = """
+        DROP TRIGGER IF EXISTS {table}_workflowversion ON "{table}";
+        CREATE CONSTRAINT TRIGGER {table}_workflowversion
+        AFTER INSERT OR DELETE OR UPDATE{columns} ON "{table}"
+            DEFERRABLE INITIALLY DEFERRED
+            FOR EACH ROW EXECUTE PROCEDURE increment_workflowversion();
+        """
+
+    for table, columns in WORKFLOW_VERSION_TABLES.items():
+        session.execute(
+            sql_template.format(table=table, columns=" OF " + ", ".join(columns) if columns else "")
+        )
@@ -22,11 +22,11 @@ class TypeConverter(Enum):
         elif self is TypeConverter.bool:
             return bool(strtobool(val) if isinstance(val, str) else val)
         else:
-            if isinstance(val, str):
-                # eval f-string needs quotes so value of val not interpreted as variable name
-                return eval(f"{self.name}('{val}')")
-            else:
-                return eval(f"{self.name}({val})")
+            return _BUILTIN_TYPES[self.name](val)
+
+
+# Look up builtins directly, rather than eval'ing per value (this is called for every record)
+_BUILTIN_TYPES = {"int": int, "float": float, "str": str}
 
 
 @dataclass(frozen=True)
@@ -9,12 +9,22 @@ Can use specific annotation parsers to split e.g. allele specific annotation.
 
 import re
 import logging
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 
 from sqlalchemy import tuple_
 from datalayer import queries
 from vardb.util import vcfiterator
 from vardb.deposit.importers import get_allele_from_record
+from vardb.deposit.pipeline import (
+    StageStats,
+    convert_annotations,
+    init_annotation_worker,
+    threaded_iterator,
+)
 
 from vardb.datamodel import sample, user, gene, assessment, allele
 
@@ -34,7 +44,20 @@ VALID_PREFILTER_KEYS = set(
 
 
 class PrefilterBatchGenerator:
-    def __init__(self, session, proband_sample_name, generator, prefilters=None, batch_size=2000):
+    def __init__(
+        self,
+        session,
+        proband_sample_name,
+        generator,
+        prefilters=None,
+        batch_size=2000,
+        preload_classifications=False,
+    ):
+        """
+        :param preload_classifications: If True, load the (chromosome, position, ref, alt) keys
+            of all classified alleles once, instead of querying the database for every batch.
+            Suitable for large (e.g. whole genome) deposits.
+        """
         self.session = session
         self.proband_sample_name = proband_sample_name
         self.prefilters = prefilters
@@ -43,28 +66,42 @@ class PrefilterBatchGenerator:
         self.batch = list()  # Stores the batch to submit
         self.previous_record = None
         self.previous_should_import_if_nearby = False
+        self.preload_classifications = preload_classifications
+        self.classified_alleles = None  # Set when preloaded
 
-    def prefilter_records(self, records):
-        """
-        Checks whether a record should be prefiltered, i.e. not imported.
-        We do this to reduce the amount of data to import for large analyses.
-
-        Current available criteria:
+        # Compile prefilters once. Each prefilter is a tuple of checks that all need to be
+        # fulfilled for a record to be filtered out. Only checks used by any prefilter are run.
+        self.compiled_prefilters = [tuple(sorted(set(prefilter))) for prefilter in prefilters or []]
+        self.used_checks = set(check for p in self.compiled_prefilters for check in p)
+        # Assertion to avoid sloppy implementation of new criteria
+        assert self.used_checks.issubset(VALID_PREFILTER_KEYS)
 
-        - Not multiallelic for proband
-        - GnomAD GENOMES.G > 0.05, num > 5000
-        - No existing classifications
-        - No variants within +/- 3bp
-        - Low mapping quality (MQ<20)
+    def _get_classified_alleles(self, allele_data):
         """
+        Returns the set of (chromosome, position, ref, alt) among allele_data that have
+        a classification.
+        """
+        if self.preload_classifications:
+            if self.classified_alleles is None:
+                self.classified_alleles = set(
+                    self.session.query(
+                        allele.Allele.chromosome,
+                        allele.Allele.vcf_pos,
+                        allele.Allele.vcf_ref,
+                        allele.Allele.vcf_alt,
+                    )
+                    .join(assessment.AlleleAssessment)
+                    .distinct()
+                    .all()
+                )
+                log.info(
+                    "Preloaded {} classified alleles for prefiltering".format(
+                        len(self.classified_alleles)
+                    )
+                )
+            return self.classified_alleles
 
-        result_records = []
-
-        allele_data = [
-            (r.variant.CHROM, r.variant.POS, r.variant.REF, r.variant.ALT[0]) for r in records
-        ]
-
-        alleles_classifications = (
+        return set(
             self.session.query(
                 allele.Allele.chromosome,
                 allele.Allele.vcf_pos,
@@ -84,6 +121,34 @@ class PrefilterBatchGenerator:
             .all()
         )
 
+    def _should_filter_out(self, checks):
+        """
+        If any of the prefilters have all their criteria fulfilled, it should be filtered out
+        """
+        return any(all(checks[c] for c in prefilter) for prefilter in self.compiled_prefilters)
+
+    def prefilter_records(self, records):
+        """
+        Checks whether a record should be prefiltered, i.e. not imported.
+        We do this to reduce the amount of data to import for large analyses.
+
+        Current available criteria:
+
+        - Not multiallelic for proband
+        - GnomAD GENOMES.G > 0.05, num > 5000
+        - No existing classifications
+        - No variants within +/- 3bp
+        - Low mapping quality (MQ<20)
+        """
+
+        result_records = []
+
+        if "no_classification" in self.used_checks:
+            classified_alleles = self._get_classified_alleles(
+                [(r.variant.CHROM, r.variant.POS, r.variant.REF, r.variant.ALT[0]) for r in records]
+            )
+
+        used_checks = self.used_checks
         for r in records:
             # If the current record is nearby the previous, and the previous record was excluded
             # because of the nearby-check (previous_should_import_if_nearby),
@@ -95,52 +160,39 @@ class PrefilterBatchGenerator:
             ):
                 result_records.append(self.previous_record)
 
-            has_classification = next(
-                (
-                    a
-                    for a in alleles_classifications
-                    if a == (r.variant.CHROM, r.variant.POS, r.variant.REF, r.variant.ALT[0])
-                ),
-                False,
-            )
-
-            # Create an object with all possible criteria
-            all_checks = {
-                "non_multiallelic": not r.is_sample_multiallelic(self.proband_sample_name),
-                "hi_frequency": float(r.variant.INFO.get("GNOMAD_GENOMES__AF", 0.0)) > 0.05
-                and int(r.variant.INFO.get("GNOMAD_GENOMES__AN", 0)) > 5000,
-                "position_not_nearby": self.previous_record is None
-                or not self._is_nearby(self.previous_record, r),
-                "no_classification": not has_classification,
-                "low_mapping_quality": float(r.variant.INFO.get("MQ", float("inf"))) < 20,
-            }
-
-            # Assertion to avoid sloppy implementation of new criteria
-            assert set(all_checks.keys()) == VALID_PREFILTER_KEYS
-
-            def should_filter_out(all_checks, prefilters):
-                """
-                Run all checks against each prefilter in turn.
-                If any of the prefilters have all their criteria fulfilled, it should be filtered out
-                """
-                for prefilter in prefilters:
-                    prefilter_checks = {
-                        check: value for check, value in all_checks.items() if check in prefilter
-                    }
-                    if all(prefilter_checks.values()):
-                        return True
-                return False
-
-            if not should_filter_out(all_checks, self.prefilters):
+            # Compute the criteria used by any of the prefilters
+            checks = {}
+            if "non_multiallelic" in used_checks:
+                checks["non_multiallelic"] = not r.is_sample_multiallelic(self.proband_sample_name)
+            if "hi_frequency" in used_checks:
+                checks["hi_frequency"] = (
+                    float(r.variant.INFO.get("GNOMAD_GENOMES__AF", 0.0)) > 0.05
+                    and int(r.variant.INFO.get("GNOMAD_GENOMES__AN", 0)) > 5000
+                )
+            if "position_not_nearby" in used_checks:
+                checks["position_not_nearby"] = self.previous_record is None or not self._is_nearby(
+                    self.previous_record, r
+                )
+            if "no_classification" in used_checks:
+                checks["no_classification"] = (
+                    r.variant.CHROM,
+                    r.variant.POS,
+                    r.variant.REF,
+                    r.variant.ALT[0],
+                ) not in classified_alleles
+            if "low_mapping_quality" in used_checks:
+                checks["low_mapping_quality"] = float(r.variant.INFO.get("MQ", float("inf"))) < 20
+
+            if not self._should_filter_out(checks):
                 result_records.append(r)
                 self.previous_should_import_if_nearby = False  # Already imported
-            else:
+            elif "position_not_nearby" in used_checks:
                 # Track if this record should be imported if the next record is nearby this record by
                 # "simulating" the current record has a nearby variant
-                all_checks["position_not_nearby"] = False
-                self.previous_should_import_if_nearby = not should_filter_out(
-                    all_checks, self.prefilters
-                )
+                checks["position_not_nearby"] = False
+                self.previous_should_import_if_nearby = not self._should_filter_out(checks)
+            else:
+                self.previous_should_import_if_nearby = False
             self.previous_record = r
         return result_records
 
@@ -390,10 +442,73 @@ class DepositAnalysis(DepositFromVCF):
                         f"Invalid postprocess method {method} in {pattern} of user group {deposit_usergroup_id}"
                     )
 
-    def import_vcf(self, analysis_config_data, append=False):
+    def _write_batch(
+        self,
+        proband_only_records,
+        batch_records,
+        annotation_data,
+        block_iterator,
+        proband_sample_name,
+        db_samples,
+        stats,
+    ):
+        """
+        Writer stage: imports alleles, annotation and genotypes for one batch of records.
+        annotation_data is the already extracted annotation for each of proband_only_records.
+        """
+        with stats.timed("Database write", len(batch_records)):
+            for record in proband_only_records:
+                self.allele_importer.add(record)
+            alleles = self.allele_importer.process()
+
+            for record, record_annotation_data in zip(proband_only_records, annotation_data):
+                allele = get_allele_from_record(record, alleles)
+                self.annotation_importer.add_extracted(record_annotation_data, allele["id"])
+
+            # block_iterator splits batch_records into "multiallelic blocks" (if the site is multiallelic),
+            # yielding the proband's records along with data about the other samples used in genotype_importer
+            for (
+                proband_records,
+                proband_alleles,
+                block_records,
+                samples_missing_coverage,
+            ) in block_iterator.iter_blocks(batch_records, alleles):
+                self.genotype_importer.add(
+                    proband_records,
+                    proband_alleles,
+                    proband_sample_name,
+                    db_samples,
+                    samples_missing_coverage,
+                    block_records,
+                )
+                self.counter["nVariantsImported"] += len(proband_records)
+
+            annotations = self.annotation_importer.process()
+            assert len(alleles) == len(annotations), "Got {} alleles and {} annotations".format(
+                len(alleles), len(annotations)
+            )
+            self.genotype_importer.process()
+
+        self.counter["nRecordsProcessed"] += len(batch_records)
+        log.info(
+            "Progress: {} records processed, {} variants imported".format(
+                self.counter["nRecordsProcessed"], self.counter["nVariantsImported"]
+            )
+        )
+
+    def import_vcf(
+        self, analysis_config_data, append=False, workers=0, preload_classifications=False
+    ):
         """
         Deposit related configs can be defined in the usergroup configs.
 
+        If workers > 0, the deposit is run as a pipeline: the vcf is parsed in a separate thread,
+        and annotation is converted in a pool of `workers` processes, while the database writes
+        are done by the calling thread in the same transaction as for a sequential deposit.
+
+        If preload_classifications is True, all classified alleles are loaded once for the
+        'no_classification' prefilter check, rather than queried per batch.
+
         Example:
         "deposit": {
             "analysis": [
@@ -487,57 +602,100 @@ class DepositAnalysis(DepositFromVCF):
             else:
                 prefilters = []
 
-            records_count = 0
-            imported_records_count = 0
-
             proband_sample_name = next(s.identifier for s in db_samples if s.proband is True)
             block_iterator = BlockIterator(proband_sample_name, vcf_sample_names)
 
+            stats = StageStats()
+            start = time.perf_counter()
+            if workers:
+                log.info("Running deposit pipeline with {} annotation worker(s)".format(workers))
+                executor = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=init_annotation_worker,
+                    initargs=(self.annotation_importer.import_config, vi.meta),
+                )
+                records = threaded_iterator(iter(vi), stats=stats)
+            else:
+                executor = None
+                records = iter(vi)
+
             # batch_records are _all_ records
-            for proband_only_records, batch_records in PrefilterBatchGenerator(
-                self.session, proband_sample_name, iter(vi), prefilters=prefilters
-            ):
-                for record in proband_only_records:
-                    self.allele_importer.add(record)
-                alleles = self.allele_importer.process()
+            batches = PrefilterBatchGenerator(
+                self.session,
+                proband_sample_name,
+                records,
+                prefilters=prefilters,
+                preload_classifications=preload_classifications,
+            )
 
-                for record in proband_only_records:
-                    allele = get_allele_from_record(record, alleles)
-                    self.annotation_importer.add(record, allele["id"])
+            # Batches waiting for annotation conversion to finish, processed in order
+            pending = deque()
+            try:
+                while True:
+                    with stats.timed("Batching/prefilter") as timer:
+                        next_batch = next(batches, None)
+                        if next_batch is not None:
+                            timer.count = len(next_batch[1])
+
+                    if next_batch is not None:
+                        proband_only_records, batch_records = next_batch
+                        record_annotations = [r.annotation() for r in proband_only_records]
+                        if executor:
+                            pending.append(
+                                (
+                                    proband_only_records,
+                                    batch_records,
+                                    executor.submit(convert_annotations, record_annotations),
+                                )
+                            )
+                        else:
+                            with stats.timed("Annotation conversion", len(proband_only_records)):
+                                annotation_data = [
+                                    self.annotation_importer.extract_annotation(a, vi.meta)
+                                    for a in record_annotations
+                                ]
+                            self._write_batch(
+                                proband_only_records,
+                                batch_records,
+                                annotation_data,
+                                block_iterator,
+                                proband_sample_name,
+                                db_samples,
+                                stats,
+                            )
 
-                # block_iterator splits batch_records into "multiallelic blocks" (if the site is multiallelic),
-                # yielding the proband's records along with data about the other samples used in genotype_importer
-                for (
-                    proband_records,
-                    proband_alleles,
-                    block_records,
-                    samples_missing_coverage,
-                ) in block_iterator.iter_blocks(batch_records, alleles):
-                    self.genotype_importer.add(
-                        proband_records,
-                        proband_alleles,
-                        proband_sample_name,
-                        db_samples,
-                        samples_missing_coverage,
-                        block_records,
-                    )
-                    imported_records_count += len(proband_records)
+                    # Keep the workers busy, but limit the number of batches held in memory
+                    while pending and (next_batch is None or len(pending) > 2 * workers):
+                        proband_only_records, batch_records, future = pending.popleft()
+                        annotation_data, conversion_time = future.result()
+                        stats.add(
+                            "Annotation conversion", len(proband_only_records), conversion_time
+                        )
+                        self._write_batch(
+                            proband_only_records,
+                            batch_records,
+                            annotation_data,
+                            block_iterator,
+                            proband_sample_name,
+                            db_samples,
+                            stats,
+                        )
 
-                annotations = self.annotation_importer.process()
-                assert len(alleles) == len(annotations), "Got {} alleles and {} annotations".format(
-                    len(alleles), len(annotations)
-                )
-                self.genotype_importer.process()
-                records_count += len(batch_records)
-                log.info(
-                    "Progress: {} records processed, {} variants imported".format(
-                        records_count, imported_records_count
-                    )
-                )
+                    if next_batch is None:
+                        break
+            finally:
+                if executor:
+                    for _, _, future in pending:
+                        future.cancel()
+                    executor.shutdown(wait=True)
 
             # Run asserts on block data
             block_iterator.finish_check()
 
+            stats.log()
+            log.info("Deposit of {} took {:.1f}s".format(data["vcf"], time.perf_counter() - start))
+
         if not append:
             self.postprocess(
                 deposit_usergroup_id,
@@ -30,12 +30,26 @@ log = logging.getLogger(__name__)
 
 
 class DepositFromVCF(object):
-    def __init__(self, session):
+    def __init__(
+        self, session, use_copy=False, python_json_validation=False, bulk_annotationshadow=False
+    ):
+        """
+        :param use_copy: Stream genotype data into the database using COPY.
+                         Considerably faster for analyses with many variants and/or samples.
+        :param python_json_validation: Validate annotation data in Python, skipping the
+                         (slower) validation in the database trigger.
+        :param bulk_annotationshadow: Update the annotation shadow tables once per batch,
+                         instead of per annotation in the database trigger.
+        """
         self.session = session
         self.sample_importer = SampleImporter(self.session)
-        self.annotation_importer = AnnotationImporter(self.session)
+        self.annotation_importer = AnnotationImporter(
+            self.session,
+            python_json_validation=python_json_validation,
+            bulk_annotationshadow=bulk_annotationshadow,
+        )
         self.allele_importer = AlleleImporter(self.session)
-        self.genotype_importer = GenotypeImporter(self.session)
+        self.genotype_importer = GenotypeImporter(self.session, use_copy=use_copy)
         self.analysis_importer = AnalysisImporter(self.session)
         self.analysis_interpretation_importer = AnalysisInterpretationImporter(self.session)
         self.allele_interpretation_importer = AlleleInterpretationImporter(self.session)
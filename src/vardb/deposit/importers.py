@@ -9,8 +9,12 @@ Can use specific annotation parsers to split e.g. allele specific annotation.
 """
 import base64
 import datetime
+import io
+import json
 import logging
 from collections import defaultdict
+from contextlib import ExitStack
+from dataclasses import dataclass
 from os.path import commonprefix
 from typing import (
     Any,
@@ -20,7 +24,6 @@ from typing import (
     List,
     Mapping,
     MutableMapping,
-    MutableSequence,
     Optional,
     Sequence,
     Tuple,
@@ -30,14 +33,16 @@ from typing import (
 
 import pytz
 from api.util.util import dict_merge
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, or_, text
 from sqlalchemy.orm import scoped_session
 from vardb.datamodel import allele as am
 from vardb.datamodel import annotation as annm
+from vardb.datamodel import annotationshadow
 from vardb.datamodel import assessment
 from vardb.datamodel import genotype as gm
 from vardb.datamodel import sample as sm
 from vardb.datamodel import workflow as wf
+from vardb.datamodel.jsonschemas.validator import get_schema_validator, skip_db_validation
 from vardb.datamodel.user import User
 from vardb.deposit.annotation_config import AnnotationImportConfig
 from vardb.deposit.annotationconverters import (
@@ -220,6 +225,75 @@ def batch_generator(generator, n):
         yield batch
 
 
+def hashable_value(value: Any) -> Any:
+    """
+    Canonical, hashable representation of a value, suitable as (part of) a dict key.
+
+    Mirrors JSONB equality: dicts are compared independent of key order, while
+    lists (and tuples, which are stored as JSON arrays) are compared in order.
+    Containers are tagged, so that e.g. {"a": 1} and [["a", 1]] do not collide.
+    """
+    if isinstance(value, dict):
+        return ("__dict__", tuple(sorted((k, hashable_value(v)) for k, v in value.items())))
+    if isinstance(value, (list, tuple)):
+        return ("__list__", tuple(hashable_value(v) for v in value))
+    return value
+
+
+def row_key(row: Mapping[str, Any], keys: Sequence[str]) -> Tuple:
+    return tuple(hashable_value(row[k]) for k in keys)
+
+
+def match_existing(
+    rows: Sequence[Dict[str, Any]],
+    db_existing: Sequence[Mapping[str, Any]],
+    compare_keys: Sequence[str],
+    include_pk: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Split rows into (input_existing, created), based on whether a row is found among db_existing
+    when comparing on compare_keys. If include_pk is given, the primary key of the
+    matching db row is copied onto the existing input row.
+
+    db_existing is indexed on compare_keys once, making the matching linear in len(rows).
+    """
+    if not db_existing:
+        return list(), list(rows)
+
+    existing_index: Dict[Tuple, Mapping[str, Any]] = {}
+    for e in db_existing:
+        existing_index.setdefault(row_key(e, compare_keys), e)
+
+    input_existing = list()
+    created = list()
+    for row in rows:
+        e = existing_index.get(row_key(row, compare_keys))
+        if e is None:
+            created.append(row)
+        else:
+            if include_pk:  # Copy over primary key if applicable
+                row[include_pk] = e[include_pk]
+            input_existing.append(row)
+    return input_existing, created
+
+
+def assign_primary_keys(
+    created: Sequence[Dict[str, Any]],
+    data_with_pk: Sequence[Mapping[str, Any]],
+    keys: Sequence[str],
+    include_pk: str,
+) -> None:
+    """
+    Set include_pk on every row in created, using the matching row (on keys) from data_with_pk.
+    """
+    pk_index: Dict[Tuple, Any] = {}
+    for d in data_with_pk:
+        pk_index.setdefault(row_key(d, keys), d[include_pk])
+
+    for c in created:
+        c[include_pk] = pk_index[row_key(c, keys)]
+
+
 def bulk_insert_nonexisting(
     session: scoped_session,
     model,
@@ -276,23 +350,10 @@ def bulk_insert_nonexisting(
         if not all_new:
             db_existing = session.query(*q_fields).filter(q_filter).all()
             db_existing = [r._asdict() for r in db_existing]
-        created = list()
-        input_existing = list()
-
-        if db_existing:
-            # Filter our batch_rows based on existing in db to see which objects we need to insert
-            for row in batch_rows:
-                should_create = True
-                for e in db_existing:
-                    if all(e[k] == row[k] for k in compare_keys):
-                        if include_pk:  # Copy over primary key if applicable
-                            row[include_pk] = e[include_pk]
-                        input_existing.append(row)
-                        should_create = False
-                if should_create:
-                    created.append(row)
-        else:
-            created = batch_rows
+
+        # Filter our batch_rows based on existing in db to see which objects we need to insert
+        input_existing, created = match_existing(batch_rows, db_existing, compare_keys, include_pk)
+
         if replace and input_existing:
             # Reinsert all existing data
             log.debug("Replacing {} objects on {}".format(len(input_existing), str(model)))
@@ -304,19 +365,80 @@ def bulk_insert_nonexisting(
             # We need to retrieve all data back in order to match input correct with primary key
             # This is quite heavy, but much better than alternative which is sending INSERTs one
             # by one.
-            q_fields = [getattr(model, k) for k in list(rows[0].keys())] + [
-                getattr(model, include_pk)
-            ]
+            pk_keys = [k for k in rows[0].keys() if k != include_pk]
+            q_fields = [getattr(model, k) for k in pk_keys] + [getattr(model, include_pk)]
             data_with_pk = session.query(*q_fields).filter(q_filter).all()
             assert len(data_with_pk) == len(created) + len(input_existing)
-            for c in created:
-                pk_item = next(
-                    n for n in data_with_pk if all(getattr(n, k) == v for k, v in c.items())
-                )
-                c[include_pk] = getattr(pk_item, include_pk)
+            assign_primary_keys(created, [d._asdict() for d in data_with_pk], pk_keys, include_pk)
         yield input_existing, created
 
 
+def reserve_primary_keys(session: scoped_session, model, count: int) -> List[int]:
+    """
+    Reserve count primary keys from the sequence backing model's (serial) id column.
+
+    Lets us set the ids client side before inserting, so that related rows can reference them
+    without reading the inserted rows back.
+    """
+    if not count:
+        return list()
+    return [
+        r[0]
+        for r in session.execute(
+            text(
+                "SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :count)"
+            ),
+            {"table": model.__tablename__, "count": count},
+        )
+    ]
+
+
+def _copy_value(value: Any) -> str:
+    "Converts a value to its PostgreSQL COPY (text format) representation"
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        value = "t" if value else "f"
+    elif isinstance(value, dict):
+        value = json.dumps(value)
+    elif isinstance(value, (list, tuple)):
+        value = "{" + ",".join("NULL" if v is None else str(v) for v in value) + "}"
+    else:
+        value = str(value)
+    return (
+        value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+    )
+
+
+def copy_insert(session: scoped_session, model, rows: Sequence[Mapping[str, Any]]) -> None:
+    """
+    Insert rows into model's table using PostgreSQL COPY, which is considerably faster than
+    (bulk) INSERTs for large amounts of data.
+
+    Runs on the session's connection, i.e. within the current transaction.
+    All rows must have the same keys. JSONB values must be dicts, ARRAY values lists/tuples.
+    """
+    if not rows:
+        return
+
+    columns = list(rows[0].keys())
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join(_copy_value(row[c]) for c in columns))
+        buf.write("\n")
+    buf.seek(0)
+
+    # Make sure pending ORM changes are sent before we use the raw connection
+    session.flush()
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            "COPY {} ({}) FROM STDIN".format(model.__tablename__, ", ".join(columns)), buf
+        )
+    finally:
+        cursor.close()
+
+
 class SampleImporter(object):
     """
     Note: there can be multiple samples with same name in database, and they might differ in genotypes.
@@ -490,11 +612,20 @@ class SampleImporter(object):
 
 
 class GenotypeImporter(object):
+    """
+    Imports genotypes and genotypesampledata in batches.
+
+    If use_copy is set, the data is streamed into the database using COPY. Genotype ids are then
+    reserved up front, keyed by the items' position in the batch, so no rows need to be read back.
+    """
+
     session: scoped_session
     batch_items: List[Dict[str, Any]]
+    use_copy: bool
 
-    def __init__(self, session: scoped_session):
+    def __init__(self, session: scoped_session, use_copy: bool = False):
         self.session = session
+        self.use_copy = use_copy
         self.batch_items = list()  # [{'genotype': .., 'genotypesampledata: [...]}]
 
         self.types = {
@@ -568,9 +699,10 @@ class GenotypeImporter(object):
         # that we want to keep AD for variants that are not the proband's.
         # We go through all the records for the block for each sample
         sample_allele_depth = defaultdict(dict)  # {sample_name: {'REF': 12, 'A': 134, 'G': 12}}
+        block_records_ad = [block_record.get_format_samples("AD") for block_record in block_records]
         for sample in samples:
-            for block_record in block_records:
-                s_ad = block_record.get_format_sample("AD", sample.identifier)
+            for block_record, block_record_ad in zip(block_records, block_records_ad):
+                s_ad = block_record_ad[sample.identifier]
                 if s_ad is None:
                     continue
 
@@ -598,6 +730,12 @@ class GenotypeImporter(object):
                 # Insert ref count under REF-key
                 sample_allele_depth[sample]["REF"] = ref_count
 
+        # If REF or POS is shifted, we can't trust the AD data.
+        ad_is_shifted = (
+            len(set([r.variant.POS for r in records])) != 1
+            or len(set([r.variant.REF for r in records])) != 1
+        )
+
         # Create genotypesampledata items
         genotypesampledata_items = list()
         for sample in samples:
@@ -619,10 +757,7 @@ class GenotypeImporter(object):
 
                 # If REF or POS is shifted, we can't trust the AD data.
                 allele_ratio = 0
-                if (
-                    len(set([r.variant.POS for r in records])) != 1
-                    or len(set([r.variant.REF for r in records])) != 1
-                ):
+                if ad_is_shifted:
                     allele_depth = {}
                 else:
                     allele_depth = sample_allele_depth[sample.identifier]
@@ -689,6 +824,9 @@ class GenotypeImporter(object):
         if not self.batch_items:
             return list(), list()
 
+        if self.use_copy:
+            return self._process_copy()
+
         result_genotypes = list()
         result_genotypesampledata = list()
 
@@ -702,18 +840,15 @@ class GenotypeImporter(object):
             replace=False,
             batch_size=len(genotypes),
         ):
-            # Insert the created genotype_id into the corresponding genotypesampledata
-            for c in created:
-                for item in self.batch_items:
-                    if (
-                        item["genotype"]["allele_id"] == c["allele_id"]
-                        and item["genotype"]["secondallele_id"] == c["secondallele_id"]
-                    ):
-                        for gsd in item["genotypesampledata_items"]:
-                            gsd["genotype_id"] = c["id"]
             assert len(existing) == 0
             result_genotypes.extend(created)
 
+        # Insert the created genotype_id into the corresponding genotypesampledata.
+        # With all_new=True, the created rows are the genotype items themselves.
+        for item in self.batch_items:
+            for gsd in item["genotypesampledata_items"]:
+                gsd["genotype_id"] = item["genotype"]["id"]
+
         genotypesampledata = list()
         for item in self.batch_items:
             genotypesampledata.extend(item["genotypesampledata_items"])
@@ -731,6 +866,24 @@ class GenotypeImporter(object):
         self.batch_items = list()
         return result_genotypes, result_genotypesampledata
 
+    def _process_copy(self):
+        genotype_ids = reserve_primary_keys(self.session, gm.Genotype, len(self.batch_items))
+
+        genotypes = list()
+        genotypesampledata = list()
+        for genotype_id, item in zip(genotype_ids, self.batch_items):
+            item["genotype"]["id"] = genotype_id
+            genotypes.append(item["genotype"])
+            for gsd in item["genotypesampledata_items"]:
+                gsd["genotype_id"] = genotype_id
+                genotypesampledata.append(gsd)
+
+        copy_insert(self.session, gm.Genotype, genotypes)
+        copy_insert(self.session, gm.GenotypeSampleData, genotypesampledata)
+
+        self.batch_items = list()
+        return genotypes, genotypesampledata
+
 
 class AssessmentImporter(object):
     session: scoped_session
@@ -823,59 +976,162 @@ class AssessmentImporter(object):
         return results
 
 
-class AnnotationImporter(object):
-    annotation_config: annm.AnnotationConfig
-    batch_items: List[Mapping[str, Any]]
-    import_config: List[AnnotationImportConfig]
-    session: scoped_session
-    _converters: Dict[str, MutableSequence[AnnotationConverter]]
+def _insert_at_leaf(obj: Dict, leaf: str, item: Any) -> None:
+    assert leaf not in obj
+    obj[leaf] = item
 
-    def __init__(self, session: scoped_session, import_config: Optional[Sequence[Mapping]] = None):
-        self.session = session
-        self.batch_items: List[Dict] = list()
 
-        self.annotation_config = (
-            self.session.query(annm.AnnotationConfig)
-            .order_by(annm.AnnotationConfig.id.desc())
-            .first()
-        )
-        if import_config is None:
-            self.import_config = [
-                AnnotationImportConfig(**c) for c in self.annotation_config.deposit
+def _extend_at_leaf(obj: Dict, leaf: str, items: Union[Tuple, List]) -> None:
+    assert isinstance(
+        items, (list, tuple)
+    ), f"Trying to extend with {type(items)}. Must be of instance list or tuple. {items}"
+
+    if leaf not in obj:
+        obj[leaf] = items
+    else:
+        assert isinstance(
+            obj[leaf], type(items)
+        ), f"Type mismatch. Existing type is {type(obj[leaf])}, trying to extend with items of type {type(items)}"
+        obj[leaf] += items
+
+
+def _append_at_leaf(obj: Dict, leaf: str, item: Any) -> None:
+    if leaf not in obj:
+        obj[leaf] = []
+
+    obj[leaf].append(item)
+
+
+def _merge_at_leaf(obj: Dict, leaf: str, item: Dict) -> None:
+    if leaf not in obj:
+        obj[leaf] = item
+    else:
+        assert isinstance(obj[leaf], dict)
+        dict_merge(obj[leaf], item)
+
+
+TARGET_MODE_FUNCS: Mapping[str, Callable[[Dict, str, Any], None]] = {
+    "insert": _insert_at_leaf,
+    "extend": _extend_at_leaf,
+    "append": _append_at_leaf,
+    "merge": _merge_at_leaf,
+}
+
+
+@dataclass(frozen=True)
+class ConverterStep:
+    """One converter of a compiled annotation plan, with its target resolved up front"""
+
+    converter: AnnotationConverter
+    additional_sources: Tuple[str, ...]
+    target_parents: Tuple[str, ...]
+    target_leaf: str
+    target_mode_func: Callable[[Dict, str, Any], None]
+
+
+class AnnotationPlan(object):
+    """
+    Precomputed conversion plan for one vcf header: source -> converter steps,
+    along with the sources that are required to be present in every record.
+
+    Converters are created (and set up) on first encounter of their source, as in most vcfs
+    only a subset of the configured sources are present.
+    """
+
+    meta: Mapping[str, Sequence[Mapping[str, Any]]]
+    required_sources: Tuple[str, ...]
+    _element_configs: Dict[str, List[Tuple[Type[AnnotationConverter], Mapping[str, Any]]]]
+    _info_meta: Dict[str, Mapping[str, Any]]
+    _steps: Dict[str, List[ConverterStep]]
+
+    def __init__(
+        self,
+        import_config: Sequence[AnnotationImportConfig],
+        meta: Mapping[str, Sequence[Mapping[str, Any]]],
+    ):
+        self.meta = meta
+        self._element_configs = defaultdict(list)
+        required_sources = []
+        for converter_config in import_config:
+            converter_class: Type[AnnotationConverter] = AnnotationConverters[
+                converter_config.name
+            ].value
+            for element_config in converter_config.converter_config.elements:
+                target_mode = element_config.get("target_mode", "insert")
+                assert (
+                    target_mode in TARGET_MODE_FUNCS
+                ), f"Unknown target mode: {target_mode}. Available target modes are {list(TARGET_MODE_FUNCS.keys())}"
+                self._element_configs[element_config["source"]].append(
+                    (converter_class, element_config)
+                )
+                if element_config.get("required"):
+                    required_sources.append(element_config["source"])
+
+        self.required_sources = tuple(required_sources)
+        self._info_meta = {}
+        for x in meta.get("INFO", []):
+            self._info_meta.setdefault(x.get("ID"), x)
+        self._steps = {}
+
+    def steps(self, source: str) -> List[ConverterStep]:
+        steps = self._steps.get(source)
+        if steps is None:
+            steps = self._steps[source] = [
+                self._create_step(converter_class, element_config)
+                for converter_class, element_config in self._element_configs.get(source, [])
             ]
+        return steps
+
+    def _create_step(
+        self, converter_class: Type[AnnotationConverter], element_config: Mapping[str, Any]
+    ) -> ConverterStep:
+        converterelement_config = converter_class.Config(**element_config)
+        meta = self._info_meta.get(element_config["source"])
+        if meta:
+            converter = converter_class(config=converterelement_config, meta=meta)
         else:
-            self.import_config = [AnnotationImportConfig(**c) for c in import_config]
-        self._converters = {}
+            converter = converter_class(config=converterelement_config)
+        converter.setup()
+
+        target = converterelement_config.target
+        assert target and target != ".", f"No path provided: {target}."
+        *target_parents, target_leaf = target.split(".")
+        return ConverterStep(
+            converter=converter,
+            additional_sources=tuple(converterelement_config.additional_sources),
+            target_parents=tuple(target_parents),
+            target_leaf=target_leaf,
+            target_mode_func=TARGET_MODE_FUNCS[converterelement_config.target_mode],
+        )
+
+
+class AnnotationExtractor(object):
+    """
+    Converts the INFO fields of a record into annotation data, according to import_config.
+
+    The import config is compiled into an AnnotationPlan once per vcf header, see reset().
+    Does not depend on a database session, and can therefore be used in worker processes.
+    """
+
+    import_config: List[AnnotationImportConfig]
+    _plan: Optional[AnnotationPlan]
+
+    def __init__(self, import_config: Sequence[AnnotationImportConfig]):
+        self.import_config = list(import_config)
+        self._plan = None
 
     def reset(self) -> None:
-        self._converters = {}
+        self._plan = None
+
+    def compile(self, meta: Mapping[str, Sequence[Mapping[str, Any]]]) -> AnnotationPlan:
+        if self._plan is None or self._plan.meta is not meta:
+            self._plan = AnnotationPlan(self.import_config, meta)
+        return self._plan
 
     def _get_or_create_converters(
         self, source: str, vcf_meta: Mapping[str, Sequence[Mapping[str, Any]]]
-    ) -> MutableSequence[AnnotationConverter]:
-        if source not in self._converters:
-            self._converters[source] = []
-            for converter_config in self.import_config:
-                for element_config in converter_config.converter_config.elements:
-                    if element_config["source"] != source:
-                        continue
-                    converter_class: Type[AnnotationConverter] = AnnotationConverters[
-                        converter_config.name
-                    ].value
-
-                    converterelement_config = converter_class.Config(**element_config)
-                    meta = next(
-                        (x for x in vcf_meta.get("INFO", []) if x.get("ID") == source), None
-                    )
-
-                    if meta:
-                        converter = converter_class(config=converterelement_config, meta=meta)
-                    else:
-                        converter = converter_class(config=converterelement_config)
-                    converter.setup()
-                    self._converters[source].append(converter)
-
-        return self._converters[source]
+    ) -> List[AnnotationConverter]:
+        return [step.converter for step in self.compile(vcf_meta).steps(source)]
 
     @staticmethod
     def _traverse_path(obj: Dict, path: str) -> Tuple[str, Dict]:
@@ -897,92 +1153,69 @@ class AnnotationImporter(object):
 
     @staticmethod
     def insert_at_target(obj: Dict, target: str, item: Any) -> None:
-        leaf, obj = AnnotationImporter._traverse_path(obj, target)
-        assert leaf not in obj
-        obj[leaf] = item
+        leaf, obj = AnnotationExtractor._traverse_path(obj, target)
+        _insert_at_leaf(obj, leaf, item)
 
     @staticmethod
     def extend_at_target(obj: Dict, target: str, items: Union[Tuple, List]) -> None:
-        assert isinstance(
-            items, (list, tuple)
-        ), f"Trying to extend with {type(items)}. Must be of instance list or tuple. {items}"
-
-        leaf, obj = AnnotationImporter._traverse_path(obj, target)
-        if leaf not in obj:
-            obj[leaf] = items
-        else:
-            assert isinstance(
-                obj[leaf], type(items)
-            ), f"Type mismatch. Existing type is {type(obj[leaf])}, trying to extend with items of type {type(items)}"
-            obj[leaf] += items
+        leaf, obj = AnnotationExtractor._traverse_path(obj, target)
+        _extend_at_leaf(obj, leaf, items)
 
     @staticmethod
     def append_at_target(obj: Dict, target: str, item: Any):
-        leaf, obj = AnnotationImporter._traverse_path(obj, target)
-        if leaf not in obj:
-            obj[leaf] = []
-
-        obj[leaf].append(item)
+        leaf, obj = AnnotationExtractor._traverse_path(obj, target)
+        _append_at_leaf(obj, leaf, item)
 
     @staticmethod
     def merge_at_target(obj: Dict, target: str, item: Dict):
-        leaf, obj = AnnotationImporter._traverse_path(obj, target)
-        if leaf not in obj:
-            obj[leaf] = item
-        else:
-            assert isinstance(obj[leaf], dict)
-            dict_merge(obj[leaf], item)
+        leaf, obj = AnnotationExtractor._traverse_path(obj, target)
+        _merge_at_leaf(obj, leaf, item)
 
     def _extract_annotation_from_record(self, record: Record) -> Mapping[str, Any]:
         """Given a record, return dict with annotation to be stored in db."""
+        return self.extract_annotation(record.annotation(), record.meta)
 
-        target_mode_funcs: Mapping[str, Callable[..., None]] = {
-            "insert": self.insert_at_target,
-            "extend": self.extend_at_target,
-            "append": self.append_at_target,
-            "merge": self.merge_at_target,
-        }
+    def extract_annotation(
+        self, record_annotation: Mapping[str, Any], meta: Mapping[str, Sequence[Mapping[str, Any]]]
+    ) -> Mapping[str, Any]:
+        """Given a record's annotation (INFO fields) and the vcf meta data, return dict with
+        annotation to be stored in db."""
+        plan = self.compile(meta)
 
         annotations: MutableMapping[str, Any] = {}
-        for source, value in record.annotation().items():
-            converters = self._get_or_create_converters(source, record.meta)
-            for converter in converters:
+        for source, value in record_annotation.items():
+            for step in plan.steps(source):
                 try:
-                    element_config = converter.config
-                    additional_sources = element_config.additional_sources
-
                     converter_args = ConverterArgs(
-                        value, {k: record.annotation().get(k) for k in additional_sources}
+                        value, {k: record_annotation.get(k) for k in step.additional_sources}
                     )
 
                     try:
-                        processed_value = converter(converter_args)
+                        processed_value = step.converter(converter_args)
                     except:
                         logging.exception(
-                            f"Conversion failed with source {source!r}={value!r}: {element_config}, {converter.__class__}"
+                            f"Conversion failed with source {source!r}={value!r}: {step.converter.config}, {step.converter.__class__}"
                         )
                         raise
 
-                    target = element_config.target
-                    target_mode = element_config.target_mode
-                    assert (
-                        target_mode in target_mode_funcs
-                    ), f"Unknown target mode: {target_mode}. Available target modes are {list(target_mode_funcs.keys())}"
-                    target_mode_funcs[target_mode](annotations, target, processed_value)
+                    obj = annotations
+                    for p in step.target_parents:
+                        if p not in obj:
+                            obj[p] = {}
+                        obj = obj[p]
+                    step.target_mode_func(obj, step.target_leaf, processed_value)
 
                 except Exception:
                     err_str = (
                         f"Error when trying to convert source '{source!r}' with value {value!r}"
-                        f" ({type(value)}), using converter {element_config}"
+                        f" ({type(value)}), using converter {step.converter.config}"
                     )
                     log.exception(err_str)
                     raise RuntimeError(err_str)
 
-        for converter_config in self.import_config:
-            for el_config in converter_config.converter_config.elements:
-                source = el_config["source"]
-                if source not in record.annotation() and el_config.get("required"):
-                    raise RuntimeError(f"Missing required source field in annotation: {source}")
+        for source in plan.required_sources:
+            if source not in record_annotation:
+                raise RuntimeError(f"Missing required source field in annotation: {source}")
 
         # TODO: Get a generic sorting/diffing to ensure all lists are sorted,
         # or that sorting is not taken into account when comparing json structures
@@ -992,9 +1225,45 @@ class AnnotationImporter(object):
             )
         return annotations
 
+
+class AnnotationImporter(AnnotationExtractor):
+    annotation_config: annm.AnnotationConfig
+    batch_items: List[Mapping[str, Any]]
+    session: scoped_session
+
+    def __init__(
+        self,
+        session: scoped_session,
+        import_config: Optional[Sequence[Mapping]] = None,
+        python_json_validation: bool = False,
+        bulk_annotationshadow: bool = False,
+    ):
+        """
+        :param python_json_validation: Validate the annotation data of each batch with cached
+            Python validators, and skip the per row validation in the database trigger.
+        :param bulk_annotationshadow: Skip the per row annotationshadow trigger, and update the
+            shadow tables with one statement per batch instead.
+        """
+        self.session = session
+        self.batch_items: List[Dict] = list()
+        self.python_json_validation = python_json_validation
+        self.bulk_annotationshadow = bulk_annotationshadow
+
+        self.annotation_config = (
+            self.session.query(annm.AnnotationConfig)
+            .order_by(annm.AnnotationConfig.id.desc())
+            .first()
+        )
+        if import_config is None:
+            import_config = self.annotation_config.deposit
+        super().__init__([AnnotationImportConfig(**c) for c in import_config])
+
     def add(self, record, allele_id):
         annotation_data = self._extract_annotation_from_record(record)
+        return self.add_extracted(annotation_data, allele_id)
 
+    def add_extracted(self, annotation_data, allele_id):
+        """Add annotation data already extracted from a record (see extract_annotation)"""
         data = {
             "allele_id": allele_id,
             "annotations": annotation_data,
@@ -1008,6 +1277,17 @@ class AnnotationImporter(object):
         if not self.batch_items:
             return list()
 
+        with ExitStack() as stack:
+            if self.python_json_validation:
+                validator = get_schema_validator(self.session, "annotation")
+                for item in self.batch_items:
+                    item["schema_version"] = validator.schema_version(item["annotations"])
+                stack.enter_context(skip_db_validation(self.session))
+            if self.bulk_annotationshadow:
+                stack.enter_context(annotationshadow.skip_annotationshadow_trigger(self.session))
+            return self._process_batch()
+
+    def _process_batch(self):
         results = list()
 
         # If annotation exists already for allele_id:
@@ -1053,13 +1333,14 @@ class AnnotationImporter(object):
             replace=False,
             batch_size=len(self.batch_items),  # Insert whole batch
         ):
-            to_supercede = list()
+            superceded_by_allele_id = dict()
+            for e in exists_with_different:
+                superceded_by_allele_id.setdefault(e.allele_id, e.id)
+
             to_link_previous = list()
             for c in created:
                 # Link new created ones to the ones superceded earlier
-                existing_annotation_id = next(
-                    (e.id for e in exists_with_different if e.allele_id == c["allele_id"]), None
-                )
+                existing_annotation_id = superceded_by_allele_id.get(c["allele_id"])
                 if existing_annotation_id:
                     to_link_previous.append(
                         {"id": c["id"], "previous_annotation_id": existing_annotation_id}
@@ -1068,6 +1349,11 @@ class AnnotationImporter(object):
             if to_link_previous:
                 self.session.bulk_update_mappings(annm.Annotation, to_link_previous)
 
+            if self.bulk_annotationshadow:
+                annotationshadow.insert_annotationshadow_bulk(
+                    self.session, [c["id"] for c in created]
+                )
+
             results.extend(existing + created)
         self.batch_items = list()
         return results
@@ -0,0 +1,148 @@
+"""
+Building blocks for running a VCF deposit as a staged pipeline:
+
+    parse (thread) -> prefilter/batching -> annotation conversion (worker processes) -> write
+
+Parsing and annotation conversion are CPU bound and independent of the database, while the
+writer stage (run by the caller) keeps all database work on a single session, preserving the
+transaction semantics of a sequential deposit. Stages are connected by bounded queues, so memory
+use stays limited regardless of input size.
+"""
+
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, Iterator, List, Mapping, Optional, Sequence
+
+from vardb.deposit.annotation_config import AnnotationImportConfig
+from vardb.deposit.importers import AnnotationExtractor
+
+log = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class StageStats(object):
+    """
+    Accumulates number of items processed and time spent per pipeline stage.
+    """
+
+    def __init__(self):
+        self.stages: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def add(self, stage: str, count: int, seconds: float):
+        item_count, total_seconds = self.stages.setdefault(stage, [0, 0.0])
+        self.stages[stage] = [item_count + count, total_seconds + seconds]
+
+    def timed(self, stage: str, count: int = 0):
+        return _StageTimer(self, stage, count)
+
+    def report(self) -> List[str]:
+        lines = []
+        for stage, (count, seconds) in self.stages.items():
+            throughput = count / seconds if seconds else float("inf")
+            lines.append(
+                "{}: {} records in {:.1f}s ({:.0f} records/s)".format(
+                    stage, count, seconds, throughput
+                )
+            )
+        return lines
+
+    def log(self):
+        for line in self.report():
+            log.info(line)
+
+
+class _StageTimer(object):
+    def __init__(self, stats: StageStats, stage: str, count: int):
+        self.stats = stats
+        self.stage = stage
+        self.count = count
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add(self.stage, self.count, time.perf_counter() - self.start)
+        return False
+
+
+def threaded_iterator(
+    iterable: Iterable, maxsize: int = 10000, stats: Optional[StageStats] = None, stage="Parse"
+) -> Iterator:
+    """
+    Consume iterable in a separate thread, handing over the items through a bounded queue.
+    Exceptions in the producer thread are reraised in the consumer.
+    """
+    q: queue.Queue = queue.Queue(maxsize=maxsize)
+    stop_event = threading.Event()
+
+    def produce():
+        try:
+            count = 0
+            seconds = 0.0
+            it = iter(iterable)
+            while not stop_event.is_set():
+                # Only time spent producing items counts, not time spent waiting on a full queue
+                start = time.perf_counter()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    break
+                finally:
+                    seconds += time.perf_counter() - start
+                count += 1
+                q.put(item)
+            if stats is not None:
+                stats.add(stage, count, seconds)
+            q.put(_STOP)
+        except BaseException as e:
+            q.put(e)
+
+    thread = threading.Thread(target=produce, name="deposit-{}".format(stage.lower()), daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = q.get()
+            if item is _STOP:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop_event.set()
+        # Unblock producer if it is waiting on a full queue
+        while thread.is_alive():
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                thread.join(0.1)
+
+
+# Worker process state, set up by init_annotation_worker
+_worker_extractor: Optional[AnnotationExtractor] = None
+_worker_meta: Optional[Mapping[str, Any]] = None
+
+
+def init_annotation_worker(
+    import_config: Sequence[AnnotationImportConfig], meta: Mapping[str, Any]
+) -> None:
+    """Initializer for annotation conversion worker processes"""
+    global _worker_extractor, _worker_meta
+    _worker_extractor = AnnotationExtractor(import_config)
+    _worker_meta = meta
+
+
+def convert_annotations(record_annotations: Sequence[Mapping[str, Any]]):
+    """
+    Convert a batch of records' annotation (INFO fields) in a worker process.
+
+    :returns: Tuple of (converted annotation data, time spent in seconds)
+    """
+    assert _worker_extractor is not None, "Worker not initialized"
+    start = time.perf_counter()
+    result = [_worker_extractor.extract_annotation(a, _worker_meta) for a in record_annotations]
+    return result, time.perf_counter() - start
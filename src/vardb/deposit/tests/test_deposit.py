@@ -1,4 +1,6 @@
 from collections import defaultdict
+from functools import partial
+from unittest import mock
 
 import hypothesis as ht
 from hypothesis import strategies as st
@@ -11,7 +13,7 @@ from vardb.deposit.deposit_analysis import (
     VALID_PREFILTER_KEYS,
 )
 from vardb.deposit.analysis_config import AnalysisConfigData
-from vardb.datamodel import genotype, sample, allele, assessment
+from vardb.datamodel import genotype, sample, allele, annotation, assessment
 from .vcftestgenerator import vcf_family_strategy
 
 
@@ -274,16 +276,28 @@ def test_prefilterbatchgenerator(
             session.add(aa)
             session.flush()
 
-    batch_generator = (r for r in batch_records)
-    pbg = PrefilterBatchGenerator(
-        session, "TEST_SAMPLE", batch_generator, prefilters=prefilters_to_use, batch_size=batch_size
-    )
+    # Results should be the same whether classifications are queried per batch or preloaded
+    results = []
+    for preload_classifications in [False, True]:
+        batch_generator = (r for r in batch_records)
+        pbg = PrefilterBatchGenerator(
+            session,
+            "TEST_SAMPLE",
+            batch_generator,
+            prefilters=prefilters_to_use,
+            batch_size=batch_size,
+            preload_classifications=preload_classifications,
+        )
 
-    total_prefiltered_pos = list()
-    total_batch_pos = list()
-    for prefiltered_batch, received_batch in pbg:
-        total_prefiltered_pos += [r.variant.POS for r in prefiltered_batch]
-        total_batch_pos += [r.variant.POS for r in received_batch]
+        total_prefiltered_pos = list()
+        total_batch_pos = list()
+        for prefiltered_batch, received_batch in pbg:
+            total_prefiltered_pos += [r.variant.POS for r in prefiltered_batch]
+            total_batch_pos += [r.variant.POS for r in received_batch]
+        results.append((total_prefiltered_pos, total_batch_pos))
+
+    assert results[0] == results[1]
+    total_prefiltered_pos, total_batch_pos = results[0]
 
     if manually_curated_result is not None:
         assert manually_curated_result == total_prefiltered_pos
@@ -332,11 +346,11 @@ def test_prefilterbatchgenerator(
     assert [r.variant.POS for r in batch_records] == total_batch_pos
 
 
-@ht.given(vcf_family_strategy(6))
+@ht.given(vcf_family_strategy(6), st.booleans())
 @ht.settings(
     deadline=None, max_examples=300, timeout=ht.unlimited
 )  # A bit heavy, so few tests by default
-def test_analysis_multiple(session, vcf_data):
+def test_analysis_multiple(session, vcf_data, use_copy):
     global ANALYSIS_NUM
     ANALYSIS_NUM += 1
     analysis_name = "TEST_ANALYSIS {}".format(ANALYSIS_NUM)
@@ -359,7 +373,7 @@ def test_analysis_multiple(session, vcf_data):
             }
         )
 
-        da = DepositAnalysis(session)
+        da = DepositAnalysis(session, use_copy=use_copy)
         da.import_vcf(acd)
 
     # Preload all data
@@ -530,3 +544,95 @@ def test_analysis_multiple(session, vcf_data):
                 else:
                     assert gsd.genotype_likelihood is None
                 assert gsd.allele_depth == sample_allele_depth[sample_name]
+
+
+def test_analysis_workers(session):
+    """
+    Deposit with annotation conversion in worker processes gives the same data as a
+    sequential deposit.
+    """
+    analysis_path = "/ella/src/vardb/testdata/analyses/default/brca_sample_2.HBOCUTV_v01/"
+
+    def deposit(workers):
+        acd = AnalysisConfigData(None)
+        acd.update(
+            {
+                "name": "TEST_ANALYSIS_WORKERS",
+                "genepanel_name": "HBOCUTV",
+                "genepanel_version": "v01",
+                "data": [
+                    {
+                        "vcf": analysis_path + "brca_sample_2.HBOCUTV_v01.vcf",
+                        "ped": analysis_path + "brca_sample_2.HBOCUTV_v01.ped",
+                    }
+                ],
+            }
+        )
+        # One record per batch, so that more batches are pending than kept by the pipeline
+        with mock.patch(
+            "vardb.deposit.deposit_analysis.PrefilterBatchGenerator",
+            partial(PrefilterBatchGenerator, batch_size=1),
+        ):
+            analysis = DepositAnalysis(session).import_vcf(acd, workers=workers)
+
+        sample_identifiers = {
+            s.id: s.identifier
+            for s in session.query(sample.Sample).filter(sample.Sample.analysis_id == analysis.id)
+        }
+        genotypes = (
+            session.query(genotype.Genotype)
+            .filter(genotype.Genotype.sample_id.in_(sample_identifiers))
+            .order_by(genotype.Genotype.id)
+            .all()
+        )
+        allele_ids = set(g.allele_id for g in genotypes) | set(
+            g.secondallele_id for g in genotypes if g.secondallele_id
+        )
+        allele_keys = {
+            a.id: (a.chromosome, a.vcf_pos, a.vcf_ref, a.vcf_alt)
+            for a in session.query(allele.Allele).filter(allele.Allele.id.in_(allele_ids))
+        }
+        annotations = {
+            allele_keys[a.allele_id]: a.annotations
+            for a in session.query(annotation.Annotation).filter(
+                annotation.Annotation.allele_id.in_(allele_ids),
+                annotation.Annotation.date_superceeded.is_(None),
+            )
+        }
+        # In order of insertion, to check that batches are written in vcf order
+        genotype_rows = [
+            (
+                allele_keys[g.allele_id],
+                allele_keys.get(g.secondallele_id),
+                sample_identifiers[g.sample_id],
+                g.filter_status,
+                g.variant_quality,
+            )
+            for g in genotypes
+        ]
+        genotype_keys = {
+            g.id: (allele_keys[g.allele_id], allele_keys.get(g.secondallele_id)) for g in genotypes
+        }
+        genotypesampledata_rows = [
+            (
+                genotype_keys[gsd.genotype_id],
+                sample_identifiers[gsd.sample_id],
+                gsd.secondallele,
+                gsd.multiallelic,
+                gsd.type,
+                gsd.genotype_quality,
+                gsd.sequencing_depth,
+                gsd.allele_ratio,
+                gsd.genotype_likelihood,
+                gsd.allele_depth,
+            )
+            for gsd in session.query(genotype.GenotypeSampleData)
+            .filter(genotype.GenotypeSampleData.genotype_id.in_(genotype_keys))
+            .order_by(genotype.GenotypeSampleData.id)
+        ]
+        session.rollback()
+        return annotations, genotype_rows, genotypesampledata_rows
+
+    sequential = deposit(0)
+    assert all(sequential)
+    assert deposit(2) == sequential
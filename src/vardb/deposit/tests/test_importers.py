@@ -6,7 +6,7 @@ from typing import Tuple
 import hypothesis as ht
 import hypothesis.strategies as st
 import vardb.deposit.importers as deposit
-from conftest import mock_record
+from conftest import mock_allele, mock_record
 from sqlalchemy.orm import scoped_session
 
 
@@ -289,3 +289,194 @@ def test_annotationimport_target_mode(session: scoped_session):
     )
     data = annotation_importer.add(record, None)
     assert data["annotations"] == {"key": {"foobar": {"a": 2, "b": 1, "c": 2}}}
+
+
+def _synthetic_allele_annotation_rows(n: int):
+    alleles = []
+    annotations = []
+    for i in range(n):
+        allele = {
+            "genome_reference": "GRCh37",
+            "chromosome": str(i % 22 + 1),
+            "start_position": 1000 + i,
+            "open_end_position": 1001 + i,
+            "change_type": "SNP",
+            "change_from": "A",
+            "change_to": "G",
+            "vcf_pos": 1001 + i,
+            "vcf_ref": "A",
+            "vcf_alt": "G",
+        }
+        alleles.append(allele)
+        annotations.append(
+            {
+                "allele_id": i,
+                "annotations": {
+                    "frequencies": {"GNOMAD_GENOMES": {"freq": {"G": i / n}, "num": {"G": i}}},
+                    "transcripts": [
+                        {"transcript": f"NM_{i}.1", "consequences": ["missense_variant"]},
+                        {"transcript": f"NM_{i}.2", "consequences": ["intron_variant"]},
+                    ],
+                },
+                "date_superceeded": None,
+                "annotation_config_id": 1,
+            }
+        )
+    return alleles, annotations
+
+
+def _naive_match_existing(rows, db_existing, compare_keys):
+    created = []
+    input_existing = []
+    for row in rows:
+        if any(all(e[k] == row[k] for k in compare_keys) for e in db_existing):
+            input_existing.append(row)
+        else:
+            created.append(row)
+    return input_existing, created
+
+
+def test_hashable_value():
+    assert deposit.hashable_value({"a": 1, "b": [1, 2]}) == deposit.hashable_value(
+        {"b": [1, 2], "a": 1}
+    )
+    assert deposit.hashable_value([1, 2]) != deposit.hashable_value([2, 1])
+    assert deposit.hashable_value((1, 2)) == deposit.hashable_value([1, 2])
+    assert deposit.hashable_value({"a": 1}) != deposit.hashable_value([["a", 1]])
+    hash(deposit.hashable_value({"a": [{"b": {"c": None}}]}))
+
+
+def test_match_existing():
+    alleles, annotations = _synthetic_allele_annotation_rows(200)
+    for rows, compare_keys in [
+        (alleles, list(alleles[0].keys())),
+        (annotations, ["allele_id", "annotations", "date_superceeded", "annotation_config_id"]),
+    ]:
+        # Every other row exists in db, with keys in reversed order to simulate JSONB roundtrip
+        db_existing = []
+        for idx, row in enumerate(rows[::2]):
+            e = json.loads(json.dumps({k: row[k] for k in reversed(compare_keys)}))
+            e["id"] = idx
+            db_existing.append(e)
+
+        rows = [dict(r) for r in rows]
+        expected_existing, expected_created = _naive_match_existing(rows, db_existing, compare_keys)
+        input_existing, created = deposit.match_existing(rows, db_existing, compare_keys, "id")
+        assert input_existing == expected_existing
+        assert created == expected_created
+        assert [r["id"] for r in input_existing] == list(range(len(db_existing)))
+
+        data_with_pk = [dict(r, id=1000 + idx) for idx, r in enumerate(expected_created)]
+        deposit.assign_primary_keys(created, data_with_pk[::-1], compare_keys, "id")
+        assert [c["id"] for c in created] == list(range(1000, 1000 + len(created)))
+
+
+def _uncompiled_extract_annotation(extractor, record, converters):
+    """Per-record work as done before annotation plans were compiled"""
+    target_mode_funcs = {
+        "insert": extractor.insert_at_target,
+        "extend": extractor.extend_at_target,
+        "append": extractor.append_at_target,
+        "merge": extractor.merge_at_target,
+    }
+    annotations = {}
+    for source, value in record.annotation().items():
+        for converter in converters.get(source, []):
+            additional_values = {
+                k: record.annotation().get(k) for k in converter.config.additional_sources
+            }
+            processed_value = converter(deposit.ConverterArgs(value, additional_values))
+            target_mode_funcs[converter.config.target_mode](
+                annotations, converter.config.target, processed_value
+            )
+    for converter_config in extractor.import_config:
+        for el_config in converter_config.converter_config.elements:
+            if el_config["source"] not in record.annotation() and el_config.get("required"):
+                raise RuntimeError()
+    if "references" in annotations:
+        annotations["references"] = sorted(annotations["references"], key=lambda x: x["pubmed_id"])
+    return annotations
+
+
+def test_annotation_extraction_compiled():
+    import yaml
+    from vardb.deposit.annotation_config import AnnotationImportConfig
+    from vardb.util.vcfiterator import VcfIterator
+
+    with open("/ella/src/vardb/testdata/annotation-config.yml") as f:
+        import_config = [AnnotationImportConfig(**c) for c in yaml.safe_load(f)["deposit"]]
+
+    vi = VcfIterator(
+        "/ella/src/vardb/testdata/analyses/default/brca_sample_master.HBOCUTV_v01/brca_sample_master.HBOCUTV_v01.vcf"
+    )
+    records = list(vi)
+
+    extractor = deposit.AnnotationExtractor(import_config)
+    converters = {
+        source: extractor._get_or_create_converters(source, vi.meta)
+        for source in set(s for r in records for s in r.annotation())
+    }
+
+    # Compiled plans give the same annotation as applying the converters per record
+    uncompiled = [_uncompiled_extract_annotation(extractor, r, converters) for r in records]
+    compiled = [extractor.extract_annotation(r.annotation(), vi.meta) for r in records]
+    assert compiled == uncompiled
+
+
+def test_annotation_import_modes(session):
+    from vardb.util.vcfiterator import VcfIterator
+
+    vi = VcfIterator(
+        "/ella/src/vardb/testdata/analyses/default/brca_sample_master.HBOCUTV_v01/brca_sample_master.HBOCUTV_v01.vcf"
+    )
+    records = list(vi)
+
+    n = 100
+    for python_json_validation, bulk_annotationshadow in [
+        (False, False),
+        (True, False),
+        (False, True),
+        (True, True),
+    ]:
+        annotation_importer = deposit.AnnotationImporter(
+            session,
+            python_json_validation=python_json_validation,
+            bulk_annotationshadow=bulk_annotationshadow,
+        )
+        allele_ids = [mock_allele(session).id for _ in range(n)]
+        for idx, allele_id in enumerate(allele_ids):
+            record = records[idx % len(records)]
+            annotation_importer.add_extracted(
+                annotation_importer.extract_annotation(record.annotation(), vi.meta), allele_id
+            )
+
+        annotation_importer.process()
+
+        # Triggers are only skipped within process()
+        for setting in ["ella.skip_json_validation", "ella.skip_annotationshadow_trigger"]:
+            assert (
+                session.execute(
+                    "SELECT current_setting(:setting, true)", {"setting": setting}
+                ).scalar()
+                != "on"
+            )
+
+        # Stored schema versions are the same as the ones given by the database validation
+        versions = session.execute(
+            "SELECT schema_version, schema_version(annotations, 'annotation', true) "
+            "FROM annotation WHERE allele_id IN :allele_ids",
+            {"allele_ids": tuple(allele_ids)},
+        ).fetchall()
+        assert len(versions) == n
+        assert all(stored is not None and stored == expected for stored, expected in versions)
+
+        # Shadow tables are filled in both modes
+        shadow_counts = session.execute(
+            "SELECT (SELECT count(*) FROM annotationshadowtranscript WHERE allele_id IN :allele_ids), "
+            "(SELECT count(*) FROM annotationshadowfrequency WHERE allele_id IN :allele_ids), "
+            "(SELECT coalesce(sum(jsonb_array_length(annotations->'transcripts')), 0) FROM annotation "
+            "WHERE allele_id IN :allele_ids)",
+            {"allele_ids": tuple(allele_ids)},
+        ).fetchone()
+        assert shadow_counts[0] == shadow_counts[2]
+        assert shadow_counts[1] == n
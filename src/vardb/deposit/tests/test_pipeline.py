@@ -0,0 +1,34 @@
+import pytest
+from vardb.deposit.pipeline import StageStats, threaded_iterator
+
+
+def test_threaded_iterator():
+    stats = StageStats()
+    assert list(threaded_iterator(iter(range(1000)), maxsize=10, stats=stats)) == list(range(1000))
+    assert stats.stages["Parse"][0] == 1000
+
+    # Consumer stops early
+    it = threaded_iterator(iter(range(1000)), maxsize=10)
+    assert next(it) == 0
+    it.close()
+
+    # Exceptions are reraised in consumer
+    def failing():
+        yield 1
+        raise ValueError("Parse error")
+
+    it = threaded_iterator(failing())
+    assert next(it) == 1
+    with pytest.raises(ValueError, match="Parse error"):
+        next(it)
+
+
+def test_stage_stats():
+    stats = StageStats()
+    stats.add("Write", 10, 1.0)
+    stats.add("Write", 30, 1.0)
+    with stats.timed("Convert", 5):
+        pass
+    assert stats.stages["Write"] == [40, 2.0]
+    assert stats.stages["Convert"][0] == 5
+    assert stats.report()[0] == "Write: 40 records in 2.0s (20 records/s)"
@@ -1,18 +1,22 @@
 #!/usr/bin/env python
 
 import datetime
+import heapq
+import json
 import logging
+import tempfile
 import time
 from os import path
 from collections import defaultdict, OrderedDict
 import pytz
+from sqlalchemy import and_, distinct, func, or_
 from sqlalchemy.orm import subqueryload, joinedload
 from openpyxl.writer.write_only import WriteOnlyCell
 from openpyxl.styles import Font
 from openpyxl import Workbook
 from bs4 import BeautifulSoup
 
-from vardb.datamodel import assessment, allele, sample, genotype
+from vardb.datamodel import assessment, sample, genotype
 from datalayer import AlleleDataLoader
 
 KEY_ANALYSES = "analyses"
@@ -23,6 +27,8 @@ AlleleAssessment.date_superceeded == None, to an Excel file
 """
 
 BATCH_SIZE = 200
+# Max number of formatted rows kept in memory while sorting
+SORT_CHUNK_SIZE = 20000
 SCRIPT_DIR = path.abspath(path.dirname(__file__))
 log = logging.getLogger(__name__)
 
@@ -77,21 +83,47 @@ def html_to_text(html):
     )
 
 
-def get_batch(alleleassessments):
+def get_batch(rows):
     """
-    Generates lists of AlleleAssessment objects
-    :param alleleassessments: An sqlalchemy.orm.query object
-    :yield : a list of max BATCH_SIZE AlleleAssessments
+    Generates lists of rows
+    :param rows: An iterable, e.g. an sqlalchemy.orm.query object
+    :yield : a list of max BATCH_SIZE rows
     """
-    i_batch = 0
-    while True:
-        batch = alleleassessments.slice(i_batch * BATCH_SIZE, (i_batch + 1) * BATCH_SIZE).all()
-
-        if batch:
+    batch = list()
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
             yield batch
-        else:
-            return
-        i_batch += 1
+            batch = list()
+    if batch:
+        yield batch
+
+
+def sort_rows(rows, key, chunk_size=SORT_CHUNK_SIZE):
+    """
+    Sort rows (lists of json serializable values) without keeping more than chunk_size rows
+    in memory. Sorted chunks are spilled to temporary files, and merged while reading back.
+    Like sorted(), the sort is stable.
+    """
+    chunk_files = []
+    try:
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                chunk.sort(key=key)
+                chunk_file = tempfile.TemporaryFile("w+")
+                chunk_files.append(chunk_file)
+                for r in chunk:
+                    chunk_file.write(json.dumps(r) + "\n")
+                chunk_file.seek(0)
+                chunk = []
+        chunk.sort(key=key)
+        sorted_chunks = [(json.loads(line) for line in f) for f in chunk_files] + [chunk]
+        yield from heapq.merge(*sorted_chunks, key=key)
+    finally:
+        for chunk_file in chunk_files:
+            chunk_file.close()
 
 
 def format_transcripts(allele_annotation):
@@ -134,12 +166,16 @@ def format_transcripts(allele_annotation):
     return {key: " | ".join(value) for key, value in list(formatted_transcripts.items())}
 
 
-def format_classification(alleleassessment, adl, previous_alleleassessment=None):
+def format_classification(alleleassessment, adl, previous_alleleassessment=None, n_samples=None):
 
     """
     Make a list of the classification fields of an AlleleAssessment
     :param alleleassessment: an AlleleAssessment object
     :param adl: an AlleleDataLoader object
+    :param previous_alleleassessment: object with classification and date_superceeded
+        of the previous assessment
+    :param n_samples: number of genotypes with the allele. Counted from
+        alleleassessment.allele.genotypes if not given.
     :return : a dict of formatted strings for an assessment
     """
 
@@ -199,7 +235,8 @@ def format_classification(alleleassessment, adl, previous_alleleassessment=None)
 
     formatted_transcript = format_transcripts(allele_dict["annotation"])
 
-    n_samples = len(alleleassessment.allele.genotypes)
+    if n_samples is None:
+        n_samples = len(alleleassessment.allele.genotypes)
 
     return {
         "gene": formatted_transcript.get("gene"),
@@ -237,9 +274,78 @@ def format_classification(alleleassessment, adl, previous_alleleassessment=None)
     }
 
 
+def current_alleleassessment_rows(session, with_analysis_names):
+    """
+    Query for all current alleleassessment ids, together with the previous assessment,
+    the number of samples and (optionally) the analysis names for the allele.
+    Everything is fetched in a single query, streamed using a server side cursor.
+    """
+    aa = assessment.AlleleAssessment
+
+    previous = (
+        session.query(
+            aa.allele_id,
+            aa.classification,
+            aa.date_superceeded,
+            func.row_number()
+            .over(partition_by=aa.allele_id, order_by=aa.date_superceeded.desc())
+            .label("rn"),
+        )
+        .filter(aa.date_superceeded.isnot(None))
+        .subquery()
+    )
+
+    allele_genotypes = or_(
+        genotype.Genotype.allele_id == aa.allele_id,
+        genotype.Genotype.secondallele_id == aa.allele_id,
+    )
+    n_samples = (
+        session.query(func.count(genotype.Genotype.id))
+        .filter(allele_genotypes)
+        .correlate(aa)
+        .as_scalar()
+    )
+
+    columns = [
+        aa.id,
+        previous.c.classification.label("prev_classification"),
+        previous.c.date_superceeded.label("prev_date_superceeded"),
+        n_samples.label("n_samples"),
+    ]
+    if with_analysis_names:
+        analysis_names = (
+            session.query(func.array_agg(distinct(sample.Analysis.name)))
+            .select_from(genotype.Genotype)
+            .join(sample.Sample, genotype.Genotype.sample_id == sample.Sample.id)
+            .join(sample.Analysis, sample.Sample.analysis_id == sample.Analysis.id)
+            .filter(allele_genotypes)
+            .correlate(aa)
+            .as_scalar()
+        )
+        columns.append(analysis_names.label("analysis_names"))
+
+    return (
+        session.query(*columns)
+        .outerjoin(previous, and_(previous.c.allele_id == aa.allele_id, previous.c.rn == 1))
+        .filter(aa.date_superceeded.is_(None))
+        .order_by(aa.id)
+        .yield_per(BATCH_SIZE)
+    )
+
+
+class PreviousAlleleAssessment(object):
+    def __init__(self, classification, date_superceeded):
+        self.classification = classification
+        self.date_superceeded = date_superceeded
+
+
 def dump_alleleassessments(session, filename, with_analysis_names):
     """
     Save all current alleleassessments to Excel document
+
+    Rows are streamed from the database and written incrementally,
+    so memory usage is independent of the number of alleleassessments.
+
     :param session: An sqlalchemy session
     :param filename:
     """
@@ -247,20 +353,9 @@ def dump_alleleassessments(session, filename, with_analysis_names):
     if not filename:
         raise RuntimeError("Filename for classification export is mandatory")
 
+    column_properties = OrderedDict(COLUMN_PROPERTIES)
     if not with_analysis_names:
-        del COLUMN_PROPERTIES[KEY_ANALYSES]
-
-    alleleassessments = (
-        session.query(assessment.AlleleAssessment)
-        .options(
-            subqueryload(assessment.AlleleAssessment.annotation)
-            .subqueryload("allele")
-            .joinedload("genotypes"),
-            joinedload(assessment.AlleleAssessment.genepanel),
-            subqueryload(assessment.AlleleAssessment.referenceassessments).joinedload("reference"),
-        )
-        .filter(assessment.AlleleAssessment.date_superceeded.is_(None))
-    )
+        del column_properties[KEY_ANALYSES]
 
     adl = AlleleDataLoader(session)
 
@@ -268,10 +363,9 @@ def dump_alleleassessments(session, filename, with_analysis_names):
     workbook = Workbook(write_only=True)
     worksheet = workbook.create_sheet()
 
-    csv = []
     csv_headers = []
     titles = []
-    for ii, cp in enumerate(COLUMN_PROPERTIES.values()):
+    for ii, cp in enumerate(column_properties.values()):
         csv_headers.append(cp[0])
         title = WriteOnlyCell(worksheet, value=cp[0])
         title.font = Font(bold=True)
@@ -280,63 +374,59 @@ def dump_alleleassessments(session, filename, with_analysis_names):
         worksheet.column_dimensions[chr(ii + 65)].width = cp[1]
 
     worksheet.append(titles)
-    csv.append(csv_headers)
-
-    t_start = time.time()
-    t_total = 0
-    rows = list()
-    csv_body = []
-    for batch_alleleassessments in get_batch(alleleassessments):
-        t_query = time.time()
-        log.info(
-            "Loaded %s allele assessments in %s seconds"
-            % (len(batch_alleleassessments), str(t_query - t_start))
-        )
 
-        for alleleassessment in batch_alleleassessments:
-            previous_alleleassessment = (
+    def classification_rows():
+        t_start = time.time()
+        for batch_rows in get_batch(current_alleleassessment_rows(session, with_analysis_names)):
+            alleleassessments = (
                 session.query(assessment.AlleleAssessment)
-                .filter(~assessment.AlleleAssessment.date_superceeded.is_(None))  # Is superceeded
-                .filter(assessment.AlleleAssessment.allele_id == alleleassessment.allele_id)
-                .order_by(assessment.AlleleAssessment.date_superceeded.desc())
-                .limit(1)
-                .one_or_none()
+                .options(
+                    joinedload(assessment.AlleleAssessment.allele),
+                    joinedload(assessment.AlleleAssessment.genepanel),
+                    subqueryload(assessment.AlleleAssessment.referenceassessments).joinedload(
+                        "reference"
+                    ),
+                )
+                .filter(assessment.AlleleAssessment.id.in_([r.id for r in batch_rows]))
             )
-            classification_dict = format_classification(
-                alleleassessment, adl, previous_alleleassessment=previous_alleleassessment
+            alleleassessments_by_id = {aa.id: aa for aa in alleleassessments}
+            t_query = time.time()
+            log.info(
+                "Loaded %s allele assessments in %s seconds"
+                % (len(batch_rows), str(t_query - t_start))
             )
-            if with_analysis_names:
-                analyses = (
-                    session.query(sample.Analysis)
-                    .join(genotype.Genotype.alleles, sample.Sample, sample.Analysis)
-                    .filter(allele.Allele.id == alleleassessment.allele_id)
-                    .all()
-                )
-                analysis_names = ",".join(map(str, [a.name for a in analyses]))
-
-                classification_dict[KEY_ANALYSES] = analysis_names
-            classification_columns = [classification_dict[key] for key in COLUMN_PROPERTIES]
-            csv_body.append(classification_columns)
-            rows.append(classification_columns)
-        t_get = time.time()
-        log.info("Read the allele assessments in %s seconds" % str(t_get - t_query))
-        t_total += t_get - t_start
-        t_start = time.time()
 
-    rows.sort(key=lambda x: (x[0] or "", x[1] or "", x[2] or ""))
-    csv_body.sort(key=lambda x: (x[0] or "", x[1] or "", x[2] or ""))
-
-    for r in rows:
-        worksheet.append(r)
-    for r in csv_body:
-        csv.append(r)
+            for row in batch_rows:
+                previous_alleleassessment = None
+                if row.prev_date_superceeded is not None:
+                    previous_alleleassessment = PreviousAlleleAssessment(
+                        row.prev_classification, row.prev_date_superceeded
+                    )
+                classification_dict = format_classification(
+                    alleleassessments_by_id[row.id],
+                    adl,
+                    previous_alleleassessment=previous_alleleassessment,
+                    n_samples=row.n_samples,
+                )
+                if with_analysis_names:
+                    classification_dict[KEY_ANALYSES] = ",".join(sorted(row.analysis_names or []))
+                yield [classification_dict[key] for key in column_properties]
 
-    log.info("Dumped database in %s seconds" % t_total)
+            log.info("Read the allele assessments in %s seconds" % str(time.time() - t_query))
+            t_start = time.time()
 
+    t_start = time.time()
     with open(filename + ".csv", "w") as csv_file:
-        for cols in csv:
+        csv_file.write("\t".join(csv_headers))
+        csv_file.write("\n")
+        for cols in sort_rows(
+            classification_rows(), key=lambda x: (x[0] or "", x[1] or "", x[2] or "")
+        ):
+            worksheet.append(cols)
             csv_file.write("\t".join(map(lambda c: str(c) if not isinstance(c, str) else c, cols)))
             csv_file.write("\n")
 
+    log.info("Dumped database in %s seconds" % (time.time() - t_start))
+
     workbook.save(filename + ".xlsx")
     log.info("Wrote database to %s.xlsx/csv" % filename)
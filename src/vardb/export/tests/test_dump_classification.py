@@ -0,0 +1,21 @@
+import hypothesis as ht
+import hypothesis.strategies as st
+
+from vardb.export import dump_classification
+
+
+@ht.given(
+    st.lists(
+        st.lists(st.one_of(st.none(), st.sampled_from(["A", "B", "C"])), min_size=3, max_size=3)
+    ),
+    st.integers(1, 5),
+)
+def test_sort_rows(rows, chunk_size):
+    # Add row number to check that the sort is stable
+    rows = [r + [idx] for idx, r in enumerate(rows)]
+
+    def key(x):
+        return (x[0] or "", x[1] or "")
+
+    result = list(dump_classification.sort_rows(iter(rows), key, chunk_size=chunk_size))
+    assert result == sorted(rows, key=key)
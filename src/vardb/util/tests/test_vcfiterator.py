@@ -0,0 +1,42 @@
+from conftest import mock_record
+
+
+def test_record_format_accessors():
+    samples = ["PROBAND", "FATHER", "MOTHER"]
+    record = mock_record(
+        {"CHROM": "X", "POS": 123, "REF": "A", "ALT": "C"},
+        fmt=[
+            {"GT": "0/1", "AD": "10,12", "DP": 22, "GQ": 99, "PL": "200,0,180"},
+            {"GT": "1", "AD": "0,15", "DP": 15, "GQ": 50, "PL": "300,0"},
+            {"GT": "./.", "AD": ".", "DP": ".", "GQ": ".", "PL": "."},
+        ],
+        samples=samples,
+    )
+
+    assert record.get_format_samples("GT") == {
+        "PROBAND": (0, 1),
+        "FATHER": (1,),
+        "MOTHER": (-1, -1),
+    }
+    assert record.get_format_samples("DP", scalar=True) == {
+        "PROBAND": 22,
+        "FATHER": 15,
+        "MOTHER": None,
+    }
+    assert record.get_format_samples("PL") == {
+        "PROBAND": [200, 0, 180],
+        "FATHER": [300, 0, None],
+        "MOTHER": [None, None, None],
+    }
+    assert record.get_format_samples("HQ") == {s: None for s in samples}
+    assert record.get_format_matrix("DP").shape == (3, 1)
+
+    # Bulk and per sample accessors agree
+    for field, scalar in [("GT", False), ("AD", False), ("DP", True), ("GQ", True), ("PL", False)]:
+        bulk = record.get_format_samples(field, scalar=scalar)
+        for sample in samples:
+            assert record.get_format_sample(field, sample, scalar=scalar) == bulk[sample]
+
+    # Values returned are not shared with the cache
+    record.get_format_sample("PL", "PROBAND").append(1)
+    assert record.get_format_sample("PL", "PROBAND") == [200, 0, 180]
@@ -42,17 +42,54 @@ def numpy_to_list(a: Optional[np.ndarray]):
 
 
 class Record(object):
+    """
+    Wraps a cyvcf2.Variant.
+
+    FORMAT fields (and genotypes) are decoded from cyvcf2 at most once per record, and cached for
+    all samples, as the importers look up several fields for every sample in a record.
+    """
+
     variant: cyvcf2.Variant
     samples: Sequence[str]
     meta: Mapping[str, Any]
+    _sample_indices: Mapping[str, int]
+    _format_cache: Dict[str, Tuple[Optional[np.ndarray], Optional[list]]]
+    _genotypes: Optional[list]
 
-    def __init__(self, variant: cyvcf2.Variant, samples: Sequence[str], meta: Mapping[str, Any]):
+    def __init__(
+        self,
+        variant: cyvcf2.Variant,
+        samples: Sequence[str],
+        meta: Mapping[str, Any],
+        sample_indices: Optional[Mapping[str, int]] = None,
+    ):
         self.variant = variant
         self.samples = samples
         self.meta = meta
+        if sample_indices is None:
+            sample_indices = {s: i for i, s in enumerate(samples)}
+        self._sample_indices = sample_indices
+        self._format_cache = {}
+        self._genotypes = None
 
     def _sample_index(self, sample_name: str):
-        return self.samples.index(sample_name)
+        try:
+            return self._sample_indices[sample_name]
+        except KeyError:
+            raise ValueError(f"{sample_name!r} is not in samples")
+
+    def _decoded_format(self, property: str) -> Tuple[Optional[np.ndarray], Optional[list]]:
+        "Returns (numpy matrix, decoded values as nested list) for FORMAT field. Cached per record."
+        if property not in self._format_cache:
+            matrix = self.variant.format(property)
+            self._format_cache[property] = (matrix, numpy_to_list(matrix))
+        return self._format_cache[property]
+
+    def _all_genotypes(self) -> list:
+        # cyvcf2 builds a new list of all samples' genotypes on every access of variant.genotypes
+        if self._genotypes is None:
+            self._genotypes = self.variant.genotypes
+        return self._genotypes
 
     def get_raw_filter(self):
         """Need to implement this here, as cyvcf2 does not distinguish between 'PASS' and '.' (both return None).
@@ -60,7 +97,7 @@ class Record(object):
         return str(self.variant).split("\t")[6]
 
     def sample_genotype(self, sample_name: str):
-        return tuple(self.variant.genotypes[self._sample_index(sample_name)][:-1])
+        return tuple(self._all_genotypes()[self._sample_index(sample_name)][:-1])
 
     def has_allele(self, sample_name: str):
         gt = self.sample_genotype(sample_name)
@@ -70,20 +107,45 @@ class Record(object):
         if property == "GT":
             return self.sample_genotype(sample_name)
         else:
-            prop = self.variant.format(property)
-            if prop is not None:
-                ret = numpy_to_list(prop[self._sample_index(sample_name)])
+            values = self._decoded_format(property)[1]
+            if values is not None:
+                ret = values[self._sample_index(sample_name)]
                 if scalar:
                     assert len(ret) == 1
                     return ret[0]
                 else:
-                    return ret
+                    return list(ret)
+            return None
+
+    def get_format_samples(self, property: str, scalar: bool = False) -> Dict[str, Any]:
+        """
+        Bulk version of get_format_sample: returns {sample_name: value} for all samples.
+        If the FORMAT field is not present, all values are None.
+        """
+        if property == "GT":
+            return {s: tuple(gt[:-1]) for s, gt in zip(self.samples, self._all_genotypes())}
+
+        values = self._decoded_format(property)[1]
+        if values is None:
+            return {s: None for s in self.samples}
+        if scalar:
+            assert all(len(v) == 1 for v in values)
+            return {s: v[0] for s, v in zip(self.samples, values)}
+        else:
+            return {s: list(v) for s, v in zip(self.samples, values)}
+
+    def get_format_matrix(self, property: str) -> Optional[np.ndarray]:
+        """
+        Returns the raw (samples x values) numpy matrix for FORMAT field, as given by cyvcf2.
+        Note that unknown integer values are not converted to None.
+        """
+        return self._decoded_format(property)[0]
 
     def get_format(self, property: str):
         if property == "GT":
-            return self.variant.genotypes
+            return self._all_genotypes()
         else:
-            return numpy_to_list(self.variant.format(property))
+            return self._decoded_format(property)[1]
 
     def get_block_id(self):
         return self.variant.INFO.get("OLD_MULTIALLELIC")
@@ -197,6 +259,7 @@ class VcfIterator(object):
             for variant in self.reader:
                 yield str(variant), variant
         else:
+            sample_indices = {s: i for i, s in enumerate(self.samples)}
             for variant in self.reader:
-                r = Record(variant, self.samples, self.meta)
+                r = Record(variant, self.samples, self.meta, sample_indices=sample_indices)
                 yield r
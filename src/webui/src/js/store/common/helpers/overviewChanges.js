@@ -0,0 +1,67 @@
+// Last overview per url, as {version, entries: {category: {id: entry}}}
+const overviews = {}
+
+/**
+ * Merges changes since previous.version (see OverviewCache.changes() in the backend)
+ * into the previous overview. Only changed entries are passed to processEntry.
+ *
+ * Returns {version, entries, result}, where result is the overview as returned
+ * from the backend without since_version, i.e. {category: [entry, ...]}
+ */
+export function mergeOverviewChanges(previous, changes, getId, processEntry) {
+    const entries = {}
+    const result = {}
+    for (let [category, { ids, changed }] of Object.entries(changes.categories)) {
+        const categoryEntries =
+            previous && !changes.full ? Object.assign({}, previous.entries[category]) : {}
+        for (let entry of changed) {
+            processEntry(entry)
+            categoryEntries[getId(entry)] = entry
+        }
+        entries[category] = {}
+        result[category] = ids.map((id) => {
+            entries[category][id] = categoryEntries[id]
+            return categoryEntries[id]
+        })
+    }
+    return { version: changes.version, entries, result }
+}
+
+/**
+ * Forgets all previous overviews, e.g. on logout.
+ */
+export function clearOverviewChanges() {
+    for (let url of Object.keys(overviews)) {
+        delete overviews[url]
+    }
+}
+
+function hasMissingEntries(result) {
+    return Object.values(result).some((entries) => entries.some((e) => e === undefined))
+}
+
+/**
+ * Fetches the overview at url, only transferring the changes since the last call.
+ * Sets response.result to the full overview.
+ *
+ * The version is an opaque token from the backend, bound to the overview for the user's group.
+ * If the merged overview still lacks some entries, the full overview is fetched instead.
+ */
+export default function getOverviewChanges(http, url, getId, processEntry) {
+    const previous = overviews[url]
+    const sinceVersion = previous ? encodeURIComponent(previous.version) : ''
+    return http.get(`${url}?since_version=${sinceVersion}`).then((response) => {
+        const merged = mergeOverviewChanges(previous, response.result, getId, processEntry)
+        if (previous && hasMissingEntries(merged.result)) {
+            delete overviews[url]
+            return getOverviewChanges(http, url, getId, processEntry)
+        }
+        if (merged.version === null) {
+            delete overviews[url]
+        } else {
+            overviews[url] = { version: merged.version, entries: merged.entries }
+        }
+        response.result = merged.result
+        return response
+    })
+}
@@ -0,0 +1,138 @@
+import getOverviewChanges, { clearOverviewChanges, mergeOverviewChanges } from './overviewChanges'
+
+const getId = (e) => e.id
+const processEntry = (e) => {
+    e.processed = true
+}
+
+describe('merges overview changes', function() {
+    it('full overview', function() {
+        const changes = {
+            version: 1,
+            full: true,
+            categories: {
+                not_started: { ids: [2, 1], changed: [{ id: 2 }, { id: 1 }] },
+                ongoing: { ids: [], changed: [] }
+            }
+        }
+        const merged = mergeOverviewChanges(undefined, changes, getId, processEntry)
+        expect(merged.version).toEqual(1)
+        expect(merged.result).toEqual({
+            not_started: [{ id: 2, processed: true }, { id: 1, processed: true }],
+            ongoing: []
+        })
+    })
+
+    it('changes since previous version', function() {
+        const previous = mergeOverviewChanges(
+            undefined,
+            {
+                version: 1,
+                full: true,
+                categories: {
+                    not_started: { ids: [2, 1], changed: [{ id: 2 }, { id: 1 }] },
+                    ongoing: { ids: [], changed: [] }
+                }
+            },
+            getId,
+            processEntry
+        )
+        const changes = {
+            version: 3,
+            full: false,
+            categories: {
+                not_started: { ids: [1], changed: [{ id: 1, priority: 3 }] },
+                ongoing: { ids: [2], changed: [{ id: 2, user_id: 1 }] }
+            }
+        }
+        const merged = mergeOverviewChanges(previous, changes, getId, processEntry)
+        expect(merged.version).toEqual(3)
+        expect(merged.result).toEqual({
+            not_started: [{ id: 1, priority: 3, processed: true }],
+            ongoing: [{ id: 2, user_id: 1, processed: true }]
+        })
+        expect(Object.keys(merged.entries.not_started)).toEqual(['1'])
+    })
+
+    it('unchanged entries are reused', function() {
+        const previous = mergeOverviewChanges(
+            undefined,
+            {
+                version: 1,
+                full: true,
+                categories: { not_started: { ids: [1], changed: [{ id: 1 }] } }
+            },
+            getId,
+            processEntry
+        )
+        const merged = mergeOverviewChanges(
+            previous,
+            { version: 1, full: false, categories: { not_started: { ids: [1], changed: [] } } },
+            getId,
+            processEntry
+        )
+        expect(merged.result.not_started[0]).toBe(previous.result.not_started[0])
+    })
+})
+
+describe('fetches overview changes', function() {
+    const full = {
+        version: 'a:1',
+        full: true,
+        categories: { not_started: { ids: [1], changed: [{ id: 1 }] } }
+    }
+
+    function mockHttp(responses) {
+        const http = {
+            urls: [],
+            get: (url) => {
+                http.urls.push(url)
+                return Promise.resolve({ result: responses.shift() })
+            }
+        }
+        return http
+    }
+
+    beforeEach(function() {
+        clearOverviewChanges()
+    })
+
+    it('sends previous version', async function() {
+        const http = mockHttp([
+            full,
+            { version: 'a:2', full: false, categories: { not_started: { ids: [1], changed: [] } } }
+        ])
+        await getOverviewChanges(http, 'overviews/', getId, processEntry)
+        const response = await getOverviewChanges(http, 'overviews/', getId, processEntry)
+        expect(http.urls).toEqual(['overviews/?since_version=', 'overviews/?since_version=a%3A1'])
+        expect(response.result).toEqual({ not_started: [{ id: 1, processed: true }] })
+    })
+
+    it('refetches full overview if entries are missing', async function() {
+        const http = mockHttp([
+            full,
+            { version: 'a:2', full: false, categories: { not_started: { ids: [2], changed: [] } } },
+            {
+                version: 'a:2',
+                full: true,
+                categories: { not_started: { ids: [2], changed: [{ id: 2 }] } }
+            }
+        ])
+        await getOverviewChanges(http, 'overviews/', getId, processEntry)
+        const response = await getOverviewChanges(http, 'overviews/', getId, processEntry)
+        expect(http.urls).toEqual([
+            'overviews/?since_version=',
+            'overviews/?since_version=a%3A1',
+            'overviews/?since_version='
+        ])
+        expect(response.result).toEqual({ not_started: [{ id: 2, processed: true }] })
+    })
+
+    it('forgets previous versions when cleared', async function() {
+        const http = mockHttp([full, full])
+        await getOverviewChanges(http, 'overviews/', getId, processEntry)
+        clearOverviewChanges()
+        await getOverviewChanges(http, 'overviews/', getId, processEntry)
+        expect(http.urls).toEqual(['overviews/?since_version=', 'overviews/?since_version='])
+    })
+})
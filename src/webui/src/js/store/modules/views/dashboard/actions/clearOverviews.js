@@ -0,0 +1,8 @@
+import { clearOverviewChanges } from '../../../../common/helpers/overviewChanges'
+
+// Overviews are cached per user group, don't reuse them for the next user
+function clearOverviews() {
+    clearOverviewChanges()
+}
+
+export default clearOverviews
@@ -2,6 +2,7 @@ import { set } from 'cerebral/operators'
 import { state } from 'cerebral/tags'
 import { wait } from 'cerebral/operators'
 import postLogout from '../actions/postLogout'
+import clearOverviews from '../actions/clearOverviews'
 import { redirect } from '../../../../common/factories/route'
 import toast from '../../../../common/factories/toast'
 import loadBroadcast from '../../../../common/sequences/loadBroadcast'
@@ -14,6 +15,7 @@ export default [
         success: [
             set(state`app.user`, null),
             set(state`app.config`, null), // Force config reload
+            clearOverviews,
             redirect('/login'),
             loadBroadcast
         ],
@@ -1,16 +1,14 @@
 import processAlleles from '../../../../common/helpers/processAlleles'
+import getOverviewChanges from '../../../../common/helpers/overviewChanges'
 
 function getOverviewAlleles({ state, http, path }) {
-    return http
-        .get('overviews/alleles/')
+    return getOverviewChanges(
+        http,
+        'overviews/alleles/',
+        (item) => item.allele.id,
+        (item) => processAlleles([item.allele], item.genepanel)
+    )
         .then((response) => {
-            let data = response.result
-            for (let key of ['marked_review', 'not_started', 'ongoing']) {
-                for (let item of data[key]) {
-                    processAlleles([item.allele], item.genepanel)
-                }
-            }
-
             response.result.ongoing_user = response.result.ongoing.filter((item) => {
                 return (
                     item.interpretations[item.interpretations.length - 1].user_id ===
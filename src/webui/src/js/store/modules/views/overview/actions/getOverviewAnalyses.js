@@ -1,23 +1,14 @@
 import processAnalyses from '../../../../common/helpers/processAnalyses'
+import getOverviewChanges from '../../../../common/helpers/overviewChanges'
 
 export default function getOverviewAnalyses({ http, props, path, state }) {
-    return http
-        .get('overviews/analyses/')
+    return getOverviewChanges(
+        http,
+        'overviews/analyses/',
+        (item) => item.id,
+        (item) => processAnalyses([item])
+    )
         .then((response) => {
-            const keys = [
-                'not_ready',
-                'not_started',
-                'ongoing',
-                'marked_review',
-                'marked_medicalreview'
-            ]
-
-            for (let key of keys) {
-                for (let item of response.result[key]) {
-                    processAnalyses([item])
-                }
-            }
-
             response.result.ongoing_user = response.result.ongoing.filter((item) => {
                 return (
                     item.interpretations[item.interpretations.length - 1].user_id ===